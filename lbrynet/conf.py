@@ -156,6 +156,21 @@ ADJUSTABLE_SETTINGS = {
     'api_host': (str, 'localhost'),
 
     'api_port': (int, 5279),
+    'blob_cache_size': (int, 10000),  # max number of blob objects kept in memory
+    # number of sub directory levels blob files are fanned out into (0 - 3), changing this
+    # moves existing blobs in the background on the next start
+    'blob_dir_levels': (int, 0),
+    # stored blobs are re-hashed in the background at up to this rate to catch corruption,
+    # 0 disables scrubbing
+    'blob_scrub_mb_per_second': (float, 1.0),
+    'blob_scrub_iops': (int, 20),
+    'blob_scrub_interval_days': (int, 30),  # how often each blob is re-verified
+    # blobs are evicted when they use more than this, 0 for no limit. Blobs of published
+    # streams are never evicted
+    'blob_storage_limit_mb': (int, 0),
+    # blobs of up to this many bytes, such as stream descriptors and the last blob of a
+    # stream, are appended to pack files instead of getting a file each, 0 disables packing
+    'blob_pack_max_size': (int, 256 * KB),
     'cache_time': (int, 150),
     'check_ui_requirements': (bool, True),
     'data_dir': (str, default_data_dir),
@@ -163,6 +178,9 @@ ADJUSTABLE_SETTINGS = {
     'default_ui_branch': (str, 'master'),
     'delete_blobs_on_remove': (bool, True),
     'dht_node_port': (int, 4444),
+    # keep the peers announced to the dht node in dht_data.db, so they are still known after
+    # a restart
+    'dht_persist_data_store': (bool, True),
     'download_directory': (str, default_download_directory),
     'download_timeout': (int, 180),
     'host_ui': (bool, True),
@@ -204,6 +222,10 @@ ADJUSTABLE_SETTINGS = {
     'search_servers': (list, ['lighthouse1.lbry.io:50005']),
     'search_timeout': (float, 5.0),
     'startup_scripts': (list, []),
+    # when blobs are only kept for the session (no blob_dir), completed blobs over this much
+    # memory are spilled to a temporary directory least recently used first, 0 for no limit
+    'temp_blob_memory_limit_mb': (int, 100),
+    'transfer_history_retention_days': (int, 30),
     'ui_branch': (str, 'master'),
     'use_auth_http': (bool, False),
     'use_upnp': (bool, True),
@@ -0,0 +1,97 @@
+import logging
+import weakref
+from collections import OrderedDict
+
+
+log = logging.getLogger(__name__)
+
+
+class BlobCache(object):
+    """A size bounded LRU cache of HashBlob objects
+
+    Blobs that have open readers or writers are never evicted. Blobs that were
+    evicted but are still referenced elsewhere (for example by a download
+    manager) are kept in a weak map, so that there is never more than one blob
+    object for a given hash.
+    """
+
+    def __init__(self, max_size):
+        assert max_size > 0
+        self.max_size = max_size
+        self._blobs = OrderedDict()
+        self._evicted = weakref.WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, blob_hash):
+        return blob_hash in self._blobs or blob_hash in self._evicted
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def __iter__(self):
+        return self._blobs.iterkeys()
+
+    def itervalues(self):
+        return self._blobs.itervalues()
+
+    def get(self, blob_hash):
+        """Return the blob for blob_hash, marking it as most recently used, or None"""
+        blob = self._blobs.pop(blob_hash, None)
+        if blob is None:
+            blob = self._evicted.pop(blob_hash, None)
+        if blob is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._blobs[blob_hash] = blob
+        self._evict()
+        return blob
+
+    def peek(self, blob_hash):
+        """Return the blob for blob_hash without marking it as used, or None"""
+        blob = self._blobs.get(blob_hash)
+        if blob is None:
+            blob = self._evicted.get(blob_hash)
+        return blob
+
+    def add(self, blob):
+        self._evicted.pop(blob.blob_hash, None)
+        self._blobs.pop(blob.blob_hash, None)
+        self._blobs[blob.blob_hash] = blob
+        self._evict()
+
+    def remove(self, blob_hash):
+        self._evicted.pop(blob_hash, None)
+        return self._blobs.pop(blob_hash, None)
+
+    def get_stats(self):
+        return {
+            'size': len(self._blobs),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    @staticmethod
+    def _is_in_use(blob):
+        return bool(blob.readers or blob.writers)
+
+    def _evict(self):
+        if len(self._blobs) <= self.max_size:
+            return
+        to_evict = len(self._blobs) - self.max_size
+        victims = []
+        for blob_hash, blob in self._blobs.iteritems():
+            if len(victims) == to_evict:
+                break
+            if not self._is_in_use(blob):
+                victims.append(blob_hash)
+        for blob_hash in victims:
+            self._evicted[blob_hash] = self._blobs.pop(blob_hash)
+        self.evictions += len(victims)
+        if len(victims) < to_evict:
+            log.debug("The blob cache is over its size limit by %i blobs that are in use",
+                      to_evict - len(victims))
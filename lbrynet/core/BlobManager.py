@@ -1,15 +1,27 @@
 import logging
 import os
+import shutil
+import tempfile
 import time
-import sqlite3
+from collections import OrderedDict
 
-from twisted.internet import threads, defer
+from twisted.internet import defer, threads
 from twisted.python.failure import Failure
-from twisted.enterprise import adbapi
+from twisted.python.threadpool import ThreadPool
+from lbrynet import conf
+from lbrynet.core.BlobCache import BlobCache
+from lbrynet.core.BlobPackStore import BlobPackStore
+from lbrynet.core.BlobScrubber import BlobScrubber
+from lbrynet.core.Database import open_database
+from lbrynet.core.blob_layout import BlobLayoutMigrator, get_blob_path, delete_blob_files
+from lbrynet.core.blob_layout import QUARANTINE_DIR_NAME, PACK_DIR_NAME
 from lbrynet.core.HashBlob import BlobFile, TempBlob, BlobFileCreator, TempBlobCreator
+from lbrynet.core.HashBlob import PackableBlobFile, PackableBlobFileCreator
+from lbrynet.core.TransferHistory import TransferHistory, UPLOAD, DOWNLOAD, get_hour
+from lbrynet.core.TransferHistory import SECONDS_PER_HOUR
 from lbrynet.core.server.DHTHashAnnouncer import DHTHashSupplier
 from lbrynet.core.Error import NoSuchBlobError
-from lbrynet.core.sqlite_helpers import rerun_if_locked
+from lbrynet.core.sqlite_helpers import rerun_if_locked, execute_in_batches
 
 
 log = logging.getLogger(__name__)
@@ -30,6 +42,12 @@ class BlobManager(DHTHashSupplier):
     def get_blob_creator(self):
         pass
 
+    def get_blob_cache_stats(self):
+        pass
+
+    def get_storage_stats(self):
+        pass
+
     def _make_new_blob(self, blob_hash, length):
         pass
 
@@ -63,10 +81,10 @@ class BlobManager(DHTHashSupplier):
     def get_all_verified_blobs(self):
         pass
 
-    def add_blob_to_download_history(self, blob_hash, host, rate):
+    def add_blob_to_download_history(self, blob_hash, host, rate, num_bytes=0):
         pass
 
-    def add_blob_to_upload_history(self, blob_hash, host, rate):
+    def add_blob_to_upload_history(self, blob_hash, host, rate, num_bytes=0):
         pass
 
     def _immediate_announce(self, blob_hashes):
@@ -79,57 +97,188 @@ class BlobManager(DHTHashSupplier):
 #       care what kind of Blob it has?
 class DiskBlobManager(BlobManager):
     """This class stores blobs on the hard disk"""
-    def __init__(self, hash_announcer, blob_dir, db_dir):
+    # blobs.db mutations are written behind, in one transaction per flush
+    DB_FLUSH_INTERVAL = 1
+    DB_FLUSH_BATCH_SIZE = 500
+    # when over the storage limit, blobs are evicted until this fraction of it is used
+    EVICTION_TARGET = 0.9
+    # seconds added to a blob's last use time for each upload and dht request for it, so
+    # blobs in demand are kept over blobs that were merely used more recently
+    EVICTION_DEMAND_WEIGHT = 60 * 60
+    # number of the most requested hashes to get from the dht node when evicting
+    EVICTION_POPULAR_HASHES = 1000
+    # blob files are deleted in batches of this size on the blob io thread
+    DELETE_BATCH_SIZE = 100
+    # seconds until deleting blobs that were in use is retried
+    DELETE_RETRY_DELAY = 5
+
+    def __init__(self, hash_announcer, blob_dir, db_dir, blob_cache_size=None,
+                 blob_dir_levels=None, transfer_history_retention_days=None,
+                 blob_scrub_mb_per_second=None, blob_storage_limit_mb=None,
+                 blob_pack_max_size=None):
         BlobManager.__init__(self, hash_announcer)
         self.blob_dir = blob_dir
+        if blob_dir_levels is None:
+            blob_dir_levels = conf.settings['blob_dir_levels']
+        self.blob_dir_levels = blob_dir_levels
+        self.layout_migrator = BlobLayoutMigrator(blob_dir, blob_dir_levels)
         self.db_file = os.path.join(db_dir, "blobs.db")
         self.db_conn = None
-        self.blob_type = BlobFile
-        self.blob_creator_type = BlobFileCreator
-        # TODO: consider using an LRU for blobs as there could potentially
-        #       be thousands of blobs loaded up, many stale
-        self.blobs = {}
-        self.blob_hashes_to_delete = {} # {blob_hash: being_deleted (True/False)}
-        self._next_manage_call = None
+        if blob_pack_max_size is None:
+            blob_pack_max_size = conf.settings['blob_pack_max_size']
+        if blob_pack_max_size > 0:
+            self.pack_store = BlobPackStore(os.path.join(blob_dir, PACK_DIR_NAME),
+                                            blob_pack_max_size)
+            self.blob_type = PackableBlobFile
+            self.blob_creator_type = PackableBlobFileCreator
+        else:
+            self.pack_store = None
+            self.blob_type = BlobFile
+            self.blob_creator_type = BlobFileCreator
+        if blob_cache_size is None:
+            blob_cache_size = conf.settings['blob_cache_size']
+        self.blobs = BlobCache(blob_cache_size)
+        # {blob_hash: blob_length} of every verified blob, loaded from the db in setup()
+        self._verified_blobs = {}
+        self._stored_bytes = 0
+        if blob_storage_limit_mb is None:
+            blob_storage_limit_mb = conf.settings['blob_storage_limit_mb']
+        self.storage_limit = blob_storage_limit_mb * 2 ** 20
+        # blobs of streams we published or pinned, which are never evicted
+        self._pinned_blobs = set()
+        self._blob_access_times = {}  # {blob_hash: timestamp}, since startup
+        self._eviction_deferred = None
+        # blob files waiting to be deleted, in the order they were deleted in
+        self._blob_hashes_to_delete = OrderedDict()
+        self._blob_hashes_in_use_to_delete = set()
+        self._deletion_deferred = None
+        self._deletion_waiters = []
+        self._next_deletion_retry = None
+        # a single thread for deleting blob files, so large deletions don't hold up the
+        # reactor thread pool
+        self._io_pool = ThreadPool(1, 1, 'blob_io')
+        if transfer_history_retention_days is None:
+            transfer_history_retention_days = conf.settings['transfer_history_retention_days']
+        self.transfer_history = TransferHistory(transfer_history_retention_days * 24 * 60 * 60)
+        self.quarantine_dir = os.path.join(blob_dir, QUARANTINE_DIR_NAME)
+        if blob_scrub_mb_per_second is None:
+            blob_scrub_mb_per_second = conf.settings['blob_scrub_mb_per_second']
+        if blob_scrub_mb_per_second > 0:
+            self.scrubber = BlobScrubber(self, blob_scrub_mb_per_second,
+                                         conf.settings['blob_scrub_iops'],
+                                         conf.settings['blob_scrub_interval_days'] * 24 * 60 * 60)
+        else:
+            self.scrubber = None
+        # pending blobs.db mutations
+        self._completed_blobs_to_add = {}  # {blob_hash: (blob_length, next_announce_time)}
+        self._blob_hashes_to_remove = set()
+        self._blob_verified_times = {}  # {blob_hash: last_verified_time}
+        self._next_db_flush_call = None
+        self._db_flush_queued = False
+        # serializes writes to blobs.db
+        self._db_write_lock = defer.DeferredLock()
 
     def setup(self):
         log.info("Setting up the DiskBlobManager. blob_dir: %s, db_file: %s", str(self.blob_dir),
                  str(self.db_file))
         d = self._open_db()
-        d.addCallback(lambda _: self._manage())
+        if self.pack_store is not None:
+            d.addCallback(lambda _: threads.deferToThread(self.pack_store.load))
+        d.addCallback(lambda _: self._load_verified_blobs())
+        d.addCallback(lambda _: self._load_pinned_blobs())
+        d.addCallback(lambda _: self.layout_migrator.start())
+        d.addCallback(lambda _: self._io_pool.start())
+        if self.scrubber is not None:
+            d.addCallback(lambda _: self.scrubber.start())
+        d.addCallback(lambda _: self._check_storage_limit())
         return d
 
     def stop(self):
         log.info("Stopping the DiskBlobManager")
-        if self._next_manage_call is not None and self._next_manage_call.active():
-            self._next_manage_call.cancel()
-            self._next_manage_call = None
-        self.db_conn = None
-        return defer.succeed(True)
+        if self._next_deletion_retry is not None and self._next_deletion_retry.active():
+            self._next_deletion_retry.cancel()
+        self._next_deletion_retry = None
+
+        def close_db(_):
+            db_conn, self.db_conn = self.db_conn, None
+            if db_conn is not None:
+                return db_conn.close()
+
+        ds = []
+        if self.scrubber is not None:
+            ds.append(self.scrubber.stop())
+        if self._eviction_deferred is not None:
+            ds.append(self._eviction_deferred)
+        if self._deletion_deferred is not None:
+            ds.append(self._deletion_deferred)
+        d = defer.DeferredList(ds)
+        d.addCallback(lambda _: self._io_pool.stop())
+        if self.pack_store is not None:
+            d.addCallback(lambda _: self.pack_store.close())
+        d.addCallback(lambda _: self._flush_db())
+        d.addErrback(lambda err: log.error("Failed to flush blobs.db: %s", err.getTraceback()))
+        d.addCallback(close_db)
+        d.addCallback(lambda _: self.layout_migrator.stop())
+        return d
 
     def get_blob(self, blob_hash, length=None):
         """Return a blob identified by blob_hash, which may be a new blob or a
         blob that is already on the hard disk
         """
         assert length is None or isinstance(length, int)
-        if blob_hash in self.blobs:
-            return defer.succeed(self.blobs[blob_hash])
+        if blob_hash in self._verified_blobs:
+            self._blob_access_times[blob_hash] = time.time()
+        blob = self.blobs.get(blob_hash)
+        if blob is not None:
+            return defer.succeed(blob)
         return self._make_new_blob(blob_hash, length)
 
     def get_blob_creator(self):
-        return self.blob_creator_type(self, self.blob_dir)
+        if self.pack_store is not None:
+            return self.blob_creator_type(self, self.blob_dir, self.blob_dir_levels,
+                                          pack_store=self.pack_store)
+        return self.blob_creator_type(self, self.blob_dir, self.blob_dir_levels)
+
+    def get_blob_cache_stats(self):
+        return self.blobs.get_stats()
+
+    def get_storage_stats(self):
+        stats = {
+            'blobs': len(self._verified_blobs),
+            'bytes': self._stored_bytes,
+            'limit': self.storage_limit,
+            'pinned_blobs': len(self._pinned_blobs),
+        }
+        if self.pack_store is not None:
+            stats['packs'] = self.pack_store.get_stats()
+        return stats
+
+    def _new_blob(self, blob_hash, length, verified):
+        if self.pack_store is not None:
+            return self.blob_type(self.blob_dir, blob_hash, length, verified=verified,
+                                  dir_levels=self.blob_dir_levels, pack_store=self.pack_store)
+        return self.blob_type(self.blob_dir, blob_hash, length, verified=verified,
+                              dir_levels=self.blob_dir_levels)
 
     def _make_new_blob(self, blob_hash, length=None):
         log.debug('Making a new blob for %s', blob_hash)
-        blob = self.blob_type(self.blob_dir, blob_hash, length)
-        self.blobs[blob_hash] = blob
+        self.layout_migrator.migrate_blob(blob_hash)
+        verified_length = self._verified_blobs.get(blob_hash)
+        if verified_length is not None:
+            blob = self._new_blob(blob_hash, verified_length, True)
+        else:
+            blob = self._new_blob(blob_hash, length, False)
+        self.blobs.add(blob)
         return defer.succeed(blob)
 
     def blob_completed(self, blob, next_announce_time=None):
         if next_announce_time is None:
             next_announce_time = self.get_next_announce_time()
+        self._add_to_index(blob.blob_hash, blob.length)
+        self._blob_access_times[blob.blob_hash] = time.time()
         d = self._add_completed_blob(blob.blob_hash, blob.length, next_announce_time)
         d.addCallback(lambda _: self._immediate_announce([blob.blob_hash]))
+        d.addCallback(lambda r: self._check_storage_limit() or r)
         return d
 
     def completed_blobs(self, blobhashes_to_check):
@@ -143,17 +292,51 @@ class DiskBlobManager(BlobManager):
         assert blob_creator.blob_hash is not None
         assert blob_creator.blob_hash not in self.blobs
         assert blob_creator.length is not None
-        new_blob = self.blob_type(self.blob_dir, blob_creator.blob_hash, blob_creator.length)
-        self.blobs[blob_creator.blob_hash] = new_blob
+        new_blob = self._new_blob(blob_creator.blob_hash, blob_creator.length, True)
+        self.blobs.add(new_blob)
+        # blobs we create belong to streams we publish
+        self.pin_blobs([blob_creator.blob_hash])
         self._immediate_announce([blob_creator.blob_hash])
         next_announce_time = self.get_next_announce_time()
         d = self.blob_completed(new_blob, next_announce_time)
         return d
 
     def delete_blobs(self, blob_hashes):
+        """Stop announcing blobs and delete them
+
+        The blobs are removed from blobs.db with the next batch of writes and their files
+        are deleted in the background. They stay verified until their files are deleted,
+        so other lbry files of the same stream can still use them until then.
+
+        @return: a deferred that fires once the files have been deleted, blobs that are
+            being read or written are deleted later
+        """
+        self.unpin_blobs(blob_hashes)
         for blob_hash in blob_hashes:
-            if not blob_hash in self.blob_hashes_to_delete:
-                self.blob_hashes_to_delete[blob_hash] = False
+            self._blob_hashes_to_delete[blob_hash] = True
+        self._delete_blobs_from_db(blob_hashes)
+        d = defer.Deferred()
+        self._deletion_waiters.append(d)
+        self._start_deletion()
+        return d
+
+    def pin_blobs(self, blob_hashes):
+        """Never evict these blobs to stay under the storage limit"""
+        blob_hashes = [b for b in blob_hashes if b not in self._pinned_blobs]
+        if not blob_hashes:
+            return defer.succeed(True)
+        self._pinned_blobs.update(blob_hashes)
+        return self._db_write_lock.run(self._save_pinned_blobs, blob_hashes, True)
+
+    def unpin_blobs(self, blob_hashes):
+        blob_hashes = [b for b in blob_hashes if b in self._pinned_blobs]
+        if not blob_hashes:
+            return defer.succeed(True)
+        self._pinned_blobs.difference_update(blob_hashes)
+        return self._db_write_lock.run(self._save_pinned_blobs, blob_hashes, False)
+
+    def is_pinned(self, blob_hash):
+        return blob_hash in self._pinned_blobs
 
     def immediate_announce_all_blobs(self):
         d = self._get_all_verified_blob_hashes()
@@ -165,75 +348,307 @@ class DiskBlobManager(BlobManager):
         d.addCallback(self.completed_blobs)
         return d
 
-    def add_blob_to_download_history(self, blob_hash, host, rate):
-        d = self._add_blob_to_download_history(blob_hash, host, rate)
+    def add_blob_to_download_history(self, blob_hash, host, rate, num_bytes=0):
+        self.transfer_history.add(DOWNLOAD, blob_hash, host, rate, num_bytes)
+        self._schedule_db_flush()
+        return defer.succeed(True)
+
+    def add_blob_to_upload_history(self, blob_hash, host, rate, num_bytes=0):
+        if blob_hash in self._verified_blobs:
+            self._blob_access_times[blob_hash] = time.time()
+        self.transfer_history.add(UPLOAD, blob_hash, host, rate, num_bytes)
+        self._schedule_db_flush()
+        return defer.succeed(True)
+
+    def get_blobs_to_scrub(self, verified_before, limit):
+        """Get the verified blobs which were least recently verified, and not since a timestamp
+
+        @return: deferred that fires with a list of (blob_hash, blob_length)
+        """
+        d = self._flush_db()
+        d.addCallback(lambda _: self._get_blobs_to_scrub(verified_before, limit))
+        d.addCallback(lambda blobs: [(b, l) for b, l in blobs if b in self._verified_blobs])
         return d
 
-    def add_blob_to_upload_history(self, blob_hash, host, rate):
-        d = self._add_blob_to_upload_history(blob_hash, host, rate)
+    def is_packed(self, blob_hash):
+        return self.pack_store is not None and blob_hash in self.pack_store
+
+    def get_blob_file_path(self, blob_hash):
+        """Return the path of a verified blob's file, or None if it is unknown, packed or
+        being written"""
+        if blob_hash not in self._verified_blobs or self.is_packed(blob_hash):
+            return None
+        blob = self.blobs.peek(blob_hash)
+        if blob is not None and blob.writers:
+            return None
+        self.layout_migrator.migrate_blob(blob_hash)
+        return get_blob_path(self.blob_dir, blob_hash, self.blob_dir_levels)
+
+    def blob_verified(self, blob_hash, timestamp=None):
+        """Record that a stored blob was re-hashed and is intact"""
+        self._blob_verified_times[blob_hash] = timestamp or time.time()
+        self._schedule_db_flush()
+
+    def quarantine_blob(self, blob_hash):
+        """Stop serving and announcing a blob that failed verification
+
+        Its file is moved into the quarantine directory and it is removed from blobs.db,
+        so it can be downloaded again.
+        """
+        if blob_hash not in self._verified_blobs:
+            return defer.succeed(False)
+        self._remove_from_index(blob_hash)
+        self._delete_blobs_from_db([blob_hash])
+        d = self.get_blob(blob_hash)
+        d.addCallback(lambda blob: blob.quarantine(self.quarantine_dir))
+        d.addErrback(lambda err: log.error("Failed to quarantine blob %s: %s", blob_hash,
+                                           err.getErrorMessage()))
         return d
 
-    def _manage(self):
-        from twisted.internet import reactor
+    def get_top_blobs(self, direction=UPLOAD, since=None, limit=10):
+        """Get the blobs transferred the most since a timestamp
 
-        d = self._delete_blobs_marked_for_deletion()
+        @return: deferred that fires with a list of (blob_hash, transfers, bytes)
+        """
+        d = self._flush_db()
+        d.addCallback(lambda _: self._get_top_blobs(direction, since or 0, limit))
+        return d
 
-        def set_next_manage_call():
-            self._next_manage_call = reactor.callLater(1, self._manage)
+    def get_bytes_per_host(self, direction=UPLOAD, since=None):
+        """Get the number of bytes transferred to or from each host since a timestamp
 
-        d.addCallback(lambda _: set_next_manage_call())
+        @return: deferred that fires with a list of (host, transfers, bytes)
+        """
+        d = self._flush_db()
+        d.addCallback(lambda _: self._get_bytes_per_host(direction, since or 0))
+        return d
 
-    def _delete_blobs_marked_for_deletion(self):
+    def _add_to_index(self, blob_hash, length):
+        self._remove_from_index(blob_hash)
+        # it was completed again since it was deleted
+        self._blob_hashes_to_delete.pop(blob_hash, None)
+        self._blob_hashes_in_use_to_delete.discard(blob_hash)
+        self._verified_blobs[blob_hash] = length
+        self._stored_bytes += length or 0
+
+    def _remove_from_index(self, blob_hash):
+        if blob_hash in self._verified_blobs:
+            self._stored_bytes -= self._verified_blobs.pop(blob_hash) or 0
+        self._blob_access_times.pop(blob_hash, None)
+
+    def _check_storage_limit(self):
+        if not self.storage_limit or self._eviction_deferred is not None:
+            return
+        if self._stored_bytes <= self.storage_limit:
+            return
+
+        def clear_eviction(result):
+            self._eviction_deferred = None
+            return result
+
+        self._eviction_deferred = self._evict_blobs()
+        self._eviction_deferred.addErrback(
+            lambda err: log.error("Failed to evict blobs: %s", err.getTraceback()))
+        self._eviction_deferred.addBoth(clear_eviction)
+
+    def _get_dht_request_counts(self):
+        dht_node = getattr(self.hash_announcer, 'dht_node', None)
+        if dht_node is None:
+            return {}
+        popular_hashes = dht_node.get_most_popular_hashes(self.EVICTION_POPULAR_HASHES)
+        return {blob_hash.encode('hex'): count for blob_hash, count in popular_hashes}
+
+    def _choose_blobs_to_evict(self, candidates, num_bytes):
+        """Choose the least valuable blobs totalling at least num_bytes
+
+        @param candidates: list of (blob_hash, last_upload_time, uploads)
+        """
+        request_counts = self._get_dht_request_counts()
+        scored = []
+        for blob_hash, last_upload_time, uploads in candidates:
+            if blob_hash not in self._verified_blobs or blob_hash in self._pinned_blobs:
+                continue
+            blob = self.blobs.peek(blob_hash)
+            if blob is not None and (blob.readers or blob.writers):
+                continue
+            last_used = max(last_upload_time, self._blob_access_times.get(blob_hash, 0))
+            demand = uploads + request_counts.get(blob_hash, 0)
+            scored.append((last_used + demand * self.EVICTION_DEMAND_WEIGHT, blob_hash))
+        scored.sort()
+        to_evict = []
+        for _, blob_hash in scored:
+            if num_bytes <= 0:
+                break
+            to_evict.append(blob_hash)
+            num_bytes -= self._verified_blobs[blob_hash] or 0
+        return to_evict
 
-        def remove_from_list(b_h):
-            del self.blob_hashes_to_delete[b_h]
-            return b_h
+    @defer.inlineCallbacks
+    def _evict_blobs(self):
+        yield self._flush_db()
+        candidates = yield self._get_eviction_candidates()
+        excess = self._stored_bytes - int(self.storage_limit * self.EVICTION_TARGET)
+        to_evict = self._choose_blobs_to_evict(candidates, excess)
+        evicted_bytes = sum(self._verified_blobs[b] or 0 for b in to_evict)
+        if evicted_bytes < excess:
+            log.warning("Can't get under the storage limit of %i bytes, %i bytes are used by "
+                        "pinned blobs or blobs in use", self.storage_limit,
+                        self._stored_bytes - evicted_bytes)
+        if not to_evict:
+            defer.returnValue([])
+        log.info("Evicting %i blobs (%i bytes) to stay under the storage limit",
+                 len(to_evict), evicted_bytes)
+        # stop announcing the blobs and remove their rows in a single transaction, the
+        # files are deleted in the background
+        d = self.delete_blobs(to_evict)
+        yield self._flush_db()
+        yield d
+        defer.returnValue(to_evict)
+
+    def _start_deletion(self):
+        if self._deletion_deferred is not None:
+            return
+        if not self._blob_hashes_to_delete:
+            self._deletion_finished(None)
+            return
+        self._deletion_deferred = self._delete_pending_blob_files()
+        self._deletion_deferred.addErrback(
+            lambda err: log.error("Failed to delete blobs: %s", err.getTraceback()))
+        self._deletion_deferred.addBoth(self._deletion_finished)
+
+    def _deletion_finished(self, result):
+        from twisted.internet import reactor
 
-        def set_not_deleting(err, b_h):
-            log.warning("Failed to delete blob %s. Reason: %s", str(b_h), err.getErrorMessage())
-            self.blob_hashes_to_delete[b_h] = False
-            return err
+        self._deletion_deferred = None
+        waiters, self._deletion_waiters = self._deletion_waiters, []
+        for d in waiters:
+            d.callback(True)
+        if self._blob_hashes_in_use_to_delete and self._next_deletion_retry is None:
+            self._next_deletion_retry = reactor.callLater(self.DELETE_RETRY_DELAY,
+                                                          self._retry_deleting_blobs_in_use)
+        return result
+
+    def _retry_deleting_blobs_in_use(self):
+        self._next_deletion_retry = None
+        for blob_hash in self._blob_hashes_in_use_to_delete:
+            self._blob_hashes_to_delete[blob_hash] = True
+        self._blob_hashes_in_use_to_delete.clear()
+        self._start_deletion()
+
+    def _take_blob_files_to_delete(self):
+        """Take the next batch of blobs to delete
+
+        @return: the paths of their files and the hashes of the packed blobs among them
+        """
+        paths = []
+        packed_blob_hashes = []
+        while (self._blob_hashes_to_delete and
+               len(paths) + len(packed_blob_hashes) < self.DELETE_BATCH_SIZE):
+            blob_hash, _ = self._blob_hashes_to_delete.popitem(last=False)
+            blob = self.blobs.peek(blob_hash)
+            if blob is not None:
+                if blob.readers or blob.writers:
+                    self._blob_hashes_in_use_to_delete.add(blob_hash)
+                    continue
+                blob.mark_deleted()
+            self._remove_from_index(blob_hash)
+            if self.is_packed(blob_hash):
+                packed_blob_hashes.append(blob_hash)
+                continue
+            self.layout_migrator.migrate_blob(blob_hash)
+            paths.append(get_blob_path(self.blob_dir, blob_hash, self.blob_dir_levels))
+        return paths, packed_blob_hashes
 
-        def delete_from_db(result):
-            b_hs = [r[1] for r in result if r[0] is True]
-            if b_hs:
-                d = self._delete_blobs_from_db(b_hs)
-            else:
-                d = defer.succeed(True)
+    @defer.inlineCallbacks
+    def _delete_pending_blob_files(self):
+        from twisted.internet import reactor
 
-            def log_error(err):
-                log.warning(
-                    "Failed to delete completed blobs from the db: %s", err.getErrorMessage())
+        while self._blob_hashes_to_delete:
+            paths, packed_blob_hashes = self._take_blob_files_to_delete()
+            if packed_blob_hashes:
+                yield threads.deferToThreadPool(reactor, self._io_pool, self.pack_store.remove,
+                                                packed_blob_hashes)
+                log.debug("Removed %i packed blobs", len(packed_blob_hashes))
+            if paths:
+                failed = yield threads.deferToThreadPool(reactor, self._io_pool,
+                                                         delete_blob_files, paths)
+                for path, err in failed:
+                    log.warning("Failed to delete blob file %s: %s", path, err)
+                log.debug("Deleted %i blob files", len(paths) - len(failed))
+        if self.pack_store is not None and self.pack_store.get_packs_to_compact():
+            yield threads.deferToThreadPool(reactor, self._io_pool, self.pack_store.compact)
 
-            d.addErrback(log_error)
-            return d
+    ######### database calls #########
 
-        def delete(blob, b_h):
-            d = blob.delete()
-            d.addCallbacks(lambda _: remove_from_list(b_h), set_not_deleting, errbackArgs=(b_h,))
-            return d
+    def _schedule_db_flush(self):
+        from twisted.internet import reactor
 
-        ds = []
-        for blob_hash, being_deleted in self.blob_hashes_to_delete.items():
-            if being_deleted is False:
-                self.blob_hashes_to_delete[blob_hash] = True
-                d = self.get_blob(blob_hash)
-                d.addCallbacks(
-                    delete, set_not_deleting,
-                    callbackArgs=(blob_hash,), errbackArgs=(blob_hash,))
-                ds.append(d)
-        dl = defer.DeferredList(ds, consumeErrors=True)
-        dl.addCallback(delete_from_db)
-        return defer.DeferredList(ds)
+        pending = (len(self._completed_blobs_to_add) + len(self._blob_hashes_to_remove) +
+                   len(self._blob_verified_times) + len(self.transfer_history))
+        if pending >= self.DB_FLUSH_BATCH_SIZE:
+            self._queue_db_flush()
+        elif self._next_db_flush_call is None:
+            self._next_db_flush_call = reactor.callLater(self.DB_FLUSH_INTERVAL,
+                                                         self._queue_db_flush)
+
+    def _queue_db_flush(self):
+        if not self._db_flush_queued:
+            self._db_flush_queued = True
+            self._db_write_lock.run(self._write_pending_db_mutations)
+
+    def _flush_db(self):
+        """Write all pending mutations, the deferred fires once they are committed"""
+        return self._db_write_lock.run(self._write_pending_db_mutations)
+
+    def _take_pending_db_mutations(self):
+        if self._next_db_flush_call is not None:
+            if self._next_db_flush_call.active():
+                self._next_db_flush_call.cancel()
+            self._next_db_flush_call = None
+        to_add, self._completed_blobs_to_add = self._completed_blobs_to_add, {}
+        to_remove, self._blob_hashes_to_remove = self._blob_hashes_to_remove, set()
+        verified, self._blob_verified_times = self._blob_verified_times, {}
+        history = self.transfer_history.take_pending()
+        return to_add, to_remove, verified, history
+
+    def _write_pending_db_mutations(self):
+        self._db_flush_queued = False
+        to_add, to_remove, verified, history = self._take_pending_db_mutations()
+        if not to_add and not to_remove and not verified and not history:
+            return defer.succeed(True)
+        log.debug("Writing %i added blobs, %i removed blobs, %i verified blobs and %i transfer "
+                  "history rollups to the db", len(to_add), len(to_remove), len(verified),
+                  len(history))
+        d = self._write_db_mutations(to_add, to_remove, verified, history)
+        d.addErrback(lambda err: log.error("Failed to write blob changes to the db: %s",
+                                           err.getErrorMessage()))
+        return d
 
-    ######### database calls #########
+    def _apply_db_mutations(self, transaction, to_add, to_remove, verified, history):
+        if to_remove:
+            execute_in_batches(transaction, "delete from blobs where blob_hash in ({})",
+                               to_remove)
+        if to_add:
+            # completed blobs were hashed as they were written
+            now = time.time()
+            transaction.executemany(
+                "insert or ignore into blobs " +
+                "(blob_hash, blob_length, last_verified_time, next_announce_time) " +
+                "values (?, ?, ?, ?)",
+                [(b, length, now, t) for b, (length, t) in to_add.iteritems()])
+        if verified:
+            transaction.executemany(
+                "update blobs set last_verified_time = ? where blob_hash = ?",
+                [(t, b) for b, t in verified.iteritems()])
+        self.transfer_history.write(transaction, history)
+
+    @rerun_if_locked
+    def _write_db_mutations(self, to_add, to_remove, verified, history):
+        return self.db_conn.runInteraction(self._apply_db_mutations, to_add, to_remove, verified,
+                                           history)
 
     def _open_db(self):
-        # check_same_thread=False is solely to quiet a spurious error that appears to be due
-        # to a bug in twisted, where the connection is closed by a different thread than the
-        # one that opened it. The individual connections in the pool are not used in multiple
-        # threads.
-        self.db_conn = adbapi.ConnectionPool('sqlite3', self.db_file, check_same_thread=False)
+        self.db_conn = open_database(self.db_file)
 
         def create_tables(transaction):
             transaction.execute("create table if not exists blobs (" +
@@ -241,54 +656,43 @@ class DiskBlobManager(BlobManager):
                                 "    blob_length integer, " +
                                 "    last_verified_time real, " +
                                 "    next_announce_time real)")
+            transaction.execute("create index if not exists blobs_last_verified_time_idx " +
+                                "on blobs (last_verified_time)")
+            transaction.execute("create table if not exists pinned_blobs (" +
+                                "    blob_hash text primary key)")
 
-            transaction.execute("create table if not exists download (" +
-                                "    id integer primary key autoincrement, " +
-                                "    blob text, " +
-                                "    host text, " +
-                                "    rate float, " +
-                                "    ts integer)")
-
-            transaction.execute("create table if not exists upload (" +
-                                "    id integer primary key autoincrement, " +
-                                "    blob text, " +
-                                "    host text, " +
-                                "    rate float, " +
-                                "    ts integer)")
+            TransferHistory.create_tables(transaction)
 
         return self.db_conn.runInteraction(create_tables)
 
-    @rerun_if_locked
     def _add_completed_blob(self, blob_hash, length, next_announce_time):
         log.debug("Adding a completed blob. blob_hash=%s, length=%s", blob_hash, str(length))
-        d = self.db_conn.runQuery(
-            "insert into blobs (blob_hash, blob_length, next_announce_time) values (?, ?, ?)",
-            (blob_hash, length, next_announce_time)
-        )
-        d.addErrback(lambda err: err.trap(sqlite3.IntegrityError))
-        return d
+        self._blob_hashes_to_remove.discard(blob_hash)
+        self._completed_blobs_to_add[blob_hash] = (length, next_announce_time)
+        self._schedule_db_flush()
+        return defer.succeed(True)
 
-    @defer.inlineCallbacks
     def _completed_blobs(self, blobhashes_to_check):
         """Returns of the blobhashes_to_check, which are valid"""
-        blobs = yield defer.DeferredList([self.get_blob(b) for b in blobhashes_to_check])
-        blob_hashes = [b.blob_hash for success, b in blobs if success and b.verified]
-        defer.returnValue(blob_hashes)
+        blob_hashes = [b for b in blobhashes_to_check if b in self._verified_blobs]
+        return defer.succeed(blob_hashes)
 
-    @rerun_if_locked
-    def _update_blob_verified_timestamp(self, blob, timestamp):
-        return self.db_conn.runQuery("update blobs set last_verified_time = ? where blob_hash = ?",
-                                     (blob, timestamp))
+    def _get_blobs_to_announce(self):
+        def get_and_update():
+            return self._get_and_update_blobs_to_announce(*self._take_pending_db_mutations())
+
+        return self._db_write_lock.run(get_and_update)
 
     @rerun_if_locked
-    def _get_blobs_to_announce(self):
+    def _get_and_update_blobs_to_announce(self, to_add, to_remove, verified, history):
 
         def get_and_update(transaction):
+            self._apply_db_mutations(transaction, to_add, to_remove, verified, history)
             timestamp = time.time()
             r = transaction.execute("select blob_hash from blobs " +
                                     "where next_announce_time < ? and blob_hash is not null",
                                     (timestamp,))
-            blobs = [b for b, in r.fetchall()]
+            blobs = [b for b, in r.fetchall() if b in self._verified_blobs]
             next_announce_time = self.get_next_announce_time(len(blobs))
             transaction.execute(
                 "update blobs set next_announce_time = ? where next_announce_time < ?",
@@ -299,53 +703,98 @@ class DiskBlobManager(BlobManager):
 
         return self.db_conn.runInteraction(get_and_update)
 
-    @rerun_if_locked
     def _delete_blobs_from_db(self, blob_hashes):
+        for blob_hash in blob_hashes:
+            self._completed_blobs_to_add.pop(blob_hash, None)
+            self._blob_hashes_to_remove.add(blob_hash)
+        self._schedule_db_flush()
+        return defer.succeed(True)
 
-        def delete_blobs(transaction):
-            for b in blob_hashes:
-                transaction.execute("delete from blobs where blob_hash = ?", (b,))
-
-        return self.db_conn.runInteraction(delete_blobs)
-
-    @rerun_if_locked
     def _get_all_verified_blob_hashes(self):
-        d = self.db_conn.runQuery("select blob_hash from blobs")
+        return defer.succeed(self._verified_blobs.keys())
 
-        def get_verified_blobs(blobs):
-            verified_blobs = []
-            for blob_hash, in blobs:
-                file_path = os.path.join(self.blob_dir, blob_hash)
-                if os.path.isfile(file_path):
-                    verified_blobs.append(blob_hash)
-            return verified_blobs
-
-        d.addCallback(lambda blobs: threads.deferToThread(get_verified_blobs, blobs))
+    @rerun_if_locked
+    def _load_verified_blobs(self):
+        d = self.db_conn.runQuery("select blob_hash, blob_length from blobs")
+
+        def load_verified_blobs(blobs):
+            self._verified_blobs = {}
+            self._stored_bytes = 0
+            for blob_hash, blob_length in blobs:
+                if blob_hash is not None:
+                    self._add_to_index(blob_hash, blob_length)
+            log.info("Loaded %i verified blobs from %s", len(self._verified_blobs), self.db_file)
+
+        d.addCallback(load_verified_blobs)
         return d
 
     @rerun_if_locked
-    def _add_blob_to_download_history(self, blob_hash, host, rate):
-        ts = int(time.time())
-        d = self.db_conn.runQuery(
-            "insert into download values (null, ?, ?, ?, ?) ",
-            (blob_hash, str(host), float(rate), ts))
+    def _load_pinned_blobs(self):
+        d = self.db_conn.runQuery("select blob_hash from pinned_blobs")
+        d.addCallback(lambda blobs: self._pinned_blobs.update(b for b, in blobs))
         return d
 
     @rerun_if_locked
-    def _add_blob_to_upload_history(self, blob_hash, host, rate):
-        ts = int(time.time())
+    def _save_pinned_blobs(self, blob_hashes, pinned):
+        if pinned:
+            query = "insert or ignore into pinned_blobs values (?)"
+        else:
+            query = "delete from pinned_blobs where blob_hash = ?"
+        return self.db_conn.runInteraction(
+            lambda transaction: transaction.executemany(query, [(b,) for b in blob_hashes]))
+
+    @rerun_if_locked
+    def _get_eviction_candidates(self):
         d = self.db_conn.runQuery(
-            "insert into upload values (null, ?, ?, ?, ?) ",
-            (blob_hash, str(host), float(rate), ts))
+            "select blobs.blob_hash, max(h.hour), sum(h.transfers) from blobs " +
+            "left join transfer_history h " +
+            "    on h.direction = ? and h.blob_hash = blobs.blob_hash " +
+            "group by blobs.blob_hash",
+            (UPLOAD,))
+        d.addCallback(lambda rows: [
+            (blob_hash, (hour or 0) * SECONDS_PER_HOUR, uploads or 0)
+            for blob_hash, hour, uploads in rows
+        ])
         return d
 
+    @rerun_if_locked
+    def _get_blobs_to_scrub(self, verified_before, limit):
+        # blobs that were never verified have a null last_verified_time, which sorts first
+        return self.db_conn.runQuery(
+            "select blob_hash, blob_length from blobs " +
+            "where last_verified_time is null or last_verified_time < ? " +
+            "order by last_verified_time limit ?",
+            (verified_before, limit))
+
+    @rerun_if_locked
+    def _get_top_blobs(self, direction, since, limit):
+        return self.db_conn.runQuery(
+            "select blob_hash, sum(transfers), sum(bytes) from transfer_history " +
+            "where direction = ? and hour >= ? group by blob_hash " +
+            "order by sum(transfers) desc, sum(bytes) desc limit ?",
+            (direction, get_hour(since), limit))
+
+    @rerun_if_locked
+    def _get_bytes_per_host(self, direction, since):
+        return self.db_conn.runQuery(
+            "select host, sum(transfers), sum(bytes) from transfer_history " +
+            "where direction = ? and hour >= ? group by host order by sum(bytes) desc, host",
+            (direction, get_hour(since)))
+
 
 # TODO: Having different managers for different blobs breaks the
 #       abstraction of a HashBlob. Why should the management of blobs
 #       care what kind of Blob it has?
 class TempBlobManager(BlobManager):
-    """This class stores blobs in memory"""
-    def __init__(self, hash_announcer):
+    """This class stores blobs in memory
+
+    Once the completed blobs use more than memory_limit bytes, the least recently used
+    ones are spilled to files in a temporary directory, which is removed on stop().
+    """
+    def __init__(self, hash_announcer, memory_limit=None):
+        """
+        @param memory_limit: bytes of completed blobs to keep in memory, 0 for no limit
+        """
         BlobManager.__init__(self, hash_announcer)
         self.blob_type = TempBlob
         self.blob_creator_type = TempBlobCreator
@@ -353,6 +802,16 @@ class TempBlobManager(BlobManager):
         self.blob_next_announces = {}
         self.blob_hashes_to_delete = {}  # {blob_hash: being_deleted (True/False)}
         self._next_manage_call = None
+        if memory_limit is None:
+            memory_limit = conf.settings['temp_blob_memory_limit_mb'] * 2 ** 20
+        self.memory_limit = memory_limit
+        # {blob_hash: blob_length} of completed blobs, least recently used first
+        self._blobs_in_memory = OrderedDict()
+        self._spilled_blobs = {}  # {blob_hash: blob_length}
+        self.bytes_in_memory = 0
+        self.bytes_spilled = 0
+        self.spill_dir = None
+        self._spill_deferred = None
 
     def setup(self):
         self._manage()
@@ -362,8 +821,13 @@ class TempBlobManager(BlobManager):
         if self._next_manage_call is not None and self._next_manage_call.active():
             self._next_manage_call.cancel()
             self._next_manage_call = None
+        d = self._spill_deferred or defer.succeed(True)
+        d.addBoth(lambda _: self._remove_spill_dir())
+        return d
 
     def get_blob(self, blob_hash, length=None):
+        if blob_hash in self._blobs_in_memory:
+            self._blobs_in_memory[blob_hash] = self._blobs_in_memory.pop(blob_hash)
         if blob_hash in self.blobs:
             return defer.succeed(self.blobs[blob_hash])
         return self._make_new_blob(blob_hash, length)
@@ -371,6 +835,15 @@ class TempBlobManager(BlobManager):
     def get_blob_creator(self):
         return self.blob_creator_type(self)
 
+    def get_storage_stats(self):
+        return {
+            'blobs_in_memory': len(self._blobs_in_memory),
+            'bytes_in_memory': self.bytes_in_memory,
+            'blobs_spilled': len(self._spilled_blobs),
+            'bytes_spilled': self.bytes_spilled,
+            'memory_limit': self.memory_limit,
+        }
+
     def _make_new_blob(self, blob_hash, length=None):
         blob = self.blob_type(blob_hash, length)
         self.blobs[blob_hash] = blob
@@ -380,6 +853,10 @@ class TempBlobManager(BlobManager):
         if next_announce_time is None:
             next_announce_time = time.time()
         self.blob_next_announces[blob.blob_hash] = next_announce_time
+        if blob.spill_path is None and blob.blob_hash not in self._blobs_in_memory:
+            self._blobs_in_memory[blob.blob_hash] = blob.length or 0
+            self.bytes_in_memory += blob.length or 0
+            self._check_memory_limit()
         return defer.succeed(True)
 
     def completed_blobs(self, blobhashes_to_check):
@@ -441,10 +918,59 @@ class TempBlobManager(BlobManager):
 
         d.addCallback(lambda _: set_next_manage_call())
 
+    def _check_memory_limit(self):
+        if not self.memory_limit or self._spill_deferred is not None:
+            return
+        if self.bytes_in_memory <= self.memory_limit:
+            return
+
+        def clear_spill(result):
+            self._spill_deferred = None
+            return result
+
+        self._spill_deferred = self._spill_blobs()
+        self._spill_deferred.addErrback(
+            lambda err: log.error("Failed to spill blobs: %s", err.getTraceback()))
+        self._spill_deferred.addBoth(clear_spill)
+
+    @defer.inlineCallbacks
+    def _spill_blobs(self):
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='lbrynet_blobs_')
+        while self.bytes_in_memory > self.memory_limit and self._blobs_in_memory:
+            blob_hash, length = self._blobs_in_memory.popitem(last=False)
+            self.bytes_in_memory -= length
+            blob = self.blobs.get(blob_hash)
+            if blob is None or not blob.is_validated() or not length:
+                continue
+            try:
+                spilled = yield blob.spill(self.spill_dir)
+            except Exception:
+                self._blobs_in_memory[blob_hash] = length
+                self.bytes_in_memory += length
+                raise
+            if spilled:
+                self._spilled_blobs[blob_hash] = length
+                self.bytes_spilled += length
+        log.debug("%i bytes of blobs in memory, %i bytes spilled to %s", self.bytes_in_memory,
+                  self.bytes_spilled, self.spill_dir)
+
+    def _forget_blob(self, blob_hash):
+        if blob_hash in self._blobs_in_memory:
+            self.bytes_in_memory -= self._blobs_in_memory.pop(blob_hash)
+        if blob_hash in self._spilled_blobs:
+            self.bytes_spilled -= self._spilled_blobs.pop(blob_hash)
+
+    def _remove_spill_dir(self):
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+
     def _delete_blobs_marked_for_deletion(self):
-        def remove_from_list(b_h):
+        def remove_from_list(_, b_h):
             del self.blob_hashes_to_delete[b_h]
-            log.info("Deleted blob %s", blob_hash)
+            self._forget_blob(b_h)
+            log.info("Deleted blob %s", b_h)
             return b_h
 
         def set_not_deleting(err, b_h):
@@ -461,13 +987,15 @@ class TempBlobManager(BlobManager):
                     blob = self.blobs[blob_hash]
                     d = blob.delete()
 
-                    d.addCallbacks(lambda _: remove_from_list(blob_hash), set_not_deleting,
-                                   errbackArgs=(blob_hash,))
+                    # spilled blobs are deleted in a thread, so the callbacks run after
+                    # the loop is done
+                    d.addCallbacks(remove_from_list, set_not_deleting,
+                                   callbackArgs=(blob_hash,), errbackArgs=(blob_hash,))
 
                     ds.append(d)
                 else:
-                    remove_from_list(blob_hash)
+                    remove_from_list(None, blob_hash)
                     d = defer.fail(Failure(NoSuchBlobError(blob_hash)))
-                    log.warning("Blob %s cannot be deleted because it is unknown")
+                    log.warning("Blob %s cannot be deleted because it is unknown", blob_hash)
                     ds.append(d)
         return defer.DeferredList(ds)
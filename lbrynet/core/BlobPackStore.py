@@ -0,0 +1,247 @@
+import logging
+import os
+import threading
+
+from lbrynet.core.blob_layout import ensure_dir_exists, delete_blob_files
+from lbrynet.core.cryptoutils import get_lbry_hash_obj
+from lbrynet.core.utils import is_valid_blobhash
+
+
+log = logging.getLogger(__name__)
+
+PACK_FILE_EXTENSION = '.pack'
+INDEX_FILE_EXTENSION = '.idx'
+
+
+class BlobPackStore(object):
+    """Stores small blobs, such as stream descriptors and the last blobs of streams,
+    appended to a few large pack files instead of in a file each
+
+    Every pack file has an append only index file next to it with a line per blob added
+    to the pack ("<blob_hash> <offset> <length>") and per blob removed from it
+    ("<blob_hash> -"). The index is loaded into memory by load(). Packs where most of the
+    bytes belong to removed blobs are compacted by moving their remaining blobs into the
+    current pack and deleting them.
+
+    All methods other than the lookups may do file I/O and should be called from a
+    thread, they are serialized with a lock.
+    """
+
+    MAX_PACK_SIZE = 64 * 2 ** 20
+    # packs with less than this fraction of their bytes in use are compacted
+    COMPACTION_THRESHOLD = 0.5
+
+    def __init__(self, pack_dir, max_blob_size):
+        """
+        @param pack_dir: directory the pack and index files are kept in
+
+        @param max_blob_size: blobs of up to this many bytes are packed
+        """
+        self.pack_dir = pack_dir
+        self.max_blob_size = max_blob_size
+        self._index = {}  # {blob_hash: (pack_id, offset, length)}
+        self._pack_sizes = {}  # {pack_id: size of the pack file}
+        self._live_bytes = {}  # {pack_id: bytes used by blobs in the index}
+        self._current_pack = None
+        self._current_pack_file = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, blob_hash):
+        return blob_hash in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def should_pack(self, length):
+        return length is not None and 0 < length <= self.max_blob_size
+
+    def get_length(self, blob_hash):
+        entry = self._index.get(blob_hash)
+        if entry is not None:
+            return entry[2]
+        return None
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'blobs': len(self._index),
+                'packs': len(self._pack_sizes),
+                'bytes': sum(self._pack_sizes.itervalues()),
+                'live_bytes': sum(self._live_bytes.itervalues()),
+            }
+
+    def get_path(self, pack_id, extension=PACK_FILE_EXTENSION):
+        return os.path.join(self.pack_dir, "%06i%s" % (pack_id, extension))
+
+    def load(self):
+        """Read the index files, packs without blobs left in them are deleted"""
+        with self._lock:
+            self._close_current_pack()
+            self._index = {}
+            self._pack_sizes = {}
+            self._live_bytes = {}
+            ensure_dir_exists(self.pack_dir)
+            pack_ids = []
+            for file_name in os.listdir(self.pack_dir):
+                name, extension = os.path.splitext(file_name)
+                if extension == PACK_FILE_EXTENSION and name.isdigit():
+                    pack_ids.append(int(name))
+            # compaction moves blobs to a newer pack, so later entries win
+            for pack_id in sorted(pack_ids):
+                self._pack_sizes[pack_id] = os.path.getsize(self.get_path(pack_id))
+                self._live_bytes[pack_id] = 0
+                self._load_index_file(pack_id)
+            for pack_id, offset, length in self._index.itervalues():
+                self._live_bytes[pack_id] += length
+            if pack_ids:
+                last_pack = max(pack_ids)
+                if self._pack_sizes[last_pack] < self.MAX_PACK_SIZE:
+                    self._current_pack = last_pack
+            for pack_id in pack_ids:
+                if not self._live_bytes[pack_id] and pack_id != self._current_pack:
+                    self._delete_pack(pack_id)
+            log.info("Loaded %i packed blobs from %i packs in %s", len(self._index),
+                     len(self._pack_sizes), self.pack_dir)
+
+    def add(self, blob_hash, data):
+        with self._lock:
+            if blob_hash not in self._index:
+                self._append(blob_hash, data)
+
+    def read(self, blob_hash):
+        """Return the contents of a packed blob, or None if it isn't packed"""
+        with self._lock:
+            entry = self._index.get(blob_hash)
+            if entry is None:
+                return None
+            return self._read(*entry)
+
+    def hash_blob(self, blob_hash):
+        """Return the hash and length of a packed blob, or (None, 0) if it isn't packed"""
+        data = self.read(blob_hash)
+        if data is None:
+            return None, 0
+        hashsum = get_lbry_hash_obj()
+        hashsum.update(data)
+        return hashsum.hexdigest(), len(data)
+
+    def remove(self, blob_hashes):
+        with self._lock:
+            removed = {}  # {pack_id: [blob_hash]}
+            for blob_hash in blob_hashes:
+                entry = self._index.pop(blob_hash, None)
+                if entry is not None:
+                    removed.setdefault(entry[0], []).append(blob_hash)
+                    self._live_bytes[entry[0]] -= entry[2]
+            for pack_id, pack_blob_hashes in removed.iteritems():
+                if not self._live_bytes[pack_id] and pack_id != self._current_pack:
+                    self._delete_pack(pack_id)
+                else:
+                    self._write_index_lines(
+                        pack_id, ["%s -\n" % blob_hash for blob_hash in pack_blob_hashes])
+
+    def get_packs_to_compact(self):
+        with self._lock:
+            return [
+                pack_id for pack_id, size in self._pack_sizes.iteritems()
+                if pack_id != self._current_pack and
+                self._live_bytes[pack_id] < size * self.COMPACTION_THRESHOLD
+            ]
+
+    def compact(self):
+        """Move the blobs out of packs that are mostly unused and delete the packs
+
+        The lock is only held while moving one blob, so reads aren't held up for long.
+
+        @return: the number of bytes freed
+        """
+        freed = 0
+        for pack_id in self.get_packs_to_compact():
+            with self._lock:
+                blob_hashes = [b for b, entry in self._index.iteritems() if entry[0] == pack_id]
+            for blob_hash in blob_hashes:
+                with self._lock:
+                    entry = self._index.get(blob_hash)
+                    if entry is None or entry[0] != pack_id:
+                        continue
+                    data = self._read(*entry)
+                    self._live_bytes[pack_id] -= entry[2]
+                    self._append(blob_hash, data)
+            with self._lock:
+                if pack_id in self._pack_sizes and not self._live_bytes[pack_id]:
+                    freed += self._pack_sizes[pack_id]
+                    self._delete_pack(pack_id)
+        if freed:
+            log.info("Compacted blob packs, freed %i bytes", freed)
+        return freed
+
+    def close(self):
+        with self._lock:
+            self._close_current_pack()
+
+    def _load_index_file(self, pack_id):
+        index_path = self.get_path(pack_id, INDEX_FILE_EXTENSION)
+        if not os.path.isfile(index_path):
+            return
+        with open(index_path, 'rb') as index_file:
+            for line in index_file:
+                parts = line.split()
+                if not line.endswith('\n') or not parts or not is_valid_blobhash(parts[0]):
+                    # the last line may have been cut off by a crash
+                    continue
+                if len(parts) == 2 and parts[1] == '-':
+                    self._index.pop(parts[0], None)
+                elif len(parts) == 3 and parts[1].isdigit() and parts[2].isdigit():
+                    offset, length = int(parts[1]), int(parts[2])
+                    # the data is written before the index line, but may not have made
+                    # it to the disk
+                    if offset + length <= self._pack_sizes[pack_id]:
+                        self._index[parts[0]] = (pack_id, offset, length)
+
+    def _read(self, pack_id, offset, length):
+        with open(self.get_path(pack_id), 'rb') as pack_file:
+            pack_file.seek(offset)
+            data = pack_file.read(length)
+        if len(data) != length:
+            raise IOError("Pack %i ended before blob at offset %i" % (pack_id, offset))
+        return data
+
+    def _append(self, blob_hash, data):
+        if self._current_pack is not None:
+            if self._pack_sizes[self._current_pack] + len(data) > self.MAX_PACK_SIZE:
+                self._close_current_pack()
+                self._current_pack = None
+        if self._current_pack is None:
+            self._current_pack = max(self._pack_sizes) + 1 if self._pack_sizes else 0
+            self._pack_sizes[self._current_pack] = 0
+            self._live_bytes[self._current_pack] = 0
+        if self._current_pack_file is None:
+            ensure_dir_exists(self.pack_dir)
+            self._current_pack_file = open(self.get_path(self._current_pack), 'ab')
+        pack_id = self._current_pack
+        offset = self._pack_sizes[pack_id]
+        self._current_pack_file.write(data)
+        self._current_pack_file.flush()
+        self._pack_sizes[pack_id] += len(data)
+        self._write_index_lines(pack_id, ["%s %i %i\n" % (blob_hash, offset, len(data))])
+        self._index[blob_hash] = (pack_id, offset, len(data))
+        self._live_bytes[pack_id] += len(data)
+
+    def _write_index_lines(self, pack_id, lines):
+        with open(self.get_path(pack_id, INDEX_FILE_EXTENSION), 'ab') as index_file:
+            index_file.write(''.join(lines))
+
+    def _close_current_pack(self):
+        if self._current_pack_file is not None:
+            self._current_pack_file.close()
+            self._current_pack_file = None
+
+    def _delete_pack(self, pack_id):
+        if pack_id == self._current_pack:
+            self._close_current_pack()
+            self._current_pack = None
+        del self._pack_sizes[pack_id]
+        del self._live_bytes[pack_id]
+        paths = [self.get_path(pack_id), self.get_path(pack_id, INDEX_FILE_EXTENSION)]
+        for path, err in delete_blob_files(paths):
+            log.warning("Failed to delete blob pack file %s: %s", path, err)
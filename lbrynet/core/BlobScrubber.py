@@ -0,0 +1,155 @@
+import logging
+import os
+import time
+
+from twisted.internet import defer, threads
+from lbrynet.core.cryptoutils import get_lbry_hash_obj
+
+
+log = logging.getLogger(__name__)
+
+MB = 2 ** 20
+
+
+def hash_blob_file(path, read_size):
+    """Return the hash and length of a blob file, or (None, 0) if it doesn't exist"""
+    if not os.path.isfile(path):
+        return None, 0
+    hashsum = get_lbry_hash_obj()
+    length = 0
+    with open(path, 'rb') as blob_file:
+        while True:
+            data = blob_file.read(read_size)
+            if not data:
+                break
+            hashsum.update(data)
+            length += len(data)
+    return hashsum.hexdigest(), length
+
+
+class BlobScrubber(object):
+    """Re-hashes stored blobs in the background to catch blobs that were corrupted on disk
+
+    Blobs are checked least recently verified first, one at a time in the reactor
+    thread pool. The time between two blobs is chosen so that on average at most
+    max_mb_per_second and max_iops are spent on scrubbing. Blobs that check out have
+    their last_verified_time updated, blobs that don't are quarantined by the blob
+    manager, which stops announcing them so that they can be downloaded again.
+    """
+
+    START_DELAY = 60
+    # seconds to wait before looking for more blobs when none are due to be verified
+    IDLE_DELAY = 60 * 60
+    BATCH_SIZE = 100
+    READ_SIZE = 2 ** 16
+
+    def __init__(self, blob_manager, max_mb_per_second, max_iops, verify_interval):
+        """
+        @param blob_manager: the DiskBlobManager whose blobs are scrubbed
+
+        @param max_mb_per_second: average read budget, in MB per second
+
+        @param max_iops: average number of READ_SIZE reads per second
+
+        @param verify_interval: seconds after which a blob is due to be verified again
+        """
+        assert max_mb_per_second > 0 and max_iops > 0
+        self.blob_manager = blob_manager
+        self.max_bytes_per_second = max_mb_per_second * MB
+        self.max_iops = max_iops
+        self.verify_interval = verify_interval
+        self.blobs_verified = 0
+        self.blobs_quarantined = 0
+        self.bytes_read = 0
+        self._blobs_to_scrub = []  # [(blob_hash, blob_length)], least recently verified last
+        self._next_scrub_call = None
+        self._scrub_deferred = None
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self._schedule_scrub(self.START_DELAY)
+
+    def stop(self):
+        """Stop scrubbing, the deferred fires once the blob being hashed is finished"""
+        self._running = False
+        if self._next_scrub_call is not None and self._next_scrub_call.active():
+            self._next_scrub_call.cancel()
+        self._next_scrub_call = None
+        if self._scrub_deferred is not None:
+            return self._scrub_deferred
+        return defer.succeed(True)
+
+    def get_stats(self):
+        return {
+            'blobs_verified': self.blobs_verified,
+            'blobs_quarantined': self.blobs_quarantined,
+            'bytes_read': self.bytes_read,
+        }
+
+    def get_delay(self, num_bytes):
+        """Seconds to wait after reading num_bytes to stay within the I/O budget"""
+        num_reads = max(1, -(-num_bytes // self.READ_SIZE))
+        return max(float(num_bytes) / self.max_bytes_per_second,
+                   float(num_reads) / self.max_iops)
+
+    def _schedule_scrub(self, delay):
+        from twisted.internet import reactor
+
+        if self._running:
+            self._next_scrub_call = reactor.callLater(delay, self._scrub)
+
+    def _scrub(self):
+        self._next_scrub_call = None
+        self._scrub_deferred = self._scrub_next_blob()
+        self._scrub_deferred.addErrback(self._log_scrub_error)
+        self._scrub_deferred.addCallback(self._scrub_finished)
+
+    def _log_scrub_error(self, err):
+        log.error("Failed to scrub a blob: %s", err.getTraceback())
+        return 0
+
+    def _scrub_finished(self, num_bytes):
+        self._scrub_deferred = None
+        if num_bytes is None:
+            self._schedule_scrub(self.IDLE_DELAY)
+        else:
+            self._schedule_scrub(self.get_delay(num_bytes))
+
+    @defer.inlineCallbacks
+    def _scrub_next_blob(self):
+        """Verify the next blob due for verification
+
+        @return: a deferred that fires with the number of bytes read, or None if no
+            blobs are due to be verified
+        """
+        if not self._blobs_to_scrub:
+            blobs = yield self.blob_manager.get_blobs_to_scrub(
+                time.time() - self.verify_interval, self.BATCH_SIZE)
+            self._blobs_to_scrub = list(reversed(blobs))
+            if not self._blobs_to_scrub:
+                defer.returnValue(None)
+        blob_hash, blob_length = self._blobs_to_scrub.pop()
+        if self.blob_manager.is_packed(blob_hash):
+            path = self.blob_manager.pack_store.pack_dir
+            blob_file_hash, file_length = yield threads.deferToThread(
+                self.blob_manager.pack_store.hash_blob, blob_hash)
+        else:
+            path = self.blob_manager.get_blob_file_path(blob_hash)
+            if path is None:
+                # deleted or in use since the batch was selected, it will come up again
+                defer.returnValue(0)
+            blob_file_hash, file_length = yield threads.deferToThread(
+                hash_blob_file, path, self.READ_SIZE)
+        self.bytes_read += file_length
+        if blob_file_hash == blob_hash and blob_length in (None, file_length):
+            self.blobs_verified += 1
+            self.blob_manager.blob_verified(blob_hash)
+        else:
+            if blob_file_hash is None:
+                log.warning("Blob %s is missing from %s", blob_hash, path)
+            else:
+                log.warning("Blob %s failed verification, quarantining it", blob_hash)
+            self.blobs_quarantined += 1
+            yield self.blob_manager.quarantine_blob(blob_hash)
+        defer.returnValue(file_length)
@@ -0,0 +1,264 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from twisted.internet import defer
+from twisted.internet import threads
+from twisted.python.threadpool import ThreadPool
+
+
+log = logging.getLogger(__name__)
+
+# {path: Database} of the open databases, shared by everything that uses the same file
+_databases = {}
+
+
+def open_database(path):
+    """Get the Database for a sqlite file
+
+    The same Database is returned for every caller that opens a file, so they all share its
+    writer thread. It is closed once every caller has closed it.
+    """
+    path = os.path.abspath(path)
+    database = _databases.get(path)
+    if database is None:
+        database = Database(path)
+        _databases[path] = database
+    database.open()
+    return database
+
+
+def get_database_stats():
+    return {
+        os.path.basename(path): database.get_stats()
+        for path, database in _databases.iteritems()
+    }
+
+
+class QueryMetrics(object):
+    """Per statement latency, recorded from the database threads"""
+
+    # lists of placeholders, such as the ones from execute_in_batches, are counted as one
+    PLACEHOLDER_LIST = re.compile(r"\?(\s*,\s*\?)+")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queries = {}  # {query: [count, total_seconds, max_seconds]}
+
+    def record(self, query, seconds):
+        query = self.PLACEHOLDER_LIST.sub("?, ...", " ".join(query.split()))
+        with self._lock:
+            metrics = self._queries.get(query)
+            if metrics is None:
+                self._queries[query] = [1, seconds, seconds]
+            else:
+                metrics[0] += 1
+                metrics[1] += seconds
+                metrics[2] = max(metrics[2], seconds)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                query: {
+                    'count': count,
+                    'avg_ms': 1000.0 * total / count,
+                    'max_ms': 1000.0 * max_seconds,
+                }
+                for query, (count, total, max_seconds) in self._queries.iteritems()
+            }
+
+
+class TimedCursor(object):
+    """A sqlite3 cursor which records how long each statement takes"""
+
+    def __init__(self, cursor, metrics):
+        self._cursor = cursor
+        self._metrics = metrics
+
+    def execute(self, query, params=()):
+        start = time.time()
+        self._cursor.execute(query, params)
+        self._metrics.record(query, time.time() - start)
+        return self
+
+    def executemany(self, query, seq_of_params):
+        start = time.time()
+        self._cursor.executemany(query, seq_of_params)
+        self._metrics.record(query, time.time() - start)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class Database(object):
+    """A sqlite database with a single writer thread and a pool of reader threads
+
+    Writes (runOperation, runInteraction and runQuery with anything but a select) are
+    queued for the writer thread, so they never compete for the database lock, and selects
+    run in parallel on the readers. The database is in WAL mode, so reads don't block the
+    writer and the writer doesn't block reads. Every thread keeps its connection open, so
+    statements are prepared once per thread and then reused from sqlite3's statement cache.
+
+    Implements the parts of twisted.enterprise.adbapi.ConnectionPool used by the blob,
+    stream and claim managers. Use open_database() to get one.
+    """
+
+    READ_THREADS = 3
+    CACHED_STATEMENTS = 256
+    # seconds to wait for locks held by other processes, such as scripts or migrations
+    BUSY_TIMEOUT = 30
+    # how long writes waited for the writer thread is recorded under this name
+    WRITE_QUEUE = "(write queue)"
+
+    def __init__(self, path, read_threads=None):
+        self.path = path
+        self.metrics = QueryMetrics()
+        name = os.path.basename(path)
+        self._writer = ThreadPool(1, 1, 'db_writer:' + name)
+        self._readers = ThreadPool(1, read_threads or self.READ_THREADS, 'db_reader:' + name)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._users = 0
+        self._pending_writes = 0
+        self._shutdown_trigger = None
+        self._closed = False
+
+    def open(self):
+        from twisted.internet import reactor
+
+        if self._users == 0:
+            self._set_wal_mode()
+            self._writer.start()
+            self._readers.start()
+            self._shutdown_trigger = reactor.addSystemEventTrigger('during', 'shutdown',
+                                                                   self._stop)
+            self._closed = False
+        self._users += 1
+
+    def close(self):
+        """Release the database, it is closed once everyone that opened it has closed it"""
+        from twisted.internet import reactor
+
+        if self._users == 0:
+            return
+        self._users -= 1
+        if self._users == 0:
+            reactor.removeSystemEventTrigger(self._shutdown_trigger)
+            self._shutdown_trigger = None
+            self._stop()
+
+    def get_stats(self):
+        return {
+            'pending_writes': self._pending_writes,
+            'queries': self.metrics.get_stats(),
+        }
+
+    def runQuery(self, query, params=()):
+        if query.lstrip()[:6].lower() == 'select':
+            return self._run_read(self._query, query, params)
+        return self._run_write(self._write_query, query, params)
+
+    def runOperation(self, query, params=()):
+        return self._run_write(self._operation, query, params)
+
+    def runInteraction(self, interaction, *args, **kwargs):
+        return self._run_write(interaction, *args, **kwargs)
+
+    def _run_read(self, func, *args):
+        from twisted.internet import reactor
+
+        if self._closed:
+            return self._fail_closed()
+        return threads.deferToThreadPool(reactor, self._readers, func, *args)
+
+    def _run_write(self, interaction, *args, **kwargs):
+        from twisted.internet import reactor
+
+        def write_finished(result):
+            self._pending_writes -= 1
+            return result
+
+        if self._closed:
+            return self._fail_closed()
+        self._pending_writes += 1
+        d = threads.deferToThreadPool(reactor, self._writer, self._transaction, time.time(),
+                                      interaction, *args, **kwargs)
+        d.addBoth(write_finished)
+        return d
+
+    def _fail_closed(self):
+        # the thread pools are stopped, queued work would never run
+        return defer.fail(sqlite3.ProgrammingError("%s has been closed" % self.path))
+
+    def _query(self, query, params):
+        cursor = TimedCursor(self._get_connection().cursor(), self.metrics)
+        return cursor.execute(query, params).fetchall()
+
+    @staticmethod
+    def _write_query(transaction, query, params):
+        return transaction.execute(query, params).fetchall()
+
+    @staticmethod
+    def _operation(transaction, query, params):
+        transaction.execute(query, params)
+
+    def _transaction(self, queued_at, interaction, *args, **kwargs):
+        self.metrics.record(self.WRITE_QUEUE, time.time() - queued_at)
+        connection = self._get_connection()
+        transaction = TimedCursor(connection.cursor(), self.metrics)
+        try:
+            result = interaction(transaction, *args, **kwargs)
+            connection.commit()
+            return result
+        except:
+            connection.rollback()
+            raise
+        finally:
+            transaction.close()
+
+    def _get_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # connections are only used by the thread that opened them, but they are closed
+            # from the reactor thread by _stop()
+            connection = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT,
+                                         cached_statements=self.CACHED_STATEMENTS,
+                                         check_same_thread=False)
+            # safe from corruption in WAL mode, only the last transactions can be lost if
+            # the machine loses power
+            connection.execute("pragma synchronous = normal")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def _set_wal_mode(self):
+        connection = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT)
+        try:
+            mode, = connection.execute("pragma journal_mode = wal").fetchone()
+            if mode.lower() != 'wal':
+                log.warning("Could not put %s in WAL mode, it is in %s mode", self.path, mode)
+        except sqlite3.Error as err:
+            log.warning("Could not put %s in WAL mode: %s", self.path, err)
+        finally:
+            connection.close()
+
+    def _stop(self):
+        self._closed = True
+        # the thread pools finish the work queued before they stop
+        self._writer.stop()
+        self._readers.stop()
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        if _databases.get(self.path) is self:
+            del _databases[self.path]
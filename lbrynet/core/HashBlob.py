@@ -1,14 +1,15 @@
 from StringIO import StringIO
+import io
 import logging
+import mmap
 import os
 import tempfile
 import threading
 import shutil
-from twisted.internet import interfaces, defer, threads
-from twisted.protocols.basic import FileSender
+from twisted.internet import defer, threads
 from twisted.python.failure import Failure
-from zope.interface import implements
 from lbrynet import conf
+from lbrynet.core.blob_layout import get_blob_dir, ensure_dir_exists, delete_blob_files
 from lbrynet.core.Error import DownloadCanceledError, InvalidDataError
 from lbrynet.core.cryptoutils import get_lbry_hash_obj
 from lbrynet.core.utils import is_valid_blobhash
@@ -17,66 +18,202 @@ from lbrynet.core.utils import is_valid_blobhash
 log = logging.getLogger(__name__)
 
 
-class HashBlobReader(object):
-    implements(interfaces.IConsumer)
+class BlobReadMap(object):
+    """Read only view of the contents of a verified blob
 
-    def __init__(self, write_func):
-        self.write_func = write_func
+    For blob files the contents are memory mapped. slice() returns read only buffers into
+    the contents which can be hashed or decrypted without copying them, they must not be
+    used after close() has been called.
+    """
 
-    def registerProducer(self, producer, streaming):
+    def __init__(self, data, close_func=None):
+        self._data = data
+        self._close_func = close_func
+        self.length = len(data)
 
-        from twisted.internet import reactor
+    def __len__(self):
+        return self.length
 
-        self.producer = producer
-        self.streaming = streaming
-        if self.streaming is False:
-            reactor.callLater(0, self.producer.resumeProducing)
+    def slice(self, start=0, end=None):
+        assert self._data is not None, "Tried to read from a closed blob map"
+        if end is None or end > self.length:
+            end = self.length
+        return buffer(self._data, start, max(0, end - start))
 
-    def unregisterProducer(self):
-        pass
+    def iter_slices(self, size):
+        for start in xrange(0, self.length, size):
+            yield self.slice(start, start + size)
 
-    def write(self, data):
+    def close(self):
+        if self._data is None:
+            return
+        self._data = None
+        if self._close_func is not None:
+            self._close_func()
+
+
+def map_blob_file(file_handle, close_func):
+    """Memory map an open blob file, return a BlobReadMap or None if it can't be mapped
+
+    close_func is called with file_handle when the map is closed, or right away if the
+    file can't be mapped.
+    """
+    try:
+        if os.fstat(file_handle.fileno()).st_size:
+            data = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # empty files can't be mapped
+            data = ''
+    except (EnvironmentError, ValueError):
+        log.exception('Failed to map %s', file_handle.name)
+        close_func(file_handle)
+        return None
+
+    def close_map():
+        if isinstance(data, mmap.mmap):
+            data.close()
+        close_func(file_handle)
 
-        from twisted.internet import reactor
+    return BlobReadMap(data, close_map)
 
-        self.write_func(data)
-        if self.streaming is False:
-            reactor.callLater(0, self.producer.resumeProducing)
+
+class BlobMapSender(object):
+    """Writes a memory mapped blob to a consumer in a few large chunks
+
+    A drop in replacement for FileSender for verified blobs, it doesn't need a reactor
+    iteration for every chunk of the blob.
+    """
+
+    CHUNK_SIZE = 2 ** 20
+
+    def __init__(self):
+        self.stopped = False
+
+    def beginFileTransfer(self, blob_map, consumer, transform=None):
+        for chunk in blob_map.iter_slices(self.CHUNK_SIZE):
+            if self.stopped:
+                return defer.fail(Exception("Consumer asked us to stop producing"))
+            # transports only take strings, so this is the one copy of the data
+            data = chunk[:]
+            if transform is not None:
+                data = transform(data)
+            if data:
+                consumer.write(data)
+        return defer.succeed(blob_map.length)
+
+    def stopProducing(self):
+        self.stopped = True
 
 
 class HashBlobWriter(object):
+    """Hashes and writes the data of a blob being received in a worker thread
+
+    Data is handed to the worker in the order it was written, whatever arrived while the
+    worker was busy is processed in one go. finished_cb is called in the reactor thread
+    once all the data has been processed, or when the write fails or is canceled, but
+    never while the worker is still using write_handle.
+    """
+
+    # bytes waiting to be hashed and written before write() asks the caller to slow down
+    MAX_BUFFER_SIZE = 2 ** 20
+
     def __init__(self, write_handle, length_getter, finished_cb):
         self.write_handle = write_handle
         self.length_getter = length_getter
         self.finished_cb = finished_cb
         self._hashsum = get_lbry_hash_obj()
         self.len_so_far = 0
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._processing = False
+        self._drained_deferred = None
+        self._finished = False
+        self._finish_reason = None
 
     @property
     def blob_hash(self):
         return self._hashsum.hexdigest()
 
     def write(self, data):
-        self._hashsum.update(data)
+        """Queue data to be hashed and written
+
+        @return: None, or a Deferred if more than MAX_BUFFER_SIZE bytes are waiting to be
+            processed, which fires once they have been and more data can be written
+        """
+        if self._finished:
+            return None
         self.len_so_far += len(data)
         if self.len_so_far > self.length_getter():
-            self.finished_cb(
-                self,
+            self._finish(
                 Failure(InvalidDataError("Length so far is greater than the expected length."
                                          " %s to %s" % (self.len_so_far,
                                                         self.length_getter()))))
-        else:
-            if self.write_handle is None:
-                log.debug("Tried to write to a write_handle that was None.")
-                return
-            self.write_handle.write(data)
-            if self.len_so_far == self.length_getter():
-                self.finished_cb(self)
+            return None
+        self._buffer.append(data)
+        self._buffered_bytes += len(data)
+        self._process_buffer()
+        if self._buffered_bytes > self.MAX_BUFFER_SIZE:
+            if self._drained_deferred is None:
+                self._drained_deferred = defer.Deferred()
+            return self._drained_deferred
+        return None
 
     def cancel(self, reason=None):
         if reason is None:
             reason = Failure(DownloadCanceledError())
-        self.finished_cb(self, reason)
+        self._finish(reason)
+
+    def _hash_and_write(self, chunks):
+        for data in chunks:
+            self._hashsum.update(data)
+            if self.write_handle is None:
+                log.debug("Tried to write to a write_handle that was None.")
+                continue
+            self.write_handle.write(data)
+
+    def _process_buffer(self):
+        if self._processing or not self._buffer:
+            return
+        chunks, self._buffer = self._buffer, []
+        self._processing = True
+        d = threads.deferToThread(self._hash_and_write, chunks)
+        d.addCallbacks(self._chunks_processed, self._processing_failed,
+                       callbackArgs=(sum(len(data) for data in chunks),))
+
+    def _chunks_processed(self, _, num_bytes):
+        self._processing = False
+        self._buffered_bytes -= num_bytes
+        if self._finished:
+            # canceled or failed while the worker was busy
+            self.finished_cb(self, self._finish_reason)
+            return
+        if self._buffer:
+            self._process_buffer()
+        elif self.len_so_far == self.length_getter():
+            self._finish()
+        if self._buffered_bytes <= self.MAX_BUFFER_SIZE:
+            self._fire_drained()
+
+    def _processing_failed(self, err):
+        self._processing = False
+        log.warning("Failed to write blob data: %s", err.getErrorMessage())
+        self._finish(err)
+
+    def _fire_drained(self):
+        if self._drained_deferred is not None:
+            d, self._drained_deferred = self._drained_deferred, None
+            d.callback(True)
+
+    def _finish(self, err=None):
+        if self._finished and self._processing:
+            # finished_cb is called when the worker is done
+            return
+        self._finished = True
+        self._finish_reason = err
+        self._buffer = []
+        self._fire_drained()
+        if not self._processing:
+            self.finished_cb(self, err)
 
 
 class HashBlob(object):
@@ -118,20 +255,20 @@ class HashBlob(object):
         return False
 
     def read(self, write_func):
-
-        def close_self(*args):
-            self.close_read_handle(file_handle)
-            return args[0]
-
-        file_sender = FileSender()
-        reader = HashBlobReader(write_func)
-        file_handle = self.open_for_reading()
-        if file_handle is not None:
-            d = file_sender.beginFileTransfer(file_handle, reader)
-            d.addCallback(close_self)
-        else:
-            d = defer.fail(ValueError("Could not read the blob"))
-        return d
+        """Pass the whole blob to write_func as a single read only buffer
+
+        The buffer is only valid until write_func returns.
+        """
+        blob_map = self.open_for_mapped_reading()
+        if blob_map is None:
+            return defer.fail(ValueError("Could not read the blob"))
+        try:
+            write_func(blob_map.slice())
+        except Exception:
+            return defer.fail()
+        finally:
+            blob_map.close()
+        return defer.succeed(blob_map.length)
 
     def writer_finished(self, writer, err=None):
 
@@ -185,6 +322,16 @@ class HashBlob(object):
     def open_for_reading(self):
         pass
 
+    def open_for_reading_async(self):
+        """Like open_for_reading, but any blocking reads are done in a thread
+
+        @return: a deferred that fires with the read handle, or None
+        """
+        return defer.succeed(self.open_for_reading())
+
+    def open_for_mapped_reading(self):
+        pass
+
     def delete(self):
         pass
 
@@ -207,13 +354,24 @@ class HashBlob(object):
 class BlobFile(HashBlob):
     """A HashBlob which will be saved to the hard disk of the downloader"""
 
-    def __init__(self, blob_dir, *args):
-        HashBlob.__init__(self, *args)
+    def __init__(self, blob_dir, blob_hash, length=None, verified=None, dir_levels=0):
+        """
+        @param verified: True or False if the caller already knows whether the blob is
+            on disk (the blob manager keeps an index of verified blobs), None to check
+            the file system
+
+        @param dir_levels: the number of sub directory levels blobs are fanned out into,
+            see lbrynet.core.blob_layout
+        """
+        HashBlob.__init__(self, blob_hash, length)
         self.blob_dir = blob_dir
-        self.file_path = os.path.join(blob_dir, self.blob_hash)
+        self.file_dir = get_blob_dir(blob_dir, self.blob_hash, dir_levels)
+        self.file_path = os.path.join(self.file_dir, self.blob_hash)
         self.setting_verified_blob_lock = threading.Lock()
         self.moved_verified_blob = False
-        if os.path.isfile(self.file_path):
+        if verified is not None:
+            self._verified = verified
+        elif os.path.isfile(self.file_path):
             self.set_length(os.path.getsize(self.file_path))
             # This assumes that the hash of the blob has already been
             # checked as part of the blob creation process. It might
@@ -225,7 +383,8 @@ class BlobFile(HashBlob):
     def open_for_writing(self, peer):
         if not peer in self.writers:
             log.debug("Opening %s to be written by %s", str(self), str(peer))
-            write_file = tempfile.NamedTemporaryFile(delete=False, dir=self.blob_dir)
+            ensure_dir_exists(self.file_dir)
+            write_file = tempfile.NamedTemporaryFile(delete=False, dir=self.file_dir)
             finished_deferred = defer.Deferred()
             writer = HashBlobWriter(write_file, self.get_length, self.writer_finished)
 
@@ -246,14 +405,24 @@ class BlobFile(HashBlob):
                 self.close_read_handle(file_handle)
         return None
 
+    def open_for_mapped_reading(self):
+        file_handle = self.open_for_reading()
+        if file_handle is None:
+            return None
+        return map_blob_file(file_handle, self.close_read_handle)
+
+    def mark_deleted(self):
+        """Forget that the blob was verified, before its file is deleted"""
+        self._verified = False
+        self.moved_verified_blob = False
+
     def delete(self):
         if not self.writers and not self.readers:
-            self._verified = False
-            self.moved_verified_blob = False
+            self.mark_deleted()
 
             def delete_from_file_system():
-                if os.path.isfile(self.file_path):
-                    os.remove(self.file_path)
+                for _, err in delete_blob_files([self.file_path]):
+                    raise err
 
             d = threads.deferToThread(delete_from_file_system)
 
@@ -273,12 +442,25 @@ class BlobFile(HashBlob):
             file_handle.close()
             self.readers -= 1
 
+    def quarantine(self, quarantine_dir):
+        """Mark the blob as not verified and move its file into quarantine_dir, so that it
+        can be downloaded again"""
+        self._verified = False
+        self.moved_verified_blob = False
+
+        def move_to_quarantine():
+            if os.path.isfile(self.file_path):
+                ensure_dir_exists(quarantine_dir)
+                shutil.move(self.file_path, os.path.join(quarantine_dir, self.blob_hash))
+
+        return threads.deferToThread(move_to_quarantine)
+
     def _close_writer(self, writer):
         if writer.write_handle is not None:
             log.debug("Closing %s", str(self))
             name = writer.write_handle.name
             writer.write_handle.close()
-            threads.deferToThread(os.remove, name)
+            threads.deferToThread(delete_blob_files, [name])
             writer.write_handle = None
 
     def _save_verified_blob(self, writer):
@@ -298,11 +480,147 @@ class BlobFile(HashBlob):
         return threads.deferToThread(move_file)
 
 
+class PackableBlobFile(BlobFile):
+    """A BlobFile which is kept in a BlobPackStore instead of its own file if it is small
+
+    Blobs that may be small enough to be packed are received into memory, blobs of unknown
+    length (such as stream descriptors) are only written to a file if they turn out to be
+    too big to be packed.
+    """
+
+    def __init__(self, blob_dir, blob_hash, length=None, verified=None, dir_levels=0,
+                 pack_store=None):
+        """
+        @param pack_store: the lbrynet.core.BlobPackStore.BlobPackStore small blobs are
+            kept in
+        """
+        assert pack_store is not None
+        self.pack_store = pack_store
+        if verified is None and blob_hash in pack_store:
+            verified = True
+            length = pack_store.get_length(blob_hash)
+        BlobFile.__init__(self, blob_dir, blob_hash, length, verified, dir_levels)
+
+    def open_for_writing(self, peer):
+        if self.length is not None and not self.pack_store.should_pack(self.length):
+            return BlobFile.open_for_writing(self, peer)
+        if not peer in self.writers:
+            log.debug("Opening %s to be written into memory by %s", str(self), str(peer))
+            finished_deferred = defer.Deferred()
+            writer = HashBlobWriter(io.BytesIO(), self.get_length, self.writer_finished)
+
+            self.writers[peer] = (writer, finished_deferred)
+            return finished_deferred, writer.write, writer.cancel
+        log.warning("Tried to download the same file twice simultaneously from the same peer")
+        return None, None, None
+
+    def open_for_reading(self):
+        """Packed blobs are read from their pack, use open_for_reading_async in the
+        reactor thread"""
+        if self._verified is True and self.blob_hash in self.pack_store:
+            return self._open_packed_data(self._read_packed_data())
+        return BlobFile.open_for_reading(self)
+
+    def open_for_reading_async(self):
+        if self._verified is True and self.blob_hash in self.pack_store:
+            d = threads.deferToThread(self._read_packed_data)
+            d.addCallback(self._open_packed_data)
+            return d
+        return BlobFile.open_for_reading_async(self)
+
+    def _read_packed_data(self):
+        """
+        @return: the contents of the blob, None if it isn't packed or False if the pack
+            couldn't be read
+        """
+        try:
+            return self.pack_store.read(self.blob_hash)
+        except EnvironmentError:
+            log.exception('Failed to read %s from its pack', str(self))
+            return False
+
+    def _open_packed_data(self, data):
+        if data is False:
+            return None
+        if data is None or self._verified is not True:
+            return BlobFile.open_for_reading(self)
+        self.readers += 1
+        return io.BytesIO(data)
+
+    def open_for_mapped_reading(self):
+        if self.blob_hash not in self.pack_store:
+            return BlobFile.open_for_mapped_reading(self)
+        file_handle = self.open_for_reading()
+        if file_handle is None:
+            return None
+        return BlobReadMap(file_handle.getvalue(), lambda: self.close_read_handle(file_handle))
+
+    def delete(self):
+        if self.blob_hash not in self.pack_store:
+            return BlobFile.delete(self)
+        if not self.writers and not self.readers:
+            self.mark_deleted()
+            return threads.deferToThread(self.pack_store.remove, [self.blob_hash])
+        return defer.fail(Failure(
+            ValueError("Blob is currently being read or written and cannot be deleted")))
+
+    def quarantine(self, quarantine_dir):
+        if self.blob_hash not in self.pack_store:
+            return BlobFile.quarantine(self, quarantine_dir)
+        self._verified = False
+        self.moved_verified_blob = False
+
+        def move_to_quarantine():
+            data = self.pack_store.read(self.blob_hash)
+            self.pack_store.remove([self.blob_hash])
+            if data is not None:
+                ensure_dir_exists(quarantine_dir)
+                with open(os.path.join(quarantine_dir, self.blob_hash), 'wb') as blob_file:
+                    blob_file.write(data)
+
+        return threads.deferToThread(move_to_quarantine)
+
+    def _close_writer(self, writer):
+        if isinstance(writer.write_handle, io.BytesIO):
+            writer.write_handle.close()
+            writer.write_handle = None
+        else:
+            BlobFile._close_writer(self, writer)
+
+    def _save_verified_blob(self, writer):
+        if not isinstance(writer.write_handle, io.BytesIO):
+            return BlobFile._save_verified_blob(self, writer)
+
+        def save_blob():
+            with self.setting_verified_blob_lock:
+                if self.moved_verified_blob is not False:
+                    raise DownloadCanceledError()
+                data = writer.write_handle.getvalue()
+                if self.pack_store.should_pack(len(data)):
+                    self.pack_store.add(self.blob_hash, data)
+                else:
+                    ensure_dir_exists(self.file_dir)
+                    with tempfile.NamedTemporaryFile(delete=False, dir=self.file_dir) as f:
+                        f.write(data)
+                    shutil.move(f.name, self.file_path)
+                writer.write_handle.close()
+                writer.write_handle = None
+                self.moved_verified_blob = True
+                return True
+
+        return threads.deferToThread(save_blob)
+
+
 class TempBlob(HashBlob):
-    """A HashBlob which will only exist in memory"""
+    """A HashBlob which will only exist in memory
+
+    The TempBlobManager may spill the data of a verified blob to a temporary file to
+    stay within its memory budget, after which it is read from that file.
+    """
     def __init__(self, *args):
         HashBlob.__init__(self, *args)
         self.data_buffer = ""
+        self.spill_path = None
 
     def open_for_writing(self, peer):
         if not peer in self.writers:
@@ -316,13 +634,58 @@ class TempBlob(HashBlob):
 
     def open_for_reading(self):
         if self._verified is True:
+            if self.spill_path is not None:
+                try:
+                    return open(self.spill_path, 'rb')
+                except IOError:
+                    log.exception('Failed to open %s', self.spill_path)
+                    return None
             return StringIO(self.data_buffer)
         return None
 
+    def open_for_mapped_reading(self):
+        if self._verified is True:
+            if self.spill_path is not None:
+                file_handle = self.open_for_reading()
+                if file_handle is None:
+                    return None
+                return map_blob_file(file_handle, self.close_read_handle)
+            return BlobReadMap(self.data_buffer)
+        return None
+
+    def spill(self, spill_dir):
+        """Move the data of the verified blob into a file in spill_dir
+
+        @return: a deferred that fires with True once the data is only in the file, or
+            False if the blob was deleted in the meantime
+        """
+        assert self._verified is True and self.spill_path is None
+        data = self.data_buffer
+        path = os.path.join(spill_dir, self.blob_hash)
+
+        def write_file():
+            with open(path, 'wb') as spill_file:
+                spill_file.write(data)
+
+        def set_spilled(_):
+            if self._verified is not True or self.data_buffer is not data:
+                threads.deferToThread(delete_blob_files, [path])
+                return False
+            self.data_buffer = None
+            self.spill_path = path
+            return True
+
+        d = threads.deferToThread(write_file)
+        d.addCallback(set_spilled)
+        return d
+
     def delete(self):
         if not self.writers and not self.readers:
             self._verified = False
             self.data_buffer = ''
+            if self.spill_path is not None:
+                path, self.spill_path = self.spill_path, None
+                return threads.deferToThread(delete_blob_files, [path])
             return defer.succeed(True)
         else:
             return defer.fail(Failure(
@@ -384,16 +747,22 @@ class HashBlobCreator(object):
 
 
 class BlobFileCreator(HashBlobCreator):
-    def __init__(self, blob_manager, blob_dir):
+    def __init__(self, blob_manager, blob_dir, dir_levels=0):
         HashBlobCreator.__init__(self, blob_manager)
         self.blob_dir = blob_dir
-        self.out_file = tempfile.NamedTemporaryFile(delete=False, dir=self.blob_dir)
+        self.dir_levels = dir_levels
+        self.out_file = self._open_out_file()
+
+    def _open_out_file(self):
+        return tempfile.NamedTemporaryFile(delete=False, dir=self.blob_dir)
 
     def _close(self):
         temp_file_name = self.out_file.name
         self.out_file.close()
         if self.blob_hash is not None:
-            shutil.move(temp_file_name, os.path.join(self.blob_dir, self.blob_hash))
+            file_dir = get_blob_dir(self.blob_dir, self.blob_hash, self.dir_levels)
+            ensure_dir_exists(file_dir)
+            shutil.move(temp_file_name, os.path.join(file_dir, self.blob_hash))
         else:
             os.remove(temp_file_name)
         return defer.succeed(True)
@@ -402,6 +771,43 @@ class BlobFileCreator(HashBlobCreator):
         self.out_file.write(data)
 
 
+class PackableBlobFileCreator(BlobFileCreator):
+    """A BlobFileCreator which adds blobs that are small enough to a BlobPackStore
+
+    Data is kept in memory until it is too big to be packed, then it is written to a
+    temporary file like BlobFileCreator does.
+    """
+
+    def __init__(self, blob_manager, blob_dir, dir_levels=0, pack_store=None):
+        assert pack_store is not None
+        self.pack_store = pack_store
+        self._buffer = io.BytesIO()
+        BlobFileCreator.__init__(self, blob_manager, blob_dir, dir_levels)
+
+    def _open_out_file(self):
+        # the temporary file is only opened once the blob is too big to be packed
+        return None
+
+    def _close(self):
+        if self.out_file is not None:
+            return BlobFileCreator._close(self)
+        data = self._buffer.getvalue()
+        self._buffer.close()
+        if self.blob_hash is None:
+            return defer.succeed(True)
+        return threads.deferToThread(self.pack_store.add, self.blob_hash, data)
+
+    def _write(self, data):
+        if self.out_file is None and self.len_so_far > self.pack_store.max_blob_size:
+            self.out_file = BlobFileCreator._open_out_file(self)
+            self.out_file.write(self._buffer.getvalue())
+            self._buffer.close()
+        if self.out_file is None:
+            self._buffer.write(data)
+        else:
+            self.out_file.write(data)
+
+
 class TempBlobCreator(HashBlobCreator):
     def __init__(self, blob_manager):
         HashBlobCreator.__init__(self, blob_manager)
@@ -1,4 +1,5 @@
 import logging
+import os
 import miniupnpc
 from lbrynet.core.BlobManager import DiskBlobManager, TempBlobManager
 from lbrynet.dht import node
@@ -43,7 +44,7 @@ class Session(object):
                  blob_manager=None, peer_port=None, use_upnp=True,
                  rate_limiter=None, wallet=None,
                  dht_node_class=node.Node, blob_tracker_class=None,
-                 payment_rate_manager_class=None, is_generous=True):
+                 payment_rate_manager_class=None, is_generous=True, dht_data_store=None):
         """@param blob_data_payment_rate: The default payment rate for blob data
 
         @param db_dir: The directory in which levelDB files should be stored
@@ -80,7 +81,8 @@ class Session(object):
             is not None, a DiskBlobManager will be used, with the
             given blob_dir.  If None and blob_dir is None, a
             TempBlobManager will be used, which stores blobs in memory
-            only.
+            for the session, spilling them to a temporary directory
+            past temp_blob_memory_limit_mb.
 
         @param peer_port: The port on which other peers should connect
             to this peer
@@ -98,6 +100,10 @@ class Session(object):
             wallet which uses the Point Trader system will be used,
             which is meant for testing only
 
+        @param dht_data_store: The data store the dht node keeps the
+            peers announced to it in. If None, they are kept in memory
+            and forgotten when the session ends
+
         """
         self.db_dir = db_dir
 
@@ -131,6 +137,7 @@ class Session(object):
         self.wallet = wallet
         self.dht_node_class = dht_node_class
         self.dht_node = None
+        self.dht_data_store = dht_data_store
 
         self.base_payment_rate_manager = BasePaymentRateManager(blob_data_payment_rate)
         self.payment_rate_manager = None
@@ -272,10 +279,17 @@ class Session(object):
             d.addCallback(lambda h: (h, port))  # match host to port
             ds.append(d)
 
+        node_kwargs = {}
+        if self.dht_data_store is not None:
+            node_kwargs['dataStore'] = self.dht_data_store
+        if self.db_dir is not None:
+            # the node joins through the contacts it had last time, if they are still up
+            node_kwargs['contactsSnapshotPath'] = os.path.join(self.db_dir, "dht_contacts.json")
         self.dht_node = self.dht_node_class(
             udpPort=self.dht_node_port,
             lbryid=self.lbryid,
-            externalIP=self.external_ip
+            externalIP=self.external_ip,
+            **node_kwargs
         )
         self.peer_finder = DHTPeerFinder(self.dht_node, self.peer_manager)
         if self.hash_announcer is None:
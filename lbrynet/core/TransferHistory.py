@@ -0,0 +1,85 @@
+import logging
+import time
+
+
+log = logging.getLogger(__name__)
+
+UPLOAD = 'upload'
+DOWNLOAD = 'download'
+
+SECONDS_PER_HOUR = 60 * 60
+
+
+def get_hour(timestamp=None):
+    if timestamp is None:
+        timestamp = time.time()
+    return int(timestamp) // SECONDS_PER_HOUR
+
+
+class TransferHistory(object):
+    """Keeps per (blob, host, hour) rollups of blob uploads and downloads
+
+    Rollups are accumulated in memory and written to the transfer_history table of
+    blobs.db in batches by the blob manager. Rows older than the retention period are
+    pruned at most once an hour.
+    """
+
+    def __init__(self, retention):
+        """
+        @param retention: number of seconds to keep history for
+        """
+        self.retention = retention
+        # {(direction, blob_hash, host, hour): [transfers, bytes, rate_sum]}
+        self._rollups = {}
+        self._last_pruned_hour = None
+
+    def __len__(self):
+        return len(self._rollups)
+
+    def add(self, direction, blob_hash, host, rate, num_bytes):
+        assert direction in (UPLOAD, DOWNLOAD)
+        key = (direction, blob_hash, str(host), get_hour())
+        rollup = self._rollups.get(key)
+        if rollup is None:
+            self._rollups[key] = [1, int(num_bytes), float(rate)]
+        else:
+            rollup[0] += 1
+            rollup[1] += int(num_bytes)
+            rollup[2] += float(rate)
+
+    def take_pending(self):
+        rollups, self._rollups = self._rollups, {}
+        return rollups
+
+    @staticmethod
+    def create_tables(transaction):
+        transaction.execute("create table if not exists transfer_history (" +
+                            "    direction text not null, " +
+                            "    blob_hash text not null, " +
+                            "    host text not null, " +
+                            "    hour integer not null, " +
+                            "    transfers integer not null, " +
+                            "    bytes integer not null, " +
+                            "    rate_sum real not null, " +
+                            "    primary key (direction, blob_hash, host, hour))")
+        transaction.execute("create index if not exists transfer_history_hour_idx " +
+                            "on transfer_history (direction, hour)")
+        transaction.execute("create index if not exists transfer_history_host_idx " +
+                            "on transfer_history (direction, host, hour)")
+
+    def write(self, transaction, rollups):
+        """Add rollups to the transfer_history table and prune old rows, runs in a db thread"""
+        if rollups:
+            transaction.executemany(
+                "insert or ignore into transfer_history values (?, ?, ?, ?, 0, 0, 0)",
+                rollups.keys())
+            transaction.executemany(
+                "update transfer_history set transfers = transfers + ?, bytes = bytes + ?, " +
+                "    rate_sum = rate_sum + ? " +
+                "where direction = ? and blob_hash = ? and host = ? and hour = ?",
+                [tuple(values) + key for key, values in rollups.iteritems()])
+        current_hour = get_hour()
+        if self._last_pruned_hour != current_hour:
+            self._last_pruned_hour = current_hour
+            transaction.execute("delete from transfer_history where hour < ?",
+                                (get_hour(time.time() - self.retention),))
@@ -6,7 +6,6 @@ import time
 
 from twisted.internet import threads, reactor, defer, task
 from twisted.python.failure import Failure
-from twisted.enterprise import adbapi
 
 from collections import defaultdict, deque
 from zope.interface import implements
@@ -22,6 +21,7 @@ from lbryschema.claim import ClaimDict
 from lbryschema.error import DecodeError
 from lbryschema.decode import smart_decode
 
+from lbrynet.core.Database import open_database
 from lbrynet.core.sqlite_helpers import rerun_if_locked
 from lbrynet.interfaces import IRequestCreator, IQueryHandlerFactory, IQueryHandler, IWallet
 from lbrynet.core.client.ClientRequest import ClientRequest
@@ -146,6 +146,9 @@ class MetaDataStorage(object):
     def get_cached_claim_for_uri(self, uri, check_expire=True):
         return defer.succeed(None)
 
+    def close(self):
+        return defer.succeed(True)
+
 
 class InMemoryStorage(MetaDataStorage):
     def __init__(self):
@@ -218,8 +221,7 @@ class InMemoryStorage(MetaDataStorage):
 class SqliteStorage(MetaDataStorage):
     def __init__(self, db_dir):
         self.db_dir = db_dir
-        self.db = adbapi.ConnectionPool('sqlite3', os.path.join(self.db_dir, "blockchainname.db"),
-                                        check_same_thread=False)
+        self.db = open_database(os.path.join(self.db_dir, "blockchainname.db"))
         MetaDataStorage.__init__(self)
 
     def load(self):
@@ -255,6 +257,12 @@ class SqliteStorage(MetaDataStorage):
 
         return self.db.runInteraction(create_tables)
 
+    def close(self):
+        db, self.db = self.db, None
+        if db is not None:
+            db.close()
+        return defer.succeed(True)
+
     @rerun_if_locked
     @defer.inlineCallbacks
     def save_name_metadata(self, name, claim_outpoint, sd_hash):
@@ -445,6 +453,8 @@ class Wallet(object):
         d.addErrback(self.log_stop_error)
         d.addCallback(lambda _: self._stop())
         d.addErrback(self.log_stop_error)
+        d.addCallback(lambda _: self._storage.close())
+        d.addErrback(self.log_stop_error)
         return d
 
     def manage(self, do_full=False):
@@ -0,0 +1,173 @@
+"""
+Layout of blob files on disk
+
+With dir_levels = 0 every blob is stored directly in the blob directory. With dir_levels = n
+blobs are fanned out into n levels of sub directories named after successive pairs of
+characters of the blob hash, e.g. blob_dir/ab/cd/abcd... for dir_levels = 2.
+"""
+
+import logging
+import os
+import threading
+
+from twisted.internet import defer, threads
+from lbrynet.core.utils import is_valid_blobhash
+
+
+log = logging.getLogger(__name__)
+
+MAX_DIR_LEVELS = 3
+LAYOUT_FILE_NAME = '.blob_dir_levels'
+# blobs that failed verification are moved here, see lbrynet.core.BlobScrubber
+QUARANTINE_DIR_NAME = 'quarantine'
+# small blobs are appended to pack files in here, see lbrynet.core.BlobPackStore
+PACK_DIR_NAME = 'packs'
+
+
+def get_blob_dir(blob_dir, blob_hash, dir_levels):
+    """Return the directory the blob with the given hash is stored in"""
+    assert 0 <= dir_levels <= MAX_DIR_LEVELS
+    parts = [blob_hash[i * 2:i * 2 + 2] for i in range(dir_levels)]
+    return os.path.join(blob_dir, *parts)
+
+
+def get_blob_path(blob_dir, blob_hash, dir_levels):
+    return os.path.join(get_blob_dir(blob_dir, blob_hash, dir_levels), blob_hash)
+
+
+def ensure_dir_exists(path):
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # another thread may have created it in the mean time
+            if not os.path.isdir(path):
+                raise
+
+
+def delete_blob_files(paths):
+    """Delete blob files that exist, return [(path, error)] of the ones that couldn't be"""
+    failed = []
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError as err:
+            if os.path.isfile(path):
+                failed.append((path, err))
+    return failed
+
+
+def read_dir_levels(blob_dir):
+    """Return the number of directory levels blob_dir was last fully migrated to"""
+    layout_file = os.path.join(blob_dir, LAYOUT_FILE_NAME)
+    if not os.path.isfile(layout_file):
+        # blob directories created before the layout was configurable are flat
+        return 0
+    with open(layout_file, 'r') as f:
+        return int(f.read().strip())
+
+
+def write_dir_levels(blob_dir, dir_levels):
+    with open(os.path.join(blob_dir, LAYOUT_FILE_NAME), 'w') as f:
+        f.write(str(dir_levels))
+
+
+def find_misplaced_blobs(blob_dir, dir_levels):
+    """Walk blob_dir and return {blob_hash: path} of blob files not stored where
+    dir_levels says they should be"""
+    misplaced = {}
+    for root, dir_names, file_names in os.walk(blob_dir):
+        if root == blob_dir:
+            for dir_name in (QUARANTINE_DIR_NAME, PACK_DIR_NAME):
+                if dir_name in dir_names:
+                    dir_names.remove(dir_name)
+        for file_name in file_names:
+            if not is_valid_blobhash(file_name):
+                continue
+            path = os.path.join(root, file_name)
+            if path != get_blob_path(blob_dir, file_name, dir_levels):
+                misplaced[file_name] = path
+    return misplaced
+
+
+class BlobLayoutMigrator(object):
+    """Moves blob files into the configured layout in a background thread
+
+    The blob directory is only walked if the layout recorded in it differs from the
+    configured one. Blobs that are needed before the background thread gets to them can
+    be moved on demand with migrate_blob.
+    """
+
+    def __init__(self, blob_dir, dir_levels):
+        self.blob_dir = blob_dir
+        self.dir_levels = dir_levels
+        self.migrated = 0
+        self.failed = 0
+        self._pending = {}  # {blob_hash: current path}
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._migrate_deferred = None
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    @defer.inlineCallbacks
+    def start(self):
+        """Find the blobs that need to be moved and start moving them
+
+        Returns a deferred that fires once the blobs that need to be moved are known,
+        the moves themselves happen in the background.
+        """
+        current_levels = yield threads.deferToThread(read_dir_levels, self.blob_dir)
+        if current_levels == self.dir_levels:
+            return
+        log.info("Migrating blobs in %s from %i to %i directory levels",
+                 self.blob_dir, current_levels, self.dir_levels)
+        pending = yield threads.deferToThread(
+            find_misplaced_blobs, self.blob_dir, self.dir_levels)
+        with self._lock:
+            self._pending = pending
+        log.info("%i blobs need to be moved", len(pending))
+        self._migrate_deferred = threads.deferToThread(self._migrate_pending_blobs)
+        self._migrate_deferred.addErrback(
+            lambda err: log.error("Failed to migrate blobs: %s", err.getTraceback()))
+
+    def stop(self):
+        self._stopped = True
+        if self._migrate_deferred is not None:
+            return self._migrate_deferred
+        return defer.succeed(True)
+
+    def migrate_blob(self, blob_hash):
+        """Move a single blob into place right away if it has not been moved yet"""
+        with self._lock:
+            path = self._pending.pop(blob_hash, None)
+            if path is not None:
+                self._move_blob(blob_hash, path)
+
+    def _move_blob(self, blob_hash, path):
+        new_path = get_blob_path(self.blob_dir, blob_hash, self.dir_levels)
+        try:
+            ensure_dir_exists(os.path.dirname(new_path))
+            os.rename(path, new_path)
+            self.migrated += 1
+        except OSError:
+            self.failed += 1
+            log.exception("Failed to move blob %s to %s", path, new_path)
+
+    def _migrate_pending_blobs(self):
+        while not self._stopped:
+            with self._lock:
+                if not self._pending:
+                    break
+                blob_hash, path = self._pending.popitem()
+                self._move_blob(blob_hash, path)
+        if self._stopped:
+            return
+        if self.failed:
+            log.warning("Failed to move %i blobs in %s, will retry on the next start",
+                        self.failed, self.blob_dir)
+        else:
+            write_dir_levels(self.blob_dir, self.dir_levels)
+            log.info("Finished migrating %i blobs in %s", self.migrated, self.blob_dir)
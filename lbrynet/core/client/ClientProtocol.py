@@ -37,6 +37,8 @@ class ClientProtocol(Protocol, TimeoutMixin):
         self._response_buff = ''
         self._downloading_blob = False
         self._blob_download_request = None
+        self._blob_write_paused = False
+        self._download_throttled = False
         self._next_request = {}
         self.connection_closed = False
         self.connection_closing = False
@@ -51,7 +53,7 @@ class ClientProtocol(Protocol, TimeoutMixin):
         self.setTimeout(None)
         self._rate_limiter.report_dl_bytes(len(data))
         if self._downloading_blob is True:
-            self._blob_download_request.write(data)
+            self._write_blob_data(data)
         else:
             self._response_buff += data
             if len(self._response_buff) > conf.settings['MAX_RESPONSE_INFO_SIZE']:
@@ -63,7 +65,21 @@ class ClientProtocol(Protocol, TimeoutMixin):
                 self._response_buff = ''
                 self._handle_response(response)
                 if self._downloading_blob is True and len(extra_data) != 0:
-                    self._blob_download_request.write(extra_data)
+                    self._write_blob_data(extra_data)
+
+    def _write_blob_data(self, data):
+        d = self._blob_download_request.write(data)
+        if isinstance(d, defer.Deferred) and not self._blob_write_paused:
+            # the blob writer is behind, stop reading from the socket until it catches up
+            self._blob_write_paused = True
+            self.transport.pauseProducing()
+            d.addCallback(self._blob_writer_drained)
+
+    def _blob_writer_drained(self, result):
+        self._blob_write_paused = False
+        if not self._download_throttled and not self.connection_closed:
+            self.transport.resumeProducing()
+        return result
 
     def timeoutConnection(self):
         log.info("Connection timed out to %s", self.peer)
@@ -255,10 +271,13 @@ class ClientProtocol(Protocol, TimeoutMixin):
         pass
 
     def throttle_download(self):
+        self._download_throttled = True
         self.transport.pauseProducing()
 
     def unthrottle_download(self):
-        self.transport.resumeProducing()
+        self._download_throttled = False
+        if not self._blob_write_paused:
+            self.transport.resumeProducing()
 
 
 class ClientProtocolFactory(ClientFactory):
@@ -1,5 +1,6 @@
 import binascii
 import logging
+from collections import OrderedDict
 
 from zope.interface import implements
 from twisted.internet import defer, reactor
@@ -11,14 +12,36 @@ log = logging.getLogger(__name__)
 
 
 class DHTPeerFinder(object):
-    """This class finds peers which have announced to the DHT that they have certain blobs"""
+    """This class finds peers which have announced to the DHT that they have certain blobs
+
+    The peers found for a blob are cached for cache_ttl seconds, or negative_cache_ttl
+    seconds if none were found, and concurrent searches for the same blob share one
+    DHT lookup.
+    """
     implements(IPeerFinder)
 
-    def __init__(self, dht_node, peer_manager):
+    CACHE_TTL = 30
+    NEGATIVE_CACHE_TTL = 10
+    MAX_CACHE_SIZE = 10000
+
+    def __init__(self, dht_node, peer_manager, cache_ttl=None, negative_cache_ttl=None,
+                 clock=None):
         self.dht_node = dht_node
         self.peer_manager = peer_manager
         self.peers = []
         self.next_manage_call = None
+        self.cache_ttl = cache_ttl if cache_ttl is not None else self.CACHE_TTL
+        self.negative_cache_ttl = (
+            negative_cache_ttl if negative_cache_ttl is not None else self.NEGATIVE_CACHE_TTL)
+        self.clock = clock or reactor
+        # {blob_hash: (expiry time, [(host, port)])}, oldest first
+        self._cache = OrderedDict()
+        # {blob_hash: [deferreds of the searches waiting for the lookup]}
+        self._lookups = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
 
     def run_manage_loop(self):
         self._manage_peers()
@@ -31,31 +54,98 @@ class DHTPeerFinder(object):
             self.next_manage_call = None
 
     def _manage_peers(self):
-        pass
+        self._remove_expired()
 
-    @defer.inlineCallbacks
     def find_peers_for_blob(self, blob_hash, timeout=None):
         def _trigger_timeout():
             if not finished_deferred.called:
                 log.debug("Peer search for %s timed out", short_hash(blob_hash))
                 finished_deferred.cancel()
 
-        bin_hash = binascii.unhexlify(blob_hash)
-        finished_deferred = self.dht_node.getPeersForBlob(bin_hash)
+        cached = self._get_cached(blob_hash)
+        if cached is not None:
+            return defer.succeed(self._get_available_peers(cached))
+
+        finished_deferred = defer.Deferred(lambda d: self._remove_waiter(blob_hash, d))
+        if blob_hash in self._lookups:
+            self.coalesced += 1
+            self._lookups[blob_hash].append(finished_deferred)
+        else:
+            self.misses += 1
+            self._lookups[blob_hash] = [finished_deferred]
+            d = self.dht_node.getPeersForBlob(binascii.unhexlify(blob_hash))
+            d.addCallbacks(self._lookup_finished, self._lookup_failed,
+                           callbackArgs=(blob_hash,), errbackArgs=(blob_hash,))
 
         if timeout is not None:
-            reactor.callLater(timeout, _trigger_timeout)
+            timeout_call = self.clock.callLater(timeout, _trigger_timeout)
+            finished_deferred.addBoth(self._cancel_timeout, timeout_call)
+        finished_deferred.addCallback(self._get_available_peers)
+        return finished_deferred
 
-        peer_list = yield finished_deferred
+    def get_most_popular_hashes(self, num_to_return):
+        return self.dht_node.get_most_popular_hashes(num_to_return)
 
-        peers = set(peer_list)
+    def get_stats(self):
+        searches = self.hits + self.negative_hits + self.misses + self.coalesced
+        return {
+            'cached_blobs': len(self._cache),
+            'lookups_in_progress': len(self._lookups),
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': float(searches - self.misses) / searches if searches else 0.0,
+        }
+
+    def _get_cached(self, blob_hash):
+        if blob_hash not in self._cache:
+            return None
+        expires, peer_list = self._cache[blob_hash]
+        if expires <= self.clock.seconds():
+            del self._cache[blob_hash]
+            return None
+        if peer_list:
+            self.hits += 1
+        else:
+            self.negative_hits += 1
+        return peer_list
+
+    def _remove_expired(self):
+        now = self.clock.seconds()
+        for blob_hash, (expires, _) in self._cache.items():
+            if expires <= now:
+                del self._cache[blob_hash]
+
+    def _lookup_finished(self, peer_list, blob_hash):
+        peer_list = list(set(peer_list))
+        ttl = self.cache_ttl if peer_list else self.negative_cache_ttl
+        self._cache.pop(blob_hash, None)
+        self._cache[blob_hash] = (self.clock.seconds() + ttl, peer_list)
+        while len(self._cache) > self.MAX_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        for d in self._lookups.pop(blob_hash):
+            d.callback(peer_list)
+
+    def _lookup_failed(self, err, blob_hash):
+        for d in self._lookups.pop(blob_hash):
+            d.errback(err)
+
+    def _remove_waiter(self, blob_hash, d):
+        # the lookup goes on when a search is cancelled, the result is still cached
+        if blob_hash in self._lookups and d in self._lookups[blob_hash]:
+            self._lookups[blob_hash].remove(d)
+
+    @staticmethod
+    def _cancel_timeout(result, timeout_call):
+        if timeout_call.active():
+            timeout_call.cancel()
+        return result
+
+    def _get_available_peers(self, peer_list):
         good_peers = []
-        for host, port in peers:
+        for host, port in peer_list:
             peer = self.peer_manager.get_peer(host, port)
             if peer.is_available() is True:
                 good_peers.append(peer)
-
-        defer.returnValue(good_peers)
-
-    def get_most_popular_hashes(self, num_to_return):
-        return self.dht_node.get_most_popular_hashes(num_to_return)
+        return good_peers
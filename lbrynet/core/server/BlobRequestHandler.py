@@ -141,20 +141,26 @@ class BlobRequestHandler(object):
         return d
 
     def open_blob_for_reading(self, blob, response):
+        if blob.is_validated():
+            d = blob.open_for_reading_async()
+        else:
+            d = defer.succeed(None)
+        d.addCallback(self._set_read_handle, blob, response)
+        return d
+
+    def _set_read_handle(self, read_handle, blob, response):
         response_fields = {}
         d = defer.succeed(None)
-        if blob.is_validated():
-            read_handle = blob.open_for_reading()
-            if read_handle is not None:
-                self.currently_uploading = blob
-                self.read_handle = read_handle
-                log.info("Sending %s to %s", str(blob), self.peer)
-                response_fields['blob_hash'] = blob.blob_hash
-                response_fields['length'] = blob.length
-                response['incoming_blob'] = response_fields
-                d.addCallback(lambda _: self.record_transaction(blob))
-                d.addCallback(lambda _: response)
-                return d
+        if read_handle is not None:
+            self.currently_uploading = blob
+            self.read_handle = read_handle
+            log.info("Sending %s to %s", str(blob), self.peer)
+            response_fields['blob_hash'] = blob.blob_hash
+            response_fields['length'] = blob.length
+            response['incoming_blob'] = response_fields
+            d.addCallback(lambda _: self.record_transaction(blob))
+            d.addCallback(lambda _: response)
+            return d
         log.debug("We can not send %s", str(blob))
         response['incoming_blob'] = {'error': 'BLOB_UNAVAILABLE'}
         d.addCallback(lambda _: response)
@@ -162,7 +168,7 @@ class BlobRequestHandler(object):
 
     def record_transaction(self, blob):
         d = self.blob_manager.add_blob_to_upload_history(
-            str(blob), self.peer.host, self.blob_data_payment_rate)
+            blob.blob_hash, self.peer.host, self.blob_data_payment_rate, blob.length)
         return d
 
     def _reply_to_send_request(self, response, incoming):
@@ -193,20 +199,26 @@ class BlobRequestHandler(object):
             inner_d.addBoth(set_not_uploading)
             return inner_d
 
-        def count_bytes(data):
-            uploaded = len(data)
+        def count_uploaded(uploaded):
             self.blob_bytes_uploaded += uploaded
             self.peer.update_stats('blob_bytes_uploaded', uploaded)
             if self.analytics_manager is not None:
                 self.analytics_manager.add_observation(analytics.BLOB_BYTES_UPLOADED, uploaded)
+
+        def count_bytes(data):
+            count_uploaded(len(data))
             return data
 
         def start_transfer():
-            self.file_sender = FileSender()
             log.debug("Starting the file upload")
             assert self.read_handle is not None, \
                 "self.read_handle was None when trying to start the transfer"
-            d = self.file_sender.beginFileTransfer(self.read_handle, consumer, count_bytes)
+            d = None
+            if hasattr(consumer, 'sendfile'):
+                d = consumer.sendfile(self.read_handle, count_uploaded)
+            if d is None:
+                self.file_sender = FileSender()
+                d = self.file_sender.beginFileTransfer(self.read_handle, consumer, count_bytes)
             return d
 
         def set_expected_payment():
@@ -12,6 +12,8 @@ log = logging.getLogger(__name__)
 class DHTHashAnnouncer(object):
     ANNOUNCE_CHECK_INTERVAL = 60
     CONCURRENT_ANNOUNCERS = 5
+    # the most hashes each announcer announces together
+    ANNOUNCE_BATCH_SIZE = 1000
 
     """This class announces to the DHT that this peer has certain blobs"""
     def __init__(self, dht_node, peer_port):
@@ -63,6 +65,11 @@ class DHTHashAnnouncer(object):
         start = time.time()
         ds = []
 
+        # hashes next to each other in the queue are announced together, and neighboring
+        # hashes are mostly stored at the same nodes
+        hashes = sorted(hashes)
+        if immediate:
+            hashes.reverse()
         for h in hashes:
             announce_deferred = defer.Deferred()
             ds.append(announce_deferred)
@@ -72,12 +79,24 @@ class DHTHashAnnouncer(object):
                 self.hash_queue.append((h, announce_deferred))
         log.debug('There are now %s hashes remaining to be announced', self.hash_queue_size())
 
+        def announced(stored, batch):
+            for h, announce_deferred in batch:
+                announce_deferred.callback(stored.get(binascii.unhexlify(h), 0))
+
+        def announce_failed(err, batch):
+            for h, announce_deferred in batch:
+                announce_deferred.errback(err)
+
         def announce():
             if len(self.hash_queue):
-                h, announce_deferred = self.hash_queue.popleft()
-                log.debug('Announcing blob %s to dht', h)
-                d = self.dht_node.announceHaveBlob(binascii.unhexlify(h), self.peer_port)
-                d.chainDeferred(announce_deferred)
+                batch = []
+                while self.hash_queue and len(batch) < self.ANNOUNCE_BATCH_SIZE:
+                    batch.append(self.hash_queue.popleft())
+                log.debug('Announcing %i blobs to dht', len(batch))
+                d = self.dht_node.announceHaveBlobs(
+                    [binascii.unhexlify(h) for h, _ in batch], self.peer_port)
+                d.addCallbacks(announced, announce_failed,
+                               callbackArgs=(batch,), errbackArgs=(batch,))
                 d.addBoth(lambda _: utils.call_later(0, announce))
             else:
                 self._concurrent_announcers -= 1
@@ -0,0 +1,129 @@
+import errno
+import logging
+import os
+
+from twisted.internet import defer, interfaces
+from zope.interface import implements
+
+try:
+    from sendfile import sendfile
+except ImportError:
+    # python 3.3+ has sendfile in the standard library, on python 2 the optional
+    # pysendfile package provides it
+    sendfile = getattr(os, 'sendfile', None)
+
+
+log = logging.getLogger(__name__)
+
+
+class SendfileSender(object):
+    """Send a file straight from its file descriptor to a TCP socket with sendfile(2)
+
+    Registers with the transport as a pull producer, so it only sends once the
+    transport has flushed anything that was written to it before and the socket is
+    writable again.
+    """
+    implements(interfaces.IPullProducer)
+
+    CHUNK_SIZE = 2 ** 20
+
+    def __init__(self, file_handle, transport, report_bytes):
+        """
+        @param report_bytes: function called with the number of bytes sent after each
+            sendfile call
+        """
+        self.file_handle = file_handle
+        self.transport = transport
+        self.report_bytes = report_bytes
+        self.offset = 0
+        self.length = None
+        self.paused = False
+        self.deferred = None
+        self._ready = False
+
+    @staticmethod
+    def is_supported(transport, file_handle):
+        if sendfile is None or transport is None:
+            return False
+        if interfaces.ISSLTransport.providedBy(transport) or getattr(transport, 'TLS', False):
+            return False
+        if not (hasattr(transport, 'socket') and hasattr(transport, 'startWriting')):
+            return False
+        try:
+            # in memory files such as packed blobs have no file descriptor
+            file_handle.fileno()
+        except (AttributeError, EnvironmentError, ValueError):
+            return False
+        return True
+
+    def start(self):
+        self.offset = self.file_handle.tell()
+        self.length = os.fstat(self.file_handle.fileno()).st_size
+        self.deferred = defer.Deferred()
+        self.transport.registerProducer(self, False)
+        return self.deferred
+
+    def pause(self):
+        self.paused = True
+
+    def unpause(self):
+        self.paused = False
+        if self.deferred is not None:
+            self.transport.startWriting()
+
+    def resumeProducing(self):
+        if self.deferred is None:
+            return
+        if not self._ready:
+            # registerProducer asks for data right away, wait until the transport
+            # has written whatever is in its buffer
+            self._ready = True
+            self.transport.startWriting()
+            return
+        if self.paused:
+            return
+        try:
+            self._send()
+        except (OSError, IOError) as err:
+            self._finish(err)
+
+    def stopProducing(self):
+        if self.deferred is not None:
+            d, self.deferred = self.deferred, None
+            d.errback(Exception("Consumer asked us to stop producing"))
+
+    def _send(self):
+        out_fd = self.transport.socket.fileno()
+        in_fd = self.file_handle.fileno()
+        while self.offset < self.length:
+            if self.paused:
+                return
+            count = min(self.CHUNK_SIZE, self.length - self.offset)
+            try:
+                sent = sendfile(out_fd, in_fd, self.offset, count)
+            except (OSError, IOError) as err:
+                if err.errno == errno.EINTR:
+                    continue
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.transport.startWriting()
+                    return
+                raise
+            if sent == 0:
+                raise IOError("%s ended after %i of %i bytes" %
+                              (self.file_handle.name, self.offset, self.length))
+            self.offset += sent
+            self.report_bytes(sent)
+            if self.deferred is None:
+                # the connection was lost while reporting the bytes
+                return
+        self._finish()
+
+    def _finish(self, err=None):
+        if self.deferred is None:
+            return
+        d, self.deferred = self.deferred, None
+        self.transport.unregisterProducer()
+        if err is None:
+            d.callback(self.offset)
+        else:
+            d.errback(err)
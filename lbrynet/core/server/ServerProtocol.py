@@ -4,6 +4,7 @@ from twisted.internet.protocol import Protocol, ServerFactory
 from twisted.python import failure
 from zope.interface import implements
 from lbrynet.core.server.ServerRequestHandler import ServerRequestHandler
+from lbrynet.core.server.SendfileSender import SendfileSender
 
 
 log = logging.getLogger(__name__)
@@ -32,6 +33,7 @@ class ServerProtocol(Protocol):
         log.debug("Got a connection")
         peer_info = self.transport.getPeer()
         self.peer = self.factory.peer_manager.get_peer(peer_info.host, peer_info.port)
+        self.sendfile_sender = None
         self.request_handler = ServerRequestHandler(self)
         for query_handler_factory in self.factory.query_handler_factories.values():
             query_handler = query_handler_factory.build_query_handler()
@@ -67,13 +69,42 @@ class ServerProtocol(Protocol):
         self.transport.write(data)
         self.factory.rate_limiter.report_ul_bytes(len(data))
 
+    def sendfile(self, file_handle, report_bytes):
+        """Send the rest of a file straight from its file descriptor to the socket
+
+        @param report_bytes: function called with the number of bytes sent
+
+        @return: a Deferred which fires when the file has been sent, or None if the
+            transport or platform does not support sendfile, in which case the caller
+            should use write()
+        """
+        if not SendfileSender.is_supported(self.transport, file_handle):
+            return None
+
+        def report_sent_bytes(num_bytes):
+            self.factory.rate_limiter.report_ul_bytes(num_bytes)
+            report_bytes(num_bytes)
+
+        def clear_sender(result):
+            self.sendfile_sender = None
+            return result
+
+        self.sendfile_sender = SendfileSender(file_handle, self.transport, report_sent_bytes)
+        d = self.sendfile_sender.start()
+        d.addBoth(clear_sender)
+        return d
+
     #Rate limiter stuff
 
     def throttle_upload(self):
+        if self.sendfile_sender is not None:
+            self.sendfile_sender.pause()
         if self.request_handler is not None:
             self.request_handler.pauseProducing()
 
     def unthrottle_upload(self):
+        if self.sendfile_sender is not None:
+            self.sendfile_sender.unpause()
         if self.request_handler is not None:
             self.request_handler.resumeProducing()
 
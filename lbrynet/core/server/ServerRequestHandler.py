@@ -86,6 +86,19 @@ class ServerRequestHandler(object):
 
         reactor.callLater(0, get_more_data)
 
+    def sendfile(self, file_handle, report_bytes):
+        """Send a file to the consumer with sendfile if possible
+
+        @return: a Deferred which fires when the file has been sent, or None if sendfile
+            can't be used and the file should be written to this consumer instead
+        """
+        if self.response_buff or self.production_paused:
+            # anything already queued has to reach the socket before the file does
+            return None
+        if not hasattr(self.consumer, 'sendfile'):
+            return None
+        return self.consumer.sendfile(file_handle, report_bytes)
+
     #From Protocol
 
     def data_received(self, data):
@@ -5,6 +5,20 @@ import logging
 
 log = logging.getLogger(__name__)
 
+# stay well below SQLITE_MAX_VARIABLE_NUMBER, which defaults to 999
+MAX_QUERY_VARIABLES = 500
+
+
+def execute_in_batches(transaction, query, values):
+    """Run a query with an "in ({})" clause once for every MAX_QUERY_VARIABLES values
+
+    @param query: query with a "{}" where the placeholders for the values go
+    """
+    values = list(values)
+    for i in range(0, len(values), MAX_QUERY_VARIABLES):
+        batch = values[i:i + MAX_QUERY_VARIABLES]
+        transaction.execute(query.format(", ".join("?" * len(batch))), batch)
+
 
 def rerun_if_locked(f):
 
@@ -33,21 +33,23 @@ class StreamBlobDecryptor(object):
                 assert ord(c) == pad_len
             return data
 
-        def write_bytes():
-            if self.len_read < self.length:
-                num_bytes_to_decrypt = greatest_multiple(len(self.buff), self.cipher.block_size)
-                data_to_decrypt, self.buff = split(self.buff, num_bytes_to_decrypt)
-                write_func(self.cipher.decrypt(data_to_decrypt))
-
         def finish_decrypt():
             assert len(self.buff) % self.cipher.block_size == 0
             data_to_decrypt, self.buff = self.buff, b''
             write_func(remove_padding(self.cipher.decrypt(data_to_decrypt)))
 
         def decrypt_bytes(data):
-            self.buff += data
+            # data is a read only buffer into the blob, decrypt it in place and only copy
+            # the trailing partial block (or the padded last block) into self.buff
             self.len_read += len(data)
-            write_bytes()
+            if self.buff:
+                data, self.buff = self.buff + data[:], b''
+            num_bytes_to_decrypt = greatest_multiple(len(data), self.cipher.block_size)
+            if self.len_read >= self.length:
+                num_bytes_to_decrypt = max(0, num_bytes_to_decrypt - self.cipher.block_size)
+            if num_bytes_to_decrypt:
+                write_func(self.cipher.decrypt(buffer(data, 0, num_bytes_to_decrypt)))
+            self.buff = data[num_bytes_to_decrypt:]
 
         d = self.blob.read(decrypt_bytes)
         d.addCallback(lambda _: finish_decrypt())
@@ -0,0 +1,54 @@
+import sqlite3
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def do_migration(db_dir):
+    log.info("Doing the migration")
+    migrate_blobs_db(db_dir)
+    log.info("Migration succeeded")
+
+
+def migrate_blobs_db(db_dir):
+    """Roll the per transfer upload and download tables up into transfer_history"""
+    blobs_db = os.path.join(db_dir, "blobs.db")
+    # skip migration on fresh installs
+    if not os.path.isfile(blobs_db):
+        return
+
+    db_file = sqlite3.connect(blobs_db)
+    file_cursor = db_file.cursor()
+
+    tables = [t for t, in file_cursor.execute("SELECT tbl_name FROM sqlite_master "
+                                              "WHERE type='table'").fetchall()]
+
+    file_cursor.executescript(
+        "CREATE TABLE IF NOT EXISTS transfer_history "
+        "    (direction TEXT NOT NULL, "
+        "     blob_hash TEXT NOT NULL, "
+        "     host TEXT NOT NULL, "
+        "     hour INTEGER NOT NULL, "
+        "     transfers INTEGER NOT NULL, "
+        "     bytes INTEGER NOT NULL, "
+        "     rate_sum REAL NOT NULL, "
+        "     PRIMARY KEY (direction, blob_hash, host, hour)); "
+        "CREATE INDEX IF NOT EXISTS transfer_history_hour_idx "
+        "    ON transfer_history (direction, hour); "
+        "CREATE INDEX IF NOT EXISTS transfer_history_host_idx "
+        "    ON transfer_history (direction, host, hour);"
+    )
+    for direction in ('upload', 'download'):
+        if direction not in tables:
+            continue
+        # the old tables did not record the number of bytes transferred, and older
+        # versions stored a truncated str(blob) instead of the blob hash
+        file_cursor.execute(
+            "INSERT OR IGNORE INTO transfer_history "
+            "    SELECT ?, blob, host, ts / 3600, count(*), 0, sum(rate) FROM {} "
+            "    WHERE length(blob) = 96 AND host IS NOT NULL AND ts IS NOT NULL "
+            "    GROUP BY blob, host, ts / 3600".format(direction), (direction,))
+        file_cursor.execute("DROP TABLE {}".format(direction))
+    db_file.commit()
+    db_file.close()
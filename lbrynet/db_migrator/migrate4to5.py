@@ -0,0 +1,39 @@
+import sqlite3
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def do_migration(db_dir):
+    log.info("Doing the migration")
+    migrate_lbryfile_info_db(db_dir)
+    log.info("Migration succeeded")
+
+
+def migrate_lbryfile_info_db(db_dir):
+    """Index lbry_file_blobs, blob lookups were full table scans"""
+    lbryfile_info_db = os.path.join(db_dir, "lbryfile_info.db")
+    # skip migration on fresh installs
+    if not os.path.isfile(lbryfile_info_db):
+        return
+
+    db_file = sqlite3.connect(lbryfile_info_db)
+    file_cursor = db_file.cursor()
+
+    tables = [t for t, in file_cursor.execute("SELECT tbl_name FROM sqlite_master "
+                                              "WHERE type='table'").fetchall()]
+    if 'lbry_file_blobs' in tables:
+        # without a unique index, adding the blobs of a stream again duplicated them
+        file_cursor.execute(
+            "DELETE FROM lbry_file_blobs WHERE rowid NOT IN "
+            "    (SELECT min(rowid) FROM lbry_file_blobs GROUP BY stream_hash, position)")
+        log.info("Removed %i duplicate stream blobs", file_cursor.rowcount)
+        file_cursor.executescript(
+            "CREATE UNIQUE INDEX IF NOT EXISTS lbry_file_blobs_stream_position_idx "
+            "    ON lbry_file_blobs (stream_hash, position); "
+            "CREATE INDEX IF NOT EXISTS lbry_file_blobs_blob_hash_idx "
+            "    ON lbry_file_blobs (blob_hash, stream_hash);"
+        )
+    db_file.commit()
+    db_file.close()
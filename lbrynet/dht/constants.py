@@ -24,9 +24,17 @@ k = 8
 #: Timeout for network operations (in seconds)
 rpcTimeout = 5
 
-# Delay between iterations of iterative node lookups (for loose parallelism)  (in seconds)
+#: The longest time (in seconds) a lookup probe counts as in flight, and how long it counts
+#: before any round trip time was measured
 iterativeLookupDelay = rpcTimeout / 2
 
+#: The most probes a lookup has in flight, the limit starts at alpha and adapts to timeouts
+maxLookupConcurrency = 3 * alpha
+#: A lookup probe unanswered for this many round trip times no longer counts as in flight
+slowProbeRttFactor = 3
+#: The least time (in seconds) a lookup probe counts as in flight
+minSlowProbeDelay = 0.05
+
 #: If a k-bucket has not been used for this amount of time, refresh it (in seconds)
 refreshTimeout = 3600  # 1 hour
 #: The interval at which nodes replicate (republish/refresh) data they are holding
@@ -35,8 +43,16 @@ replicateInterval = refreshTimeout
 # will also republish the data at this time if it is still valid
 dataExpireTimeout = 86400  # 24 hours
 
+#: The most peers stored for a single key
+maxPeersPerKey = 100
+#: The most peers stored for all keys
+maxStoredPeers = 100000
+
 tokenSecretChangeInterval = 300  # 5 minutes
 
+#: The most keys stored by one storeMany RPC, so that it fits in a single datagram
+maxKeysPerStore = 128
+
 peer_request_timeout = 10
 
 ######## IMPLEMENTATION-SPECIFIC CONSTANTS ###########
@@ -49,6 +65,21 @@ checkRefreshInterval = refreshTimeout / 5
 #: be spread across several UDP packets.
 udpDatagramMaxSize = 8192  # 8 KB
 
+#: Seconds to wait for the rest of the packets of a multi-packet message
+partialMessageTimeout = rpcTimeout * 3
+
+#: The most bytes of incomplete multi-packet messages to hold, the oldest are dropped first
+maxPartialMessageBytes = 2 * 2 ** 20  # 2 MB
+
+#: The most multi-packet messages to receive from one host at a time
+maxPartialMessagesPerSource = 16
+
+#: The most UDP packets to send per second, the old per packet delay allowed about 1000
+maxPacketsPerSecond = 1000
+
+#: The most bytes of UDP packets to send per second
+maxBytesPerSecond = 1024 * 1024  # 1 MB
+
 from lbrynet.core.cryptoutils import get_lbry_hash_obj
 
 h = get_lbry_hash_obj()
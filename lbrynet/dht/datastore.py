@@ -8,6 +8,9 @@
 # may be created by processing this file with epydoc: http://epydoc.sf.net
 
 import UserDict
+import collections
+import heapq
+import sqlite3
 import time
 import constants
 
@@ -22,45 +25,329 @@ class DataStore(UserDict.DictMixin):
     def keys(self):
         """ Return a list of the keys in this data store """
 
+    def __getitem__(self, key):
+        peers = self.getPeersForBlob(key)
+        if not peers:
+            raise KeyError(key)
+        return peers
+
     def addPeerToBlob(self, key, value, lastPublished, originallyPublished, originalPublisherID):
         pass
 
+    def getPeersForBlob(self, key):
+        pass
+
+    def close(self):
+        """ Called when the node stops, release anything held by the data store """
+
 
 class DictDataStore(DataStore):
-    """ A datastore using an in-memory Python dictionary """
+    """ A datastore using an in-memory Python dictionary
 
-    def __init__(self):
+    Peers are stored once per key; a peer announcing a key again replaces its
+    previous entry. Entries are also kept in a heap ordered by the time they
+    were published, so C{removeExpiredPeers} only looks at the entries that
+    have expired, and the oldest entries are dropped first when the store is
+    full.
+    """
+
+    def __init__(self, maxPeersPerKey=None, maxPeers=None):
+        """
+        @param maxPeersPerKey: The most peers to keep for a key, the least
+                               recently announced ones are dropped first
+        @type maxPeersPerKey: int
+        @param maxPeers: The most peers to keep for all keys, the ones that
+                         will expire first are dropped first
+        @type maxPeers: int
+        """
+        if maxPeersPerKey is None:
+            maxPeersPerKey = constants.maxPeersPerKey
+        if maxPeers is None:
+            maxPeers = constants.maxStoredPeers
+        self.maxPeersPerKey = maxPeersPerKey
+        self.maxPeers = maxPeers
         # Dictionary format:
-        # { <key>: (<value>, <lastPublished>, <originallyPublished> <originalPublisherID>) }
+        # { <key>: OrderedDict({<value>: (<value>, <lastPublished>, <originallyPublished>,
+        #                                  <originalPublisherID>)}) }
+        # with the values of a key in the order they were announced in
         self._dict = {}
+        # heap of (<originallyPublished>, <key>, <value>), entries for values that have
+        # since been announced again or removed are skipped when they are popped
+        self._expiryHeap = []
+        self._peerCount = 0
 
     def keys(self):
         """ Return a list of the keys in this data store """
         return self._dict.keys()
 
-    def removeExpiredPeers(self):
-        now = int(time.time())
+    def __len__(self):
+        return len(self._dict)
 
-        def notExpired(peer):
-            if (now - peer[2]) > constants.dataExpireTimeout:
-                return False
-            return True
+    def removeExpiredPeers(self, now=None):
+        """ Remove the peers published more than C{dataExpireTimeout} ago
 
-        for key in self._dict.keys():
-            unexpired_peers = filter(notExpired, self._dict[key])
-            self._dict[key] = unexpired_peers
+        @return: The number of peers removed
+        @rtype: int
+        """
+        if now is None:
+            now = int(time.time())
+        removed = 0
+        while self._expiryHeap and now - self._expiryHeap[0][0] > constants.dataExpireTimeout:
+            if self._removeHeapEntry(heapq.heappop(self._expiryHeap)):
+                removed += 1
+        return removed
 
     def hasPeersForBlob(self, key):
-        if key in self._dict and len(self._dict[key]) > 0:
-            return True
-        return False
+        return bool(self.getPeersForBlob(key))
 
     def addPeerToBlob(self, key, value, lastPublished, originallyPublished, originalPublisherID):
-        if key in self._dict:
-            self._dict[key].append((value, lastPublished, originallyPublished, originalPublisherID))
+        peers = self._dict.get(key)
+        if peers is None:
+            peers = self._dict[key] = collections.OrderedDict()
+        if value in peers:
+            del peers[value]
         else:
-            self._dict[key] = [(value, lastPublished, originallyPublished, originalPublisherID)]
+            self._peerCount += 1
+        peers[value] = (value, lastPublished, originallyPublished, originalPublisherID)
+        heapq.heappush(self._expiryHeap, (originallyPublished, key, value))
+        if len(peers) > self.maxPeersPerKey:
+            peers.popitem(last=False)
+            self._peerCount -= 1
+        while self._peerCount > self.maxPeers:
+            self._removeHeapEntry(heapq.heappop(self._expiryHeap))
+        if len(self._expiryHeap) > 2 * self._peerCount + constants.k:
+            self._rebuildExpiryHeap()
 
     def getPeersForBlob(self, key):
         if key in self._dict:
-            return [val[0] for val in self._dict[key]]
+            now = int(time.time())
+            return [
+                val[0] for val in self._dict[key].itervalues()
+                if now - val[2] <= constants.dataExpireTimeout
+            ]
+
+    def _removeHeapEntry(self, heapEntry):
+        """ Remove the peer of a popped heap entry, unless it was announced again
+        after the entry was added or has already been removed
+
+        @return: Whether the peer was removed
+        @rtype: bool
+        """
+        originallyPublished, key, value = heapEntry
+        peers = self._dict.get(key)
+        if peers is None or value not in peers or peers[value][2] != originallyPublished:
+            return False
+        del peers[value]
+        self._peerCount -= 1
+        if not peers:
+            del self._dict[key]
+        return True
+
+    def _rebuildExpiryHeap(self):
+        """ Drop the outdated entries from the expiry heap """
+        self._expiryHeap = [
+            (val[2], key, val[0])
+            for key, peers in self._dict.iteritems()
+            for val in peers.itervalues()
+        ]
+        heapq.heapify(self._expiryHeap)
+
+
+class SqliteDataStore(DataStore):
+    """ A datastore kept in a sqlite database, so announcements survive restarts
+
+    The peers of the most recently used keys are cached in memory, the rest are
+    looked up in the database when they are requested. Lookups and writes use
+    the primary key index and are done on the reactor, like the rest of the
+    data store API; writes are committed every C{COMMIT_INTERVAL} seconds.
+    The number of keys is kept up to date in memory, so C{len()} is cheap.
+    Expired peers are deleted when the store is opened, so only the unexpired
+    announcements are reloaded.
+    """
+
+    # number of keys whose peers are kept in memory
+    CACHE_SIZE = 1000
+    # seconds between commits of the announcements received
+    COMMIT_INTERVAL = 5
+
+    def __init__(self, path, maxPeersPerKey=None, maxPeers=None, cacheSize=None):
+        """
+        @param path: The sqlite database file
+        @type path: str
+        @param maxPeersPerKey: The most peers to keep for a key, the least
+                               recently announced ones are dropped first
+        @type maxPeersPerKey: int
+        @param maxPeers: The most peers to keep for all keys, the ones that
+                         will expire first are dropped first
+        @type maxPeers: int
+        @param cacheSize: The number of keys to cache the peers of
+        @type cacheSize: int
+        """
+        if maxPeersPerKey is None:
+            maxPeersPerKey = constants.maxPeersPerKey
+        if maxPeers is None:
+            maxPeers = constants.maxStoredPeers
+        self.maxPeersPerKey = maxPeersPerKey
+        self.maxPeers = maxPeers
+        self.cacheSize = cacheSize or self.CACHE_SIZE
+        # { <key>: OrderedDict({<value>: (<value>, <lastPublished>, <originallyPublished>,
+        #                                  <originalPublisherID>)}) }
+        # in least recently used order, the values are in the order they were announced in
+        self._cache = collections.OrderedDict()
+        self._commitCall = None
+        self._db = sqlite3.connect(path)
+        self._db.execute("pragma journal_mode = wal")
+        self._db.execute("pragma synchronous = normal")
+        self._db.execute("create table if not exists peers ("
+                         "    key blob not null,"
+                         "    value blob not null,"
+                         "    last_published integer,"
+                         "    originally_published integer,"
+                         "    original_publisher_id blob,"
+                         "    primary key (key, value)"
+                         ")")
+        self._db.execute("create index if not exists peers_originally_published_idx "
+                         "on peers (originally_published)")
+        self._peerCount = 0
+        self._keyCount = 0
+        self.removeExpiredPeers()
+        self._peerCount = self._db.execute("select count(*) from peers").fetchone()[0]
+        self._keyCount = self._countKeys()
+
+    def keys(self):
+        """ Iterate over the keys in this data store, which must not be changed
+        while doing so """
+        for key, in self._db.execute("select distinct key from peers"):
+            yield str(key)
+
+    def __len__(self):
+        return self._keyCount
+
+    def removeExpiredPeers(self, now=None):
+        """ Remove the peers published more than C{dataExpireTimeout} ago
+
+        @return: The number of peers removed
+        @rtype: int
+        """
+        if now is None:
+            now = int(time.time())
+        oldest = now - constants.dataExpireTimeout
+        removed = self._db.execute(
+            "delete from peers where originally_published < ?", (oldest,)).rowcount
+        self._db.commit()
+        if not removed:
+            return removed
+        self._peerCount -= removed
+        self._keyCount = self._countKeys()
+        for key, peers in self._cache.items():
+            for value, peer in peers.items():
+                if peer[2] < oldest:
+                    del peers[value]
+            if not peers:
+                del self._cache[key]
+        return removed
+
+    def hasPeersForBlob(self, key):
+        return bool(self.getPeersForBlob(key))
+
+    def addPeerToBlob(self, key, value, lastPublished, originallyPublished, originalPublisherID):
+        peers = self._getPeers(key, cache=True)
+        if value in peers:
+            del peers[value]
+        else:
+            if not peers:
+                self._keyCount += 1
+            self._peerCount += 1
+        peers[value] = (value, lastPublished, originallyPublished, originalPublisherID)
+        self._db.execute(
+            "insert or replace into peers values (?, ?, ?, ?, ?)",
+            (sqlite3.Binary(key), sqlite3.Binary(value), lastPublished, originallyPublished,
+             _toBinary(originalPublisherID)))
+        if len(peers) > self.maxPeersPerKey:
+            self._deletePeer(key, next(iter(peers)))
+        if self._peerCount > self.maxPeers:
+            self._removeOldestPeers(self._peerCount - self.maxPeers)
+        self._scheduleCommit()
+
+    def getPeersForBlob(self, key):
+        peers = self._getPeers(key)
+        if peers:
+            now = int(time.time())
+            return [
+                val[0] for val in peers.itervalues()
+                if now - val[2] <= constants.dataExpireTimeout
+            ]
+
+    def close(self):
+        if self._commitCall is not None:
+            self._commitCall.cancel()
+            self._commitCall = None
+        self._db.commit()
+        self._db.close()
+
+    def _getPeers(self, key, cache=False):
+        """ Get the peers of a key from the cache, or load them into it
+
+        Keys without peers are only cached if C{cache} is set, so lookups of
+        unknown keys don't push the known ones out of the cache.
+        """
+        peers = self._cache.pop(key, None)
+        if peers is None:
+            peers = collections.OrderedDict()
+            for row in self._db.execute(
+                    "select value, last_published, originally_published, original_publisher_id "
+                    "from peers where key = ? order by last_published", (sqlite3.Binary(key),)):
+                value = str(row[0])
+                peers[value] = (value, row[1], row[2], _toStr(row[3]))
+        if peers or cache:
+            while len(self._cache) >= self.cacheSize:
+                self._cache.popitem(last=False)
+            self._cache[key] = peers
+        return peers
+
+    def _countKeys(self):
+        return self._db.execute("select count(distinct key) from peers").fetchone()[0]
+
+    def _deletePeer(self, key, value):
+        self._db.execute("delete from peers where key = ? and value = ?",
+                         (sqlite3.Binary(key), sqlite3.Binary(value)))
+        self._peerCount -= 1
+        peers = self._cache.get(key)
+        if peers is not None:
+            peers.pop(value, None)
+            if peers:
+                return
+            del self._cache[key]
+        elif self._db.execute("select 1 from peers where key = ? limit 1",
+                              (sqlite3.Binary(key),)).fetchone() is not None:
+            return
+        self._keyCount -= 1
+
+    def _removeOldestPeers(self, count):
+        rows = self._db.execute(
+            "select key, value from peers order by originally_published limit ?",
+            (count,)).fetchall()
+        for key, value in rows:
+            self._deletePeer(str(key), str(value))
+
+    def _scheduleCommit(self):
+        from twisted.internet import reactor
+
+        if self._commitCall is None:
+            self._commitCall = reactor.callLater(self.COMMIT_INTERVAL, self._commit)
+
+    def _commit(self):
+        self._commitCall = None
+        self._db.commit()
+
+
+def _toBinary(value):
+    if value is None:
+        return None
+    return sqlite3.Binary(value)
+
+
+def _toStr(value):
+    if value is None:
+        return None
+    return str(value)
@@ -52,6 +52,10 @@ class Bencode(Encoding):
     @note: This algorithm differs from the "official" Bencode algorithm in
            that it can encode/decode floating point values in addition to
            integers.
+
+    The encoder appends the encoded parts to a list which is joined once, and
+    the decoder walks the data by offset, so neither copies the data more
+    than once.
     """
 
     def encode(self, data):
@@ -63,33 +67,9 @@ class Bencode(Encoding):
         @return: The encoded data
         @rtype: str
         """
-        if isinstance(data, (int, long)):
-            return 'i%de' % data
-        elif isinstance(data, str):
-            return '%d:%s' % (len(data), data)
-        elif isinstance(data, (list, tuple)):
-            encodedListItems = ''
-            for item in data:
-                encodedListItems += self.encode(item)
-            return 'l%se' % encodedListItems
-        elif isinstance(data, dict):
-            encodedDictItems = ''
-            keys = data.keys()
-            keys.sort()
-            for key in keys:
-                encodedDictItems += self.encode(key)
-                encodedDictItems += self.encode(data[key])
-            return 'd%se' % encodedDictItems
-        elif isinstance(data, float):
-            # This (float data type) is a non-standard extension to the original Bencode algorithm
-            return 'f%fe' % data
-        elif data is None:
-            # This (None/NULL data type) is a non-standard extension
-            # to the original Bencode algorithm
-            return 'n'
-        else:
-            print data
-            raise TypeError("Cannot bencode '%s' object" % type(data))
+        encoded = []
+        self._encodeRecursive(data, encoded)
+        return ''.join(encoded)
 
     def decode(self, data):
         """ Decoder implementation of the Bencode algorithm
@@ -110,45 +90,83 @@ class Bencode(Encoding):
         except ValueError as e:
             raise DecodeError(e.message)
 
+    @staticmethod
+    def _encodeRecursive(data, encoded):
+        """ Append the encoded parts of C{data} to the C{encoded} list """
+        if isinstance(data, str):
+            encoded.append('%d:' % len(data))
+            encoded.append(data)
+        elif isinstance(data, (int, long)):
+            encoded.append('i%de' % data)
+        elif isinstance(data, (list, tuple)):
+            encoded.append('l')
+            for item in data:
+                Bencode._encodeRecursive(item, encoded)
+            encoded.append('e')
+        elif isinstance(data, dict):
+            encoded.append('d')
+            for key in sorted(data):
+                Bencode._encodeRecursive(key, encoded)
+                Bencode._encodeRecursive(data[key], encoded)
+            encoded.append('e')
+        elif isinstance(data, float):
+            # This (float data type) is a non-standard extension to the original Bencode algorithm
+            encoded.append('f%fe' % data)
+        elif data is None:
+            # This (None/NULL data type) is a non-standard extension
+            # to the original Bencode algorithm
+            encoded.append('n')
+        else:
+            raise TypeError("Cannot bencode '%s' object" % type(data))
+
     @staticmethod
     def _decodeRecursive(data, startIndex=0):
         """ Actual implementation of the recursive Bencode algorithm
 
         Do not call this; use C{decode()} instead
+
+        @return: The decoded value, and the index of the data following it
+        @rtype: tuple
         """
-        if data[startIndex] == 'i':
-            endPos = data[startIndex:].find('e') + startIndex
+        token = data[startIndex]
+        if token == 'i':
+            endPos = Bencode._find(data, 'e', startIndex)
             return int(data[startIndex + 1:endPos]), endPos + 1
-        elif data[startIndex] == 'l':
+        elif token == 'l':
             startIndex += 1
             decodedList = []
             while data[startIndex] != 'e':
                 listData, startIndex = Bencode._decodeRecursive(data, startIndex)
                 decodedList.append(listData)
             return decodedList, startIndex + 1
-        elif data[startIndex] == 'd':
+        elif token == 'd':
             startIndex += 1
             decodedDict = {}
             while data[startIndex] != 'e':
                 key, startIndex = Bencode._decodeRecursive(data, startIndex)
                 value, startIndex = Bencode._decodeRecursive(data, startIndex)
                 decodedDict[key] = value
-            return decodedDict, startIndex
-        elif data[startIndex] == 'f':
+            return decodedDict, startIndex + 1
+        elif token == 'f':
             # This (float data type) is a non-standard extension to the original Bencode algorithm
-            endPos = data[startIndex:].find('e') + startIndex
+            endPos = Bencode._find(data, 'e', startIndex)
             return float(data[startIndex + 1:endPos]), endPos + 1
-        elif data[startIndex] == 'n':
+        elif token == 'n':
             # This (None/NULL data type) is a non-standard extension
             # to the original Bencode algorithm
             return None, startIndex + 1
         else:
-            splitPos = data[startIndex:].find(':') + startIndex
-            try:
-                length = int(data[startIndex:splitPos])
-            except ValueError, e:
-                raise DecodeError, e
+            splitPos = Bencode._find(data, ':', startIndex)
+            length = int(data[startIndex:splitPos])
             startIndex = splitPos + 1
             endPos = startIndex + length
-            bytes = data[startIndex:endPos]
-            return bytes, endPos
+            if length < 0 or endPos > len(data):
+                raise DecodeError('String of length %i at %i is cut off' % (length, startIndex))
+            return data[startIndex:endPos], endPos
+
+    @staticmethod
+    def _find(data, char, startIndex):
+        endPos = data.find(char, startIndex)
+        if endPos == -1:
+            raise DecodeError('Missing "%s" after %i' % (char, startIndex))
+        return endPos
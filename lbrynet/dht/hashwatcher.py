@@ -31,4 +31,4 @@ class HashWatcher(object):
 
     def _remove_old_hashes(self):
         remove_time = datetime.datetime.now() - datetime.timedelta(minutes=10)
-        self.hashes = [h for h in self.hashes if h[1] < remove_time]
+        self.hashes = [h for h in self.hashes if h[1] > remove_time]
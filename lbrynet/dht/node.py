@@ -7,8 +7,11 @@
 # The docstrings in this module contain epytext markup; API documentation
 # may be created by processing this file with epydoc: http://epydoc.sf.net
 import binascii
+import bisect
 import hashlib
-import operator
+import heapq
+import json
+import os
 import struct
 import time
 
@@ -19,7 +22,6 @@ import routingtable
 import datastore
 import protocol
 import twisted.internet.reactor
-import twisted.internet.threads
 import twisted.python.log
 
 from contact import Contact
@@ -54,7 +56,7 @@ class Node(object):
 
     def __init__(self, id=None, udpPort=4000, dataStore=None,
                  routingTableClass=None, networkProtocol=None, lbryid=None,
-                 externalIP=None):
+                 externalIP=None, contactsSnapshotPath=None):
         """
         @param dataStore: The data store to use. This must be class inheriting
                           from the C{DataStore} interface (or providing the
@@ -76,6 +78,12 @@ class Node(object):
                                 change the format of the physical RPC messages
                                 being transmitted.
         @type networkProtocol: entangled.kademlia.protocol.KademliaProtocol
+        @param contactsSnapshotPath: A file the contacts in the routing table
+                                     are saved to periodically and when the
+                                     node stops. When joining the network,
+                                     the saved contacts that still respond
+                                     are used instead of the known nodes.
+        @type contactsSnapshotPath: str
         """
         if id != None:
             self.id = id
@@ -94,7 +102,7 @@ class Node(object):
         self.next_change_token_call = None
         # Create k-buckets (for storing contacts)
         if routingTableClass is None:
-            self._routingTable = routingtable.OptimizedTreeRoutingTable(self.id)
+            self._routingTable = routingtable.BisectRoutingTable(self.id)
         else:
             self._routingTable = routingTableClass(self.id)
 
@@ -120,7 +128,9 @@ class Node(object):
                         contactTriple[0], contactTriple[1], contactTriple[2], self._protocol)
                     self._routingTable.addContact(contact)
         self.externalIP = externalIP
+        self.contactsSnapshotPath = contactsSnapshotPath
         self.hash_watcher = HashWatcher()
+        self._lookupStats = LookupStats()
 
     def __del__(self):
         if self._listeningPort is not None:
@@ -137,6 +147,8 @@ class Node(object):
         if self._listeningPort is not None:
             self._listeningPort.stopListening()
         self.hash_watcher.stop()
+        self._saveContactsSnapshot()
+        self._dataStore.close()
 
     def joinNetwork(self, knownNodeAddresses=None):
         """ Causes the Node to join the Kademlia network; normally, this
@@ -165,8 +177,17 @@ class Node(object):
                 bootstrapContacts.append(contact)
         else:
             bootstrapContacts = None
-        # Initiate the Kademlia joining sequence - perform a search for this node's own ID
-        self._joinDeferred = self._iterativeFind(self.id, bootstrapContacts)
+        savedContacts = self._loadContactsSnapshot()
+        if savedContacts:
+            # Contacts that respond are added to the routing table, so lookups can use them
+            # as soon as they respond, instead of after the join finishes
+            self._joinDeferred = self._pingContacts(savedContacts)
+            self._joinDeferred.addCallback(
+                lambda liveContacts: self._iterativeFind(
+                    self.id, None if liveContacts else bootstrapContacts))
+        else:
+            # Initiate the Kademlia joining sequence - perform a search for this node's own ID
+            self._joinDeferred = self._iterativeFind(self.id, bootstrapContacts)
         #        #TODO: Refresh all k-buckets further away than this node's closest neighbour
         # Start refreshing k-buckets periodically, if necessary
         self.next_refresh_call = twisted.internet.reactor.callLater(
@@ -195,7 +216,7 @@ class Node(object):
         # bad estimate of the average number of hashes per node, then multiply by the
         # approximate number of nodes to get a horrendous estimate of the total number
         # of hashes in the DHT
-        num_in_data_store = len(self._dataStore._dict)
+        num_in_data_store = len(self._dataStore)
         if num_in_data_store == 0:
             return 0
         return num_in_data_store * self.getApproximateTotalDHTNodes() / 8
@@ -203,6 +224,9 @@ class Node(object):
     def announceHaveBlob(self, key, port):
         return self.iterativeAnnounceHaveBlob(key, {'port': port, 'lbryid': self.lbryid})
 
+    def announceHaveBlobs(self, keys, port):
+        return self.iterativeAnnounceHaveBlobs(keys, {'port': port, 'lbryid': self.lbryid})
+
     def getPeersForBlob(self, blob_hash):
 
         def expand_and_filter(result):
@@ -227,6 +251,11 @@ class Node(object):
         d.addCallbacks(expand_and_filter, find_failed)
         return d
 
+    def getLookupStats(self):
+        """ Round trip times of lookup RPCs, and the hop count and latency histograms
+        of the finished lookups """
+        return self._lookupStats.getStats()
+
     def get_most_popular_hashes(self, num_to_return):
         return self.hash_watcher.most_popular_hashes(num_to_return)
 
@@ -292,6 +321,92 @@ class Node(object):
         d.addCallbacks(requestPeers)
         return d
 
+    @defer.inlineCallbacks
+    def iterativeAnnounceHaveBlobs(self, blob_hashes, value):
+        """ Announce many blobs, with as few lookups and RPCs as possible
+
+        The keys are announced in order, and the k closest nodes found for a key
+        are reused for the following keys as long as those are closer to it than
+        the furthest of the nodes. Each node gets the keys it is among the
+        closest to in C{storeMany} RPCs of up to C{constants.maxKeysPerStore}
+        keys, or one C{store} RPC per key if it doesn't support C{storeMany}.
+
+        @return: A deferred that fires with a dictionary of the number of nodes
+                 each key was stored at (including this one)
+        @rtype: twisted.internet.defer.Deferred
+        """
+        keys = sorted(set(blob_hashes))
+        stored = dict.fromkeys(keys, 0)
+        # {contact id: (contact, [keys])}
+        keysByContact = {}
+        # the key of the last lookup and the contacts it found
+        lookupKey = None
+        contacts = []
+        lookups = 0
+        for key in keys:
+            if not contacts:
+                reuse = False
+            elif len(contacts) >= constants.k:
+                lookupDistance = Distance(lookupKey)
+                # the key is within the range covered by the last lookup
+                reuse = lookupDistance(key) < lookupDistance.to_contact(contacts[-1])
+            else:
+                # a short result is only every node there is if we don't know k nodes
+                # either, otherwise the lookup may have failed
+                reuse = len(self._routingTable.findCloseNodes(key, constants.k)) < constants.k
+            if not reuse:
+                contacts = yield self.iterativeFindNode(key)
+                lookupKey = key
+                lookups += 1
+            distance = Distance(key)
+            closest = sorted(contacts, key=distance.to_contact)
+            if self.externalIP is not None and (
+                    len(closest) < constants.k or
+                    distance.is_closer(self.id, closest[-1].id)):
+                closest = closest[:constants.k - 1]
+                self.store(key, value, self_store=True, originalPublisherID=self.id)
+                stored[key] += 1
+            for contact in closest:
+                keysByContact.setdefault(contact.id, (contact, []))[1].append(key)
+        log.debug("Announcing %i blobs to %i nodes after %i lookups", len(keys),
+                  len(keysByContact), lookups)
+        results = yield defer.DeferredList([
+            self._storeKeysAtContact(contact, contactKeys, value)
+            for contact, contactKeys in keysByContact.itervalues()
+        ])
+        for success, storedKeys in results:
+            for key in storedKeys:
+                stored[key] += 1
+        defer.returnValue(stored)
+
+    @defer.inlineCallbacks
+    def _storeKeysAtContact(self, contact, keys, value):
+        """ Store the keys at a contact, returns the keys that were stored """
+        storedKeys = []
+        try:
+            result = yield contact.findValue(keys[0])
+            value = dict(value, token=result['token'])
+            for i in range(0, len(keys), constants.maxKeysPerStore):
+                chunk = keys[i:i + constants.maxKeysPerStore]
+                try:
+                    yield contact.storeMany(chunk, value, self.id, 0)
+                    storedKeys.extend(chunk)
+                except Exception as err:
+                    if not str(err).startswith('Invalid method'):
+                        raise
+                    log.debug("%s doesn't support storeMany, storing %i keys one at a time",
+                              contact, len(keys) - i)
+                    for key in keys[i:]:
+                        yield contact.store(key, value, self.id, 0)
+                        storedKeys.append(key)
+                    break
+        except protocol.TimeoutError:
+            log.debug("Timeout while storing %i blob hashes at %s", len(keys), contact)
+        except Exception as err:
+            log.error("Unexpected error while storing %i blob hashes at %s: %s", len(keys),
+                      contact, err)
+        defer.returnValue(storedKeys)
+
     def change_token(self):
         self.old_token_secret = self.token_secret
         self.token_secret = self._generateID()
@@ -453,6 +568,25 @@ class Node(object):
                (which is the case currently) might not be a good idea... will have
                to fix this (perhaps use a stream from the Protocol class?)
         """
+        return self.storeMany([key], value, originalPublisherID, self_store, **kwargs)
+
+    @rpcmethod
+    def storeMany(self, keys, value, originalPublisherID=None, self_store=False, **kwargs):
+        """ Store the same value for several keys in this node's local hash table
+
+        The token in C{value} is only checked once, as tokens are given for
+        the address of the requesting node rather than for a key.
+
+        @param keys: The hashtable keys of the data, at most
+                     C{constants.maxKeysPerStore} of them
+        @type keys: list
+        @param value: The value to associate with each key, see C{store}
+
+        @rtype: str
+        """
+        if not isinstance(keys, (list, tuple)) or len(keys) > constants.maxKeysPerStore:
+            raise ValueError('Invalid keys')
+
         # Get the sender's ID (if any)
         if originalPublisherID is None:
             if '_rpcNodeID' in kwargs:
@@ -470,7 +604,8 @@ class Node(object):
             return 'Not OK'
             # raise TypeError, 'No contact info available'
 
-        if ((self_store is False) and
+        # self_store is only True when storing locally, remote nodes can only send integers
+        if ((self_store is not True) and
                 ('token' not in value or not self.verify_token(value['token'], compact_ip))):
             raise ValueError('Invalid or missing token')
 
@@ -493,8 +628,9 @@ class Node(object):
 
         now = int(time.time())
         originallyPublished = now  # - age
-        self._dataStore.addPeerToBlob(
-            key, compact_address, now, originallyPublished, originalPublisherID)
+        for key in keys:
+            self._dataStore.addPeerToBlob(
+                key, compact_address, now, originallyPublished, originalPublisherID)
         return 'OK'
 
     @rpcmethod
@@ -601,8 +737,7 @@ class Node(object):
         outerDf = defer.Deferred()
 
         helper = _IterativeFindHelper(self, outerDf, shortlist, key, findValue, rpc)
-        # Start the iterations
-        helper.searchIteration()
+        helper.start()
         return outerDf
 
     def _refreshNode(self):
@@ -610,6 +745,7 @@ class Node(object):
         replication/republishing as necessary """
         df = self._refreshRoutingTable()
         df.addCallback(self._removeExpiredPeers)
+        df.addCallback(self._saveContactsSnapshot)
         df.addCallback(self._scheduleNextNodeRefresh)
 
     def _refreshRoutingTable(self):
@@ -635,211 +771,305 @@ class Node(object):
 
     # args put here because _refreshRoutingTable does outerDF.callback(None)
     def _removeExpiredPeers(self, *args):
-        df = twisted.internet.threads.deferToThread(self._dataStore.removeExpiredPeers)
-        return df
+        # the data store only looks at the expired peers, so this is quick enough to do
+        # on the reactor, where the data store is updated
+        self._dataStore.removeExpiredPeers()
+
+    def _saveContactsSnapshot(self, *args):
+        if self.contactsSnapshotPath is None:
+            return
+        contacts = [
+            {'id': contact.id.encode('hex'), 'address': contact.address,
+             'port': contact.port, 'lastSeen': contact.commTime}
+            for bucket in self._routingTable._buckets for contact in bucket._contacts
+        ]
+        if not contacts:
+            # don't replace the contacts saved by a previous run before the node has any
+            return
+        try:
+            with open(self.contactsSnapshotPath, 'w') as snapshot_file:
+                json.dump(contacts, snapshot_file)
+        except (IOError, OSError) as err:
+            log.warning("Failed to save the dht contacts to %s: %s",
+                        self.contactsSnapshotPath, err)
+
+    def _loadContactsSnapshot(self):
+        """ Read the contacts saved by C{_saveContactsSnapshot}, most recently seen first
+
+        @rtype: list
+        """
+        if self.contactsSnapshotPath is None or not os.path.isfile(self.contactsSnapshotPath):
+            return []
+        try:
+            with open(self.contactsSnapshotPath) as snapshot_file:
+                saved = json.load(snapshot_file)
+            saved.sort(key=lambda c: c['lastSeen'], reverse=True)
+            return [
+                Contact(str(c['id']).decode('hex'), str(c['address']), int(c['port']),
+                        self._protocol, c['lastSeen'])
+                for c in saved
+            ]
+        except (IOError, ValueError, TypeError, KeyError) as err:
+            log.warning("Failed to load the dht contacts from %s: %s",
+                        self.contactsSnapshotPath, err)
+            return []
+
+    def _pingContacts(self, contacts):
+        """ Ping the contacts in parallel
+
+        @return: A deferred that fires with the contacts that responded, as soon
+                 as k of them have responded or all of the pings have finished
+        @rtype: twisted.internet.defer.Deferred
+        """
+        d = defer.Deferred()
+        liveContacts = []
+        pending = [len(contacts)]
+
+        def pingFinished(result, contact):
+            pending[0] -= 1
+            if result == 'pong':
+                liveContacts.append(contact)
+            if not d.called and (len(liveContacts) >= constants.k or not pending[0]):
+                log.info("%i of %i saved dht contacts responded", len(liveContacts),
+                         len(contacts))
+                d.callback(list(liveContacts))
+
+        for contact in contacts:
+            pingDf = contact.ping()
+            pingDf.addErrback(lambda err: None)
+            pingDf.addCallback(pingFinished, contact)
+        return d
+
+
+class LookupStats(object):
+    """ Round trip times of lookup RPCs and histograms of finished lookups
+
+    The round trip time estimate is shared by the lookups of a node, so a new
+    lookup starts with what the previous ones observed.
+    """
+
+    # upper bounds of the lookup latency histogram buckets, in milliseconds
+    LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+    # weight of a new round trip time sample in the smoothed estimate
+    RTT_GAIN = 0.125
+
+    def __init__(self):
+        self.rtt = None
+        self.lookups = 0
+        self.probes = 0
+        self.timeouts = 0
+        self.hops = {}
+        self.latency = dict.fromkeys(self.LATENCY_BUCKETS_MS + (None,), 0)
+
+    def addRoundTrip(self, rtt):
+        self.probes += 1
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            self.rtt += self.RTT_GAIN * (rtt - self.rtt)
+
+    def addTimeout(self):
+        self.probes += 1
+        self.timeouts += 1
+
+    def slowProbeDelay(self):
+        """ Seconds after which an unanswered probe no longer counts as in flight """
+        if self.rtt is None:
+            return constants.iterativeLookupDelay
+        return min(constants.iterativeLookupDelay,
+                   max(constants.minSlowProbeDelay, constants.slowProbeRttFactor * self.rtt))
+
+    def addLookup(self, hops, latency):
+        self.lookups += 1
+        self.hops[hops] = self.hops.get(hops, 0) + 1
+        latencyMs = 1000 * latency
+        for bucket in self.LATENCY_BUCKETS_MS:
+            if latencyMs <= bucket:
+                break
+        else:
+            bucket = None
+        self.latency[bucket] += 1
+
+    def getStats(self):
+        return {
+            'lookups': self.lookups,
+            'probes': self.probes,
+            'timeouts': self.timeouts,
+            'rtt_ms': 1000 * self.rtt if self.rtt is not None else None,
+            'hops': dict(self.hops),
+            'latency_ms': [(bucket, self.latency[bucket])
+                           for bucket in self.LATENCY_BUCKETS_MS + (None,)],
+        }
 
 
-# This was originally a set of nested methods in _iterativeFind
-# but they have been moved into this helper class in-order to
-# have better scoping and readability
 class _IterativeFindHelper(object):
-    # TODO: use polymorphism to search for a value or node
-    #       instead of using a find_value flag
-    def __init__(self, node, outer_d, shortlist, key, find_value, rpc):
+    """ A parallel Kademlia lookup
+
+    Contacts that have not been probed yet are kept in a heap ordered by their
+    distance to the key, and the closest ones are probed while fewer than the
+    concurrency limit are in flight. The limit grows as probes are answered and
+    is halved when one times out; a probe that is unanswered for a few round
+    trip times is slow, and no longer counts towards it. The lookup finishes as
+    soon as the k closest contacts found have all responded (not waiting for
+    slow probes), or the value was found.
+    """
+
+    def __init__(self, node, outer_d, shortlist, key, find_value, rpc, clock=None):
         self.node = node
         self.outer_d = outer_d
-        self.shortlist = shortlist
         self.key = key
         self.find_value = find_value
         self.rpc = rpc
+        self.clock = clock or twisted.internet.reactor
+        self.stats = node._lookupStats
         # all distance operations in this class only care about the distance
         # to self.key, so this makes it easier to calculate those
         self.distance = Distance(key)
-        # List of active queries; len() indicates number of active probes
-        #
-        # n.b: using lists for these variables, because Python doesn't
-        #   allow binding a new value to a name in an enclosing
-        #   (non-global) scope
-        self.active_probes = []
-        # List of contact IDs that have already been queried
-        self.already_contacted = []
-        # Probes that were active during the previous iteration
-        # A list of found and known-to-be-active remote nodes
-        self.active_contacts = []
-        # This should only contain one entry; the next scheduled iteration call
-        self.pending_iteration_calls = []
-        self.prev_closest_node = [None]
+        # [(distance, contact id, hop, contact)] of the contacts not probed yet
+        self.candidates = []
+        # ids of every contact added to the candidates, probed or not
+        self.known = set()
+        # {contact id: (distance, hop, contact, time sent)} of the unanswered probes
+        self.in_flight = {}
+        # [(distance, contact id, contact)] of the contacts that responded, closest first
+        self.active = []
+        self.responded = set()
+        self.concurrency = float(constants.alpha)
+        self.hops = 0
+        self.started = self.clock.seconds()
+        self.slow_probe_call = None
         self.find_value_result = {}
-        self.slow_node_count = [0]
+        self.finished = False
+        for contact in shortlist:
+            self._addCandidate(contact, 1)
 
-    def extendShortlist(self, responseTuple):
-        """ @type responseMsg: kademlia.msgtypes.ResponseMessage """
-        # The "raw response" tuple contains the response message,
-        # and the originating address info
-        responseMsg = responseTuple[0]
-        originAddress = responseTuple[1]  # tuple: (ip adress, udp port)
-        # Make sure the responding node is valid, and abort the operation if it isn't
-        if responseMsg.nodeID in self.active_contacts or responseMsg.nodeID == self.node.id:
-            return responseMsg.nodeID
-
-        # Mark this node as active
-        aContact = self._getActiveContact(responseMsg, originAddress)
-        self.active_contacts.append(aContact)
-
-        # This makes sure "bootstrap"-nodes with "fake" IDs don't get queried twice
-        if responseMsg.nodeID not in self.already_contacted:
-            self.already_contacted.append(responseMsg.nodeID)
-        # Now grow extend the (unverified) shortlist with the returned contacts
-        result = responseMsg.response
-        # TODO: some validation on the result (for guarding against attacks)
-        # If we are looking for a value, first see if this result is the value
-        # we are looking for before treating it as a list of contact triples
-        if self.find_value is True and self.key in result and not 'contacts' in result:
-            # We have found the value
-            self.find_value_result[self.key] = result[self.key]
-            self.find_value_result['from_peer'] = aContact.address
-        else:
-            if self.find_value is True:
-                self._setClosestNodeValue(responseMsg, aContact)
-            self._keepSearching(result)
-        return responseMsg.nodeID
-
-    def _getActiveContact(self, responseMsg, originAddress):
-        if responseMsg.nodeID in self.shortlist:
-            # Get the contact information from the shortlist...
-            return self.shortlist[self.shortlist.index(responseMsg.nodeID)]
-        else:
-            # If it's not in the shortlist; we probably used a fake ID to reach it
-            # - reconstruct the contact, using the real node ID this time
-            return Contact(
-                responseMsg.nodeID, originAddress[0], originAddress[1], self.node._protocol)
+    def start(self):
+        self.searchIteration()
 
-    def _keepSearching(self, result):
-        contactTriples = self._getContactTriples(result)
-        for contactTriple in contactTriples:
-            self._addIfValid(contactTriple)
+    def _addCandidate(self, contact, hop):
+        if contact.id in self.known or contact.id == self.node.id:
+            return
+        self.known.add(contact.id)
+        heapq.heappush(self.candidates,
+                       (self.distance(contact.id), contact.id, hop, contact))
 
-    def _getContactTriples(self, result):
-        if self.find_value is True:
-            return result['contacts']
-        else:
-            return result
+    def _slowProbeCutoff(self, now):
+        return now - self.stats.slowProbeDelay()
 
-    def _setClosestNodeValue(self, responseMsg, aContact):
+    def searchIteration(self):
+        """ Probe the closest candidates while there is room in flight, or finish """
+        if self.finished:
+            return
+        now = self.clock.seconds()
+        cutoff = self._slowProbeCutoff(now)
+        # the probes that are not slow
+        pending = [probe for probe in self.in_flight.itervalues() if probe[3] > cutoff]
+        if self._isDone(pending):
+            self._finish()
+            return
+        inFlight = len(pending)
+        while self.candidates and inFlight < int(self.concurrency):
+            distance, contactID, hop, contact = heapq.heappop(self.candidates)
+            self._probeContact(distance, hop, contact, now)
+            pending.append(self.in_flight[contactID])
+            inFlight += 1
+        self._scheduleSlowProbeCheck(pending, cutoff)
+
+    def _isDone(self, pending):
+        if self.key in self.find_value_result:
+            return True
+        if len(self.active) < constants.k:
+            return not self.candidates and not pending
+        # done when no contact that may still respond in time is closer than the k-th
+        # closest contact that responded
+        kthDistance = self.active[constants.k - 1][0]
+        if self.candidates and self.candidates[0][0] < kthDistance:
+            return False
+        return all(probe[0] > kthDistance for probe in pending)
+
+    def _scheduleSlowProbeCheck(self, pending, cutoff):
+        if self.slow_probe_call is not None and self.slow_probe_call.active():
+            self.slow_probe_call.cancel()
+        self.slow_probe_call = None
+        if pending:
+            # at least a millisecond, so rounding can't keep a probe from becoming slow
+            self.slow_probe_call = self.clock.callLater(
+                max(0.001, min(probe[3] for probe in pending) - cutoff), self.searchIteration)
+
+    def _probeContact(self, distance, hop, contact, now):
+        self.in_flight[contact.id] = (distance, hop, contact, now)
+        rpcMethod = getattr(contact, self.rpc)
+        df = rpcMethod(self.key, rawResponse=True)
+        df.addCallbacks(self.extendShortlist, self.probeFailed,
+                        callbackArgs=(contact.id,), errbackArgs=(contact.id,))
+        df.addErrback(log.fail(), 'Failed to handle the response of %s', contact)
+
+    def extendShortlist(self, responseTuple, contactID):
+        """ @type responseTuple: (kademlia.msgtypes.ResponseMessage, address tuple) """
+        distance, hop, contact, sent = self.in_flight.pop(contactID)
+        # The "raw response" tuple contains the response message,
+        # and the originating address info
+        responseMsg, originAddress = responseTuple
+        self.stats.addRoundTrip(self.clock.seconds() - sent)
+        self.concurrency = min(float(constants.maxLookupConcurrency),
+                               self.concurrency + 1 / self.concurrency)
+        if responseMsg.nodeID != contactID:
+            # A "bootstrap" contact with a fake ID, use its real ID from now on
+            contact = Contact(
+                responseMsg.nodeID, originAddress[0], originAddress[1], self.node._protocol)
+            distance = self.distance(contact.id)
+            self.known.add(contact.id)
+        if contact.id not in self.responded and contact.id != self.node.id:
+            self.responded.add(contact.id)
+            bisect.insort(self.active, (distance, contact.id, contact))
+            self.hops = max(self.hops, hop)
+            result = responseMsg.response
+            # TODO: some validation on the result (for guarding against attacks)
+            # If we are looking for a value, first see if this result is the value
+            # we are looking for before treating it as a list of contact triples
+            if self.find_value is True and self.key in result and 'contacts' not in result:
+                # We have found the value
+                self.find_value_result[self.key] = result[self.key]
+                self.find_value_result['from_peer'] = contact.address
+            else:
+                if self.find_value is True:
+                    self._setClosestNodeValue(distance, contact)
+                    result = result['contacts']
+                for contactTriple in result:
+                    if isinstance(contactTriple, (list, tuple)) and len(contactTriple) == 3:
+                        self._addCandidate(Contact(contactTriple[0], contactTriple[1],
+                                                   contactTriple[2], self.node._protocol),
+                                           hop + 1)
+        self.searchIteration()
+
+    def _setClosestNodeValue(self, distance, contact):
         # We are looking for a value, and the remote node didn't have it
         # - mark it as the closest "empty" node, if it is
-        if 'closestNodeNoValue' in self.find_value_result:
-            if self._is_closer(responseMsg):
-                self.find_value_result['closestNodeNoValue'] = aContact
-        else:
-            self.find_value_result['closestNodeNoValue'] = aContact
-
-    def _is_closer(self, responseMsg):
-        return self.distance.is_closer(responseMsg.nodeID, self.active_contacts[0].id)
+        closest = self.find_value_result.get('closestNodeNoValue')
+        if closest is None or distance < self.distance.to_contact(closest):
+            self.find_value_result['closestNodeNoValue'] = contact
 
-    def _addIfValid(self, contactTriple):
-        if isinstance(contactTriple, (list, tuple)) and len(contactTriple) == 3:
-            testContact = Contact(
-                contactTriple[0], contactTriple[1], contactTriple[2], self.node._protocol)
-            if testContact not in self.shortlist:
-                self.shortlist.append(testContact)
-
-    def removeFromShortlist(self, failure):
+    def probeFailed(self, failure, contactID):
         """ @type failure: twisted.python.failure.Failure """
-        failure.trap(protocol.TimeoutError)
-        deadContactID = failure.getErrorMessage()
-        if deadContactID in self.shortlist:
-            self.shortlist.remove(deadContactID)
-        return deadContactID
-
-    def cancelActiveProbe(self, contactID):
-        self.active_probes.pop()
-        if len(self.active_probes) <= constants.alpha / 2 and len(self.pending_iteration_calls):
-            # Force the iteration
-            self.pending_iteration_calls[0].cancel()
-            del self.pending_iteration_calls[0]
-            self.searchIteration()
-
-    def sortByDistance(self, contact_list):
-        """Sort the list of contacts in order by distance from key"""
-        ExpensiveSort(contact_list, self.distance.to_contact).sort()
-
-    # Send parallel, asynchronous FIND_NODE RPCs to the shortlist of contacts
-    def searchIteration(self):
-        self.slow_node_count[0] = len(self.active_probes)
-        # Sort the discovered active nodes from closest to furthest
-        self.sortByDistance(self.active_contacts)
-        # This makes sure a returning probe doesn't force calling this function by mistake
-        while len(self.pending_iteration_calls):
-            del self.pending_iteration_calls[0]
-        # See if should continue the search
+        contact = self.in_flight.pop(contactID)[2]
+        if failure.check(protocol.TimeoutError):
+            self.stats.addTimeout()
+            self.concurrency = max(1.0, self.concurrency / 2)
+        else:
+            log.warning("Failed to contact %s: %s", contact, failure.getErrorMessage())
+        self.searchIteration()
+
+    def _finish(self):
+        self.finished = True
+        if self.slow_probe_call is not None and self.slow_probe_call.active():
+            self.slow_probe_call.cancel()
+        self.slow_probe_call = None
+        self.stats.addLookup(self.hops, self.clock.seconds() - self.started)
         if self.key in self.find_value_result:
             self.outer_d.callback(self.find_value_result)
-            return
-        elif len(self.active_contacts) and self.find_value is False:
-            if self._is_all_done():
-                # TODO: Re-send the FIND_NODEs to all of the k closest nodes not already queried
-                #
-                # Ok, we're done; either we have accumulated k active
-                # contacts or no improvement in closestNode has been
-                # noted
-                self.outer_d.callback(self.active_contacts)
-                return
-        # The search continues...
-        if len(self.active_contacts):
-            self.prev_closest_node[0] = self.active_contacts[0]
-        contactedNow = 0
-        self.sortByDistance(self.shortlist)
-        # Store the current shortList length before contacting other nodes
-        prevShortlistLength = len(self.shortlist)
-        for contact in self.shortlist:
-            if contact.id not in self.already_contacted:
-                self._probeContact(contact)
-                contactedNow += 1
-            if contactedNow == constants.alpha:
-                break
-        if self._should_lookup_active_calls():
-            # Schedule the next iteration if there are any active
-            # calls (Kademlia uses loose parallelism)
-            call = twisted.internet.reactor.callLater(
-                constants.iterativeLookupDelay, self.searchIteration)  # IGNORE:E1101
-            self.pending_iteration_calls.append(call)
-        # Check for a quick contact response that made an update to the shortList
-        elif prevShortlistLength < len(self.shortlist):
-            # Ensure that the closest contacts are taken from the updated shortList
-            self.searchIteration()
         else:
-            # If no probes were sent, there will not be any improvement, so we're done
-            self.outer_d.callback(self.active_contacts)
-
-    def _probeContact(self, contact):
-        self.active_probes.append(contact.id)
-        rpcMethod = getattr(contact, self.rpc)
-        df = rpcMethod(self.key, rawResponse=True)
-        df.addCallback(self.extendShortlist)
-        df.addErrback(self.removeFromShortlist)
-        df.addCallback(self.cancelActiveProbe)
-        df.addErrback(log.fail(), 'Failed to contact %s', contact)
-        self.already_contacted.append(contact.id)
-
-    def _should_lookup_active_calls(self):
-        return (
-            len(self.active_probes) > self.slow_node_count[0] or
-            (
-                len(self.shortlist) < constants.k and
-                len(self.active_contacts) < len(self.shortlist) and
-                len(self.active_probes) > 0
-            )
-        )
-
-    def _is_all_done(self):
-        return (
-            len(self.active_contacts) >= constants.k or
-            (
-                self.active_contacts[0] == self.prev_closest_node[0] and
-                len(self.active_probes) == self.slow_node_count[0]
-            )
-        )
+            self.outer_d.callback(
+                [contact for _, _, contact in self.active[:constants.k]])
 
 
 class Distance(object):
@@ -864,38 +1094,3 @@ class Distance(object):
     def to_contact(self, contact):
         """A convenience function for calculating the distance to a contact"""
         return self(contact.id)
-
-
-class ExpensiveSort(object):
-    """Sort a list in place.
-
-    The result of `key(item)` is cached for each item in the `to_sort`
-    list as an optimization.  This can be useful when `key` is
-    expensive.
-
-    Attributes:
-        to_sort: a list of items to sort
-        key: callable, like `key` in normal python sort
-        attr: the attribute name used to cache the value on each item.
-    """
-
-    def __init__(self, to_sort, key, attr='__value'):
-        self.to_sort = to_sort
-        self.key = key
-        self.attr = attr
-
-    def sort(self):
-        self._cacheValues()
-        self._sortByValue()
-        self._removeValue()
-
-    def _cacheValues(self):
-        for item in self.to_sort:
-            setattr(item, self.attr, self.key(item))
-
-    def _sortByValue(self):
-        self.to_sort.sort(key=operator.attrgetter(self.attr))
-
-    def _removeValue(self):
-        for item in self.to_sort:
-            delattr(item, self.attr)
@@ -9,13 +9,13 @@
 
 import logging
 import binascii
+import collections
 import time
 import socket
 import errno
 
 from twisted.internet import protocol, defer
 from twisted.python import failure
-from twisted.internet import error
 import twisted.internet.reactor
 
 import constants
@@ -39,30 +39,222 @@ class TimeoutError(Exception):
         self.remote_contact_id = remote_contact_id
 
 
-class Delay(object):
-    maxToSendDelay = 10 ** -3  # 0.05
-    minToSendDelay = 10 ** -5  # 0.01
+class SendQueue(object):
+    """ The queue of UDP packets waiting to be sent
 
-    def __init__(self, start=0):
-        self._next = start
+    Packets are written from one delayed call at a time, within a budget of
+    C{packetsPerSecond} and C{bytesPerSecond} (token buckets that can fill up
+    with C{BURST_SECONDS} worth of budget). Responses to the RPCs of other
+    nodes are sent before our own requests, so our lookups can't hold up
+    answering others.
+    """
 
-    # TODO: explain why this logic is like it is. And add tests that
-    #       show that it actually does what it needs to do.
-    def __call__(self):
-        ts = time.time()
-        delay = 0
-        if ts >= self._next:
-            delay = self.minToSendDelay
-            self._next = ts + self.minToSendDelay
-        else:
-            delay = (self._next - ts) + self.maxToSendDelay
-            self._next += self.maxToSendDelay
-        return delay
+    PRIORITY_RESPONSE = 0
+    PRIORITY_REQUEST = 1
+    # how much unused budget can build up, in seconds of the rate
+    BURST_SECONDS = 0.1
+
+    def __init__(self, write, packetsPerSecond=None, bytesPerSecond=None, clock=None):
+        """
+        @param write: Called with (data, address) to send each packet
+        @param packetsPerSecond: The most packets to send per second
+        @type packetsPerSecond: int
+        @param bytesPerSecond: The most bytes to send per second
+        @type bytesPerSecond: int
+        @param clock: The reactor to schedule sends with, for tests
+        """
+        if packetsPerSecond is None:
+            packetsPerSecond = constants.maxPacketsPerSecond
+        if bytesPerSecond is None:
+            bytesPerSecond = constants.maxBytesPerSecond
+        self._write = write
+        self.packetsPerSecond = packetsPerSecond
+        self.bytesPerSecond = bytesPerSecond
+        self._clock = clock or reactor
+        self._maxPacketTokens = max(1.0, packetsPerSecond * self.BURST_SECONDS)
+        self._maxByteTokens = max(float(constants.udpDatagramMaxSize),
+                                  bytesPerSecond * self.BURST_SECONDS)
+        self._packetTokens = self._maxPacketTokens
+        self._byteTokens = self._maxByteTokens
+        self._lastRefill = self._clock.seconds()
+        # [(data, address, time queued)] for each priority
+        self._queues = (collections.deque(), collections.deque())
+        self._sendCall = None
+        self.stats = {'packets_sent': 0, 'bytes_sent': 0, 'packets_dropped': 0,
+                      'total_latency': 0.0, 'max_latency': 0.0}
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues)
+
+    def put(self, data, address, priority):
+        self._queues[priority].append((data, address, self._clock.seconds()))
+        if self._sendCall is None:
+            self._sendCall = self._clock.callLater(0, self._sendQueued)
+
+    def stop(self):
+        """ Drop the queued packets """
+        if self._sendCall is not None:
+            self._sendCall.cancel()
+            self._sendCall = None
+        for queue in self._queues:
+            self.stats['packets_dropped'] += len(queue)
+            queue.clear()
+
+    def getStats(self):
+        sent = self.stats['packets_sent']
+        return {
+            'queued_responses': len(self._queues[self.PRIORITY_RESPONSE]),
+            'queued_requests': len(self._queues[self.PRIORITY_REQUEST]),
+            'packets_sent': sent,
+            'bytes_sent': self.stats['bytes_sent'],
+            'packets_dropped': self.stats['packets_dropped'],
+            'avg_latency_ms': 1000 * self.stats['total_latency'] / sent if sent else 0.0,
+            'max_latency_ms': 1000 * self.stats['max_latency'],
+        }
+
+    def _refill(self, now):
+        elapsed = max(0.0, now - self._lastRefill)
+        self._lastRefill = now
+        self._packetTokens = min(self._maxPacketTokens,
+                                 self._packetTokens + elapsed * self.packetsPerSecond)
+        self._byteTokens = min(self._maxByteTokens,
+                               self._byteTokens + elapsed * self.bytesPerSecond)
+
+    def _sendQueued(self):
+        self._sendCall = None
+        now = self._clock.seconds()
+        self._refill(now)
+        for queue in self._queues:
+            while queue:
+                data, address, queuedAt = queue[0]
+                # a packet bigger than the bucket is sent once the bucket is full
+                size = min(len(data), self._maxByteTokens)
+                if self._packetTokens < 1 or self._byteTokens < size:
+                    self._scheduleSend(size)
+                    return
+                queue.popleft()
+                self._packetTokens -= 1
+                self._byteTokens -= len(data)
+                latency = now - queuedAt
+                self.stats['packets_sent'] += 1
+                self.stats['bytes_sent'] += len(data)
+                self.stats['total_latency'] += latency
+                self.stats['max_latency'] = max(self.stats['max_latency'], latency)
+                self._write(data, address)
+
+    def _scheduleSend(self, size):
+        """ Send again once there is budget for a packet of C{size} bytes """
+        delay = max((1 - self._packetTokens) / self.packetsPerSecond,
+                    (size - self._byteTokens) / self.bytesPerSecond,
+                    0)
+        self._sendCall = self._clock.callLater(delay, self._sendQueued)
+
+
+class PartialMessages(object):
+    """ Fragments of the multi-packet messages being received
+
+    Messages that aren't completed within C{ttl} seconds are dropped, as are
+    the oldest messages when the fragments held take more than C{maxBytes},
+    and new messages from a host that already has C{maxPerSource} messages
+    in progress. How many messages were completed, expired or dropped is
+    counted in C{stats}.
+    """
+
+    def __init__(self, ttl=None, maxBytes=None, maxPerSource=None):
+        if ttl is None:
+            ttl = constants.partialMessageTimeout
+        if maxBytes is None:
+            maxBytes = constants.maxPartialMessageBytes
+        if maxPerSource is None:
+            maxPerSource = constants.maxPartialMessagesPerSource
+        self.ttl = ttl
+        self.maxBytes = maxBytes
+        self.maxPerSource = maxPerSource
+        # {msgID: [address, totalPackets, {seqNumber: data}, size, started]}, oldest first
+        self._messages = collections.OrderedDict()
+        self._messagesPerSource = {}  # {host: number of messages in progress}
+        self.bytes = 0
+        self.stats = {'completed': 0, 'expired': 0, 'dropped': 0, 'invalid_fragments': 0}
+
+    def __contains__(self, msgID):
+        return msgID in self._messages
+
+    def __len__(self):
+        return len(self._messages)
+
+    def fragmentCount(self, msgID):
+        return len(self._messages[msgID][2])
+
+    def add(self, msgID, address, totalPackets, seqNumber, data):
+        """ Add a fragment of a message
+
+        @return: The whole message once all of its fragments have been added,
+                 otherwise C{None}
+        @rtype: str
+        """
+        self.expire()
+        if not 0 <= seqNumber < totalPackets:
+            self.stats['invalid_fragments'] += 1
+            return None
+        message = self._messages.get(msgID)
+        if message is None:
+            if self._messagesPerSource.get(address[0], 0) >= self.maxPerSource:
+                self.stats['dropped'] += 1
+                return None
+            message = [address, totalPackets, {}, 0, time.time()]
+            self._messages[msgID] = message
+            self._messagesPerSource[address[0]] = self._messagesPerSource.get(address[0], 0) + 1
+        elif message[0] != address or message[1] != totalPackets:
+            # fragments from someone else can't be part of this message
+            self.stats['invalid_fragments'] += 1
+            return None
+        fragments = message[2]
+        if seqNumber not in fragments:
+            fragments[seqNumber] = data
+            message[3] += len(data)
+            self.bytes += len(data)
+        if len(fragments) == totalPackets:
+            self.remove(msgID)
+            self.stats['completed'] += 1
+            return ''.join(fragments[i] for i in xrange(totalPackets))
+        while self.bytes > self.maxBytes:
+            self.remove(next(iter(self._messages)))
+            self.stats['dropped'] += 1
+        return None
+
+    def expire(self, now=None):
+        """ Drop the messages started more than C{ttl} seconds ago """
+        if now is None:
+            now = time.time()
+        while self._messages:
+            msgID, message = next(self._messages.iteritems())
+            if now - message[4] <= self.ttl:
+                break
+            self.remove(msgID)
+            self.stats['expired'] += 1
+
+    def remove(self, msgID):
+        message = self._messages.pop(msgID, None)
+        if message is None:
+            return
+        self.bytes -= message[3]
+        host = message[0][0]
+        self._messagesPerSource[host] -= 1
+        if not self._messagesPerSource[host]:
+            del self._messagesPerSource[host]
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats['in_progress'] = len(self._messages)
+        stats['bytes'] = self.bytes
+        return stats
 
 
 class KademliaProtocol(protocol.DatagramProtocol):
     """ Implements all low-level network-related functions of a Kademlia node """
-    msgSizeLimit = constants.udpDatagramMaxSize - 26
+    # multi-packet header: type, number of packets, sequence number, rpc id and a 0 byte
+    packetHeaderSize = 1 + 2 + 2 + constants.key_bits / 8 + 1
+    msgSizeLimit = constants.udpDatagramMaxSize - packetHeaderSize
 
     def __init__(self, node, msgEncoder=encoding.Bencode(),
                  msgTranslator=msgformat.DefaultFormat()):
@@ -70,12 +262,11 @@ class KademliaProtocol(protocol.DatagramProtocol):
         self._encoder = msgEncoder
         self._translator = msgTranslator
         self._sentMessages = {}
-        self._partialMessages = {}
+        self._partialMessages = PartialMessages()
+        # {msgID: fragments received} of our RPCs whose responses were being received
+        # when they timed out
         self._partialMessagesProgress = {}
-        self._delay = Delay()
-        # keep track of outstanding writes so that they
-        # can be cancelled on shutdown
-        self._call_later_list = {}
+        self._sendQueue = SendQueue(self._write)
 
     def sendRPC(self, contact, method, args, rawResponse=False):
         """ Sends an RPC to the specified contact
@@ -128,23 +319,16 @@ class KademliaProtocol(protocol.DatagramProtocol):
         @note: This is automatically called by Twisted when the protocol
                receives a UDP datagram
         """
-        if datagram[0] == '\x00' and datagram[25] == '\x00':
+        headerEnd = self.packetHeaderSize - 1
+        if datagram[0] == '\x00' and datagram[headerEnd] == '\x00':
             totalPackets = (ord(datagram[1]) << 8) | ord(datagram[2])
-            msgID = datagram[5:25]
+            msgID = datagram[5:headerEnd]
             seqNumber = (ord(datagram[3]) << 8) | ord(datagram[4])
-            if msgID not in self._partialMessages:
-                self._partialMessages[msgID] = {}
-            self._partialMessages[msgID][seqNumber] = datagram[26:]
-            if len(self._partialMessages[msgID]) == totalPackets:
-                keys = self._partialMessages[msgID].keys()
-                keys.sort()
-                data = ''
-                for key in keys:
-                    data += self._partialMessages[msgID][key]
-                    datagram = data
-                del self._partialMessages[msgID]
-            else:
+            datagram = self._partialMessages.add(
+                msgID, address, totalPackets, seqNumber, datagram[headerEnd + 1:])
+            if datagram is None:
                 return
+            self._partialMessagesProgress.pop(msgID, None)
         try:
             msgPrimitive = self._encoder.decode(datagram)
         except encoding.DecodeError:
@@ -155,7 +339,7 @@ class KademliaProtocol(protocol.DatagramProtocol):
             return
 
         message = self._translator.fromPrimitive(msgPrimitive)
-        remoteContact = Contact(message.nodeID, address[0], address[1], self)
+        remoteContact = Contact(message.nodeID, address[0], address[1], self, int(time.time()))
 
         # Refresh the remote node's details in the local node's k-buckets
         self._node.addContact(remoteContact)
@@ -188,7 +372,7 @@ class KademliaProtocol(protocol.DatagramProtocol):
                 # TODO: we should probably do something with this...
                 pass
 
-    def _send(self, data, rpcID, address):
+    def _send(self, data, rpcID, address, priority=SendQueue.PRIORITY_REQUEST):
         """ Transmit the specified data over UDP, breaking it up into several
         packets if necessary
 
@@ -197,7 +381,7 @@ class KademliaProtocol(protocol.DatagramProtocol):
             |           |     |      |      |        ||||||||||||   0x00   |
             |Transmision|Total number|Sequence number| RPC ID   |Header end|
             | type ID   | of packets |of this packet |          | indicator|
-            | (1 byte)  | (2 bytes)  |  (2 bytes)    |(20 bytes)| (1 byte) |
+            | (1 byte)  | (2 bytes)  |  (2 bytes)    |(48 bytes)| (1 byte) |
             |           |     |      |      |        ||||||||||||          |
 
         @note: The header used for breaking up large data segments will
@@ -222,22 +406,14 @@ class KademliaProtocol(protocol.DatagramProtocol):
                 packetData = data[startPos:startPos + self.msgSizeLimit]
                 encSeqNumber = chr(seqNumber >> 8) + chr(seqNumber & 0xff)
                 txData = '\x00%s%s%s\x00%s' % (encTotalPackets, encSeqNumber, rpcID, packetData)
-                self._scheduleSendNext(txData, address)
+                self._sendQueue.put(txData, address, priority)
 
                 startPos += self.msgSizeLimit
                 seqNumber += 1
         else:
-            self._scheduleSendNext(data, address)
-
-    def _scheduleSendNext(self, txData, address):
-        """Schedule the sending of the next UDP packet """
-        delay = self._delay()
-        key = object()
-        delayed_call = reactor.callLater(delay, self._write_and_remove, key, txData, address)
-        self._call_later_list[key] = delayed_call
+            self._sendQueue.put(data, address, priority)
 
-    def _write_and_remove(self, key, txData, address):
-        del self._call_later_list[key]
+    def _write(self, txData, address):
         if self.transport:
             try:
                 self.transport.write(txData, address)
@@ -255,7 +431,8 @@ class KademliaProtocol(protocol.DatagramProtocol):
         msg = msgtypes.ResponseMessage(rpcID, self._node.id, response)
         msgPrimitive = self._translator.toPrimitive(msg)
         encodedMsg = self._encoder.encode(msgPrimitive)
-        self._send(encodedMsg, rpcID, (contact.address, contact.port))
+        self._send(encodedMsg, rpcID, (contact.address, contact.port),
+                   SendQueue.PRIORITY_RESPONSE)
 
     def _sendError(self, contact, rpcID, exceptionType, exceptionMessage):
         """ Send an RPC error message to the specified contact
@@ -263,7 +440,8 @@ class KademliaProtocol(protocol.DatagramProtocol):
         msg = msgtypes.ErrorMessage(rpcID, self._node.id, exceptionType, exceptionMessage)
         msgPrimitive = self._translator.toPrimitive(msg)
         encodedMsg = self._encoder.encode(msgPrimitive)
-        self._send(encodedMsg, rpcID, (contact.address, contact.port))
+        self._send(encodedMsg, rpcID, (contact.address, contact.port),
+                   SendQueue.PRIORITY_RESPONSE)
 
     def _handleRPC(self, senderContact, rpcID, method, args):
         """ Executes a local function in response to an RPC request """
@@ -303,11 +481,12 @@ class KademliaProtocol(protocol.DatagramProtocol):
             log.error("deferred timed out, but is not present in sent messages list!")
             return
         remoteContactID, df = self._sentMessages[messageID][0:2]
-        if self._partialMessages.has_key(messageID):
+        if messageID in self._partialMessages:
             # We are still receiving this message
             self._msgTimeoutInProgress(messageID, remoteContactID, df)
             return
         del self._sentMessages[messageID]
+        self._partialMessagesProgress.pop(messageID, None)
         # The message's destination node is now considered to be dead;
         # raise an (asynchronous) TimeoutError exception and update the host node
         self._node.removeContact(remoteContactID)
@@ -321,18 +500,24 @@ class KademliaProtocol(protocol.DatagramProtocol):
             self._sentMessages[messageID] = (remoteContactID, df, timeoutCall)
         else:
             # No progress has been made
-            del self._partialMessagesProgress[messageID]
-            del self._partialMessages[messageID]
+            del self._sentMessages[messageID]
+            self._partialMessagesProgress.pop(messageID, None)
+            self._partialMessages.remove(messageID)
             df.errback(failure.Failure(TimeoutError(remoteContactID)))
 
     def _hasProgressBeenMade(self, messageID):
-        return (
-            self._partialMessagesProgress.has_key(messageID) and
-            (
-                len(self._partialMessagesProgress[messageID]) !=
-                len(self._partialMessages[messageID])
-            )
-        )
+        received = self._partialMessages.fragmentCount(messageID)
+        previouslyReceived = self._partialMessagesProgress.get(messageID)
+        self._partialMessagesProgress[messageID] = received
+        return received != previouslyReceived
+
+    def getPartialMessageStats(self):
+        """ Counters of the multi-packet messages received, expired and dropped """
+        return self._partialMessages.getStats()
+
+    def getSendQueueStats(self):
+        """ The number of packets waiting to be sent, and how long sent packets waited """
+        return self._sendQueue.getStats()
 
     def stopProtocol(self):
         """ Called when the transport is disconnected.
@@ -340,15 +525,5 @@ class KademliaProtocol(protocol.DatagramProtocol):
         Will only be called once, after all ports are disconnected.
         """
         log.info('Stopping DHT')
-        for delayed_call in self._call_later_list.values():
-            try:
-                delayed_call.cancel()
-            except (error.AlreadyCalled, error.AlreadyCancelled):
-                log.debug('Attempted to cancel a DelayedCall that was not active')
-            except Exception:
-                log.exception('Failed to cancel a DelayedCall')
-                # not sure why this is needed, but taking this out sometimes causes
-                # exceptions.AttributeError: 'Port' object has no attribute 'socket'
-                # to happen on shutdown
-                # reactor.iterate()
+        self._sendQueue.stop()
         log.info('DHT stopped')
@@ -5,6 +5,8 @@
 # The docstrings in this module contain epytext markup; API documentation
 # may be created by processing this file with epydoc: http://epydoc.sf.net
 
+import bisect
+import heapq
 import time
 import random
 import constants
@@ -431,3 +433,101 @@ class OptimizedTreeRoutingTable(TreeRoutingTable):
                 if len(self._replacementCache[bucketIndex]) > 0:
                     self._buckets[bucketIndex].addContact(
                         self._replacementCache[bucketIndex].pop())
+
+
+class BisectRoutingTable(OptimizedTreeRoutingTable):
+    """ An C{OptimizedTreeRoutingTable} which finds k-buckets in O(log n)
+
+    Every k-bucket covers a prefix of the ID space, so the buckets are kept
+    sorted by the start of their range, and the bucket for a key is found with
+    a binary search over the range starts, after converting the key to an
+    integer once. Since the buckets cover disjoint, aligned ranges, all of the
+    contacts in a bucket are either closer to a key or further from it than
+    all of the contacts in another bucket; C{findCloseNodes} takes the buckets
+    closest to the key from a heap until it has enough contacts, and only
+    compares the distances of the contacts in the last bucket it takes.
+    """
+
+    def __init__(self, parentNodeID):
+        OptimizedTreeRoutingTable.__init__(self, parentNodeID)
+        # The rangeMin of each bucket in self._buckets, for bisecting
+        self._bucketRangeMins = [bucket.rangeMin for bucket in self._buckets]
+
+    def findCloseNodes(self, key, count, _rpcNodeID=None):
+        """ Finds a number of known nodes closest to the node/value with the
+        specified key.
+
+        @param key: the n-bit key (i.e. the node or value ID) to search for
+        @type key: str
+        @param count: the amount of contacts to return
+        @type count: int
+        @param _rpcNodeID: Used during RPC, this is be the sender's Node ID
+                           Whatever ID is passed in the paramater will get
+                           excluded from the list of returned contacts.
+        @type _rpcNodeID: str
+
+        @return: A list of node contacts (C{kademlia.contact.Contact instances})
+                 closest to the specified key.
+                 Like C{TreeRoutingTable}, this returns C{k} contacts if at all
+                 possible, regardless of C{count}; the iterative lookups need
+                 more than C{alpha} contacts to start from.
+        @rtype: list
+        """
+        keyValue = self._keyToLong(key)
+        count = constants.k
+        bucketHeap = []
+        for bucket in self._buckets:
+            if len(bucket):
+                bucketHeap.append((self._bucketDistance(bucket, keyValue), bucket))
+        heapq.heapify(bucketHeap)
+        closestNodes = []
+        while bucketHeap and len(closestNodes) < count:
+            bucket = heapq.heappop(bucketHeap)[1]
+            contacts = [contact for contact in bucket._contacts if contact.id != _rpcNodeID]
+            if len(closestNodes) + len(contacts) > count:
+                # only the contacts of the last bucket needed have to be compared
+                contacts = heapq.nsmallest(
+                    count - len(closestNodes), contacts,
+                    key=lambda contact: self._keyToLong(contact.id) ^ keyValue)
+            closestNodes.extend(contacts)
+        return closestNodes
+
+    def _kbucketIndex(self, key):
+        """ Calculate the index of the k-bucket which is responsible for the
+        specified key (or ID)
+
+        @param key: The key for which to find the appropriate k-bucket index
+        @type key: str or int
+
+        @return: The index of the k-bucket responsible for the specified key
+        @rtype: int
+        """
+        return bisect.bisect_right(self._bucketRangeMins, self._keyToLong(key)) - 1
+
+    def _splitBucket(self, oldBucketIndex):
+        """ Splits the specified k-bucket into two new buckets which together
+        cover the same range in the key/ID space
+
+        @param oldBucketIndex: The index of k-bucket to split (in this table's
+                               list of k-buckets)
+        @type oldBucketIndex: int
+        """
+        OptimizedTreeRoutingTable._splitBucket(self, oldBucketIndex)
+        self._bucketRangeMins.insert(
+            oldBucketIndex + 1, self._buckets[oldBucketIndex + 1].rangeMin)
+
+    @staticmethod
+    def _bucketDistance(bucket, keyValue):
+        """ The smallest XOR distance between the key and an ID in the bucket
+
+        Bucket ranges are created by halving the ID space, so a bucket covers
+        all of the IDs sharing the high bits of its rangeMin
+        """
+        size = bucket.rangeMax - bucket.rangeMin
+        return (keyValue ^ bucket.rangeMin) & ~(size - 1)
+
+    @staticmethod
+    def _keyToLong(key):
+        if isinstance(key, str):
+            return long(key.encode('hex'), 16)
+        return key
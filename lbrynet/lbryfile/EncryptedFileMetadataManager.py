@@ -3,8 +3,8 @@ import sqlite3
 import os
 from twisted.internet import defer
 from twisted.python.failure import Failure
-from twisted.enterprise import adbapi
 from lbrynet.core.Error import DuplicateStreamHashError, NoSuchStreamHash, NoSuchSDHash
+from lbrynet.core.Database import open_database
 from lbrynet.core.sqlite_helpers import rerun_if_locked
 
 
@@ -24,7 +24,9 @@ class DBEncryptedFileMetadataManager(object):
         return self._open_db()
 
     def stop(self):
-        self.db_conn = None
+        db_conn, self.db_conn = self.db_conn, None
+        if db_conn is not None:
+            db_conn.close()
         return defer.succeed(True)
 
     def get_all_streams(self):
@@ -97,14 +99,7 @@ class DBEncryptedFileMetadataManager(object):
         return self._get_stream_hash_for_sd_blob_hash(sd_hash)
 
     def _open_db(self):
-        # check_same_thread=False is solely to quiet a spurious error that appears to be due
-        # to a bug in twisted, where the connection is closed by a different thread than the
-        # one that opened it. The individual connections in the pool are not used in multiple
-        # threads.
-        self.db_conn = adbapi.ConnectionPool(
-            "sqlite3",
-            (os.path.join(self.db_dir, "lbryfile_info.db")),
-            check_same_thread=False)
+        self.db_conn = open_database(os.path.join(self.db_dir, "lbryfile_info.db"))
 
         def create_tables(transaction):
             transaction.execute("create table if not exists lbry_files (" +
@@ -121,6 +116,11 @@ class DBEncryptedFileMetadataManager(object):
                                 "    length integer, " +
                                 "    foreign key(stream_hash) references lbry_files(stream_hash)" +
                                 ")")
+            transaction.execute("create unique index if not exists " +
+                                "lbry_file_blobs_stream_position_idx " +
+                                "on lbry_file_blobs (stream_hash, position)")
+            transaction.execute("create index if not exists lbry_file_blobs_blob_hash_idx " +
+                                "on lbry_file_blobs (blob_hash, stream_hash)")
             transaction.execute("create table if not exists lbry_file_descriptors (" +
                                 "    sd_blob_hash TEXT PRIMARY KEY, " +
                                 "    stream_hash TEXT, " +
@@ -5,7 +5,6 @@ Keep track of which LBRY Files are downloading and store their LBRY File specifi
 import logging
 import os
 
-from twisted.enterprise import adbapi
 from twisted.internet import defer, task, reactor
 from twisted.python.failure import Failure
 
@@ -16,6 +15,7 @@ from lbrynet.lbryfilemanager.EncryptedFileDownloader import ManagedEncryptedFile
 from lbrynet.lbryfile.StreamDescriptor import EncryptedFileStreamType
 from lbrynet.cryptstream.client.CryptStreamDownloader import AlreadyStoppedError
 from lbrynet.cryptstream.client.CryptStreamDownloader import CurrentlyStoppingError
+from lbrynet.core.Database import open_database
 from lbrynet.core.sqlite_helpers import rerun_if_locked
 from lbrynet import conf
 
@@ -214,14 +214,14 @@ class EncryptedFileManager(object):
 
         yield self._delete_lbry_file_options(lbry_file.rowid)
 
-        yield lbry_file.delete_data()
-
         # TODO: delete this
         # get count for stream hash returns the count of the lbry files with the stream hash
         # in the lbry_file_options table, which will soon be removed.
 
         stream_count = yield self.get_count_for_stream_hash(lbry_file.stream_hash)
         if stream_count == 0:
+            # the blobs are still used by the other lbry files of this stream otherwise
+            yield lbry_file.delete_data()
             yield self.stream_info_manager.delete_stream(lbry_file.stream_hash)
         else:
             msg = ("Can't delete stream info for %s, count is %i\n"
@@ -265,15 +265,8 @@ class EncryptedFileManager(object):
     ######### database calls #########
 
     def _open_db(self):
-        # check_same_thread=False is solely to quiet a spurious error that appears to be due
-        # to a bug in twisted, where the connection is closed by a different thread than the
-        # one that opened it. The individual connections in the pool are not used in multiple
-        # threads.
-        self.sql_db = adbapi.ConnectionPool(
-            "sqlite3",
-            os.path.join(self.session.db_dir, "lbryfile_info.db"),
-            check_same_thread=False
-        )
+        # shares the writer thread with the stream metadata manager, which uses the same file
+        self.sql_db = open_database(os.path.join(self.session.db_dir, "lbryfile_info.db"))
         return self.sql_db.runQuery(
             "create table if not exists lbry_file_options (" +
             "    blob_data_rate real, " +
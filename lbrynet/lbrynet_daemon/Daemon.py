@@ -40,6 +40,7 @@ from lbrynet.lbrynet_daemon.ExchangeRateManager import ExchangeRateManager
 from lbrynet.lbrynet_daemon.auth.server import AuthJSONRPCServer
 from lbrynet.core.PaymentRateManager import OnlyFreePaymentsManager
 from lbrynet.core import log_support, utils, system_info
+from lbrynet.core.Database import get_database_stats
 from lbrynet.core.StreamDescriptor import StreamDescriptorIdentifier, download_sd_blob
 from lbrynet.core.Session import Session
 from lbrynet.core.Wallet import LBRYumWallet, SqliteStorage, ClaimOutpoint
@@ -48,6 +49,7 @@ from lbrynet.core.server.BlobRequestHandler import BlobRequestHandlerFactory
 from lbrynet.core.server.ServerProtocol import ServerProtocolFactory
 from lbrynet.core.Error import InsufficientFundsError, UnknownNameError, NoSuchSDHash
 from lbrynet.core.Error import NoSuchStreamHash
+from lbrynet.dht.datastore import SqliteDataStore
 
 log = logging.getLogger(__name__)
 
@@ -207,7 +209,7 @@ class Daemon(AuthJSONRPCServer):
         self.platform = None
         self.first_run = None
         self.log_file = conf.settings.get_log_filename()
-        self.current_db_revision = 3
+        self.current_db_revision = 5
         self.db_revision_file = conf.settings.get_db_revision_filename()
         self.session = None
         self.uploaded_temp_files = []
@@ -243,14 +245,14 @@ class Daemon(AuthJSONRPCServer):
 
         @defer.inlineCallbacks
         def _announce_startup():
-            def _announce():
+            def _announce(blobs):
                 self.announced_startup = True
                 self.startup_status = STARTUP_STAGES[5]
                 log.info("Started lbrynet-daemon")
-                log.info("%i blobs in manager", len(self.session.blob_manager.blobs))
+                log.info("%i blobs in manager", len(blobs))
 
-            yield self.session.blob_manager.get_all_verified_blobs()
-            yield _announce()
+            blobs = yield self.session.blob_manager.get_all_verified_blobs()
+            yield _announce(blobs)
 
         log.info("Starting lbrynet-daemon")
 
@@ -573,6 +575,10 @@ class Daemon(AuthJSONRPCServer):
         d = get_wallet()
 
         def create_session(wallet):
+            if conf.settings['dht_persist_data_store']:
+                dht_data_store = SqliteDataStore(os.path.join(self.db_dir, "dht_data.db"))
+            else:
+                dht_data_store = None
             self.session = Session(
                 conf.settings['data_rate'],
                 db_dir=self.db_dir,
@@ -583,7 +589,8 @@ class Daemon(AuthJSONRPCServer):
                 peer_port=self.peer_port,
                 use_upnp=self.use_upnp,
                 wallet=wallet,
-                is_generous=conf.settings['is_generous_host']
+                is_generous=conf.settings['is_generous_host'],
+                dht_data_store=dht_data_store
             )
             self.startup_status = STARTUP_STAGES[2]
 
@@ -1035,6 +1042,10 @@ class Daemon(AuthJSONRPCServer):
             response['session_status'] = {
                 'managed_blobs': len(blobs),
                 'managed_streams': len(self.lbry_file_manager.lbry_files),
+                'blob_cache': self.session.blob_manager.get_blob_cache_stats(),
+                'blob_storage': self.session.blob_manager.get_storage_stats(),
+                'peer_finder': self.session.peer_finder.get_stats(),
+                'databases': get_database_stats(),
             }
         defer.returnValue(response)
 
@@ -2314,7 +2325,7 @@ class Daemon(AuthJSONRPCServer):
         blob = yield self._download_blob(blob_hash, rate_manager=payment_rate_manager,
                                          timeout=timeout)
         if encoding and encoding in decoders:
-            blob_file = blob.open_for_reading()
+            blob_file = yield blob.open_for_reading_async()
             result = decoders[encoding](blob_file.read())
             blob.close_read_handle(blob_file)
         else:
@@ -2335,7 +2346,8 @@ class Daemon(AuthJSONRPCServer):
             (str) Success/fail message
         """
 
-        if blob_hash not in self.session.blob_manager.blobs:
+        completed = yield self.session.blob_manager.completed_blobs([blob_hash])
+        if not completed and blob_hash not in self.session.blob_manager.blobs:
             response = yield self._render_response("Don't have that blob")
             defer.returnValue(response)
         try:
@@ -2446,15 +2458,21 @@ class Daemon(AuthJSONRPCServer):
                 blobs = yield self.get_blobs_for_sd_hash(sd_hash)
             except NoSuchSDHash:
                 blobs = []
+
+        if uri or stream_hash or sd_hash:
+            blob_hashes = [blob.blob_hash for blob in blobs]
         else:
-            blobs = self.session.blob_manager.blobs.itervalues()
+            verified_blobs = yield self.session.blob_manager.get_all_verified_blobs()
+            blob_hashes = sorted(set(verified_blobs).union(self.session.blob_manager.blobs))
 
-        if needed:
-            blobs = [blob for blob in blobs if not blob.is_validated()]
-        if finished:
-            blobs = [blob for blob in blobs if blob.is_validated()]
+        if needed or finished:
+            completed = yield self.session.blob_manager.completed_blobs(blob_hashes)
+            completed = set(completed)
+            if needed:
+                blob_hashes = [b for b in blob_hashes if b not in completed]
+            if finished:
+                blob_hashes = [b for b in blob_hashes if b in completed]
 
-        blob_hashes = [blob.blob_hash for blob in blobs]
         page_size = page_size or len(blob_hashes)
         page = page or 0
         start_index = page * page_size
@@ -2508,11 +2526,12 @@ class Daemon(AuthJSONRPCServer):
             else:
                 return 0.0
 
+        @defer.inlineCallbacks
         def read_sd_blob(sd_blob):
-            sd_blob_file = sd_blob.open_for_reading()
+            sd_blob_file = yield sd_blob.open_for_reading_async()
             decoded_sd_blob = json.loads(sd_blob_file.read())
             sd_blob.close_read_handle(sd_blob_file)
-            return decoded_sd_blob
+            defer.returnValue(decoded_sd_blob)
 
         try:
             resolved = yield self.session.wallet.resolve_uri(uri)
@@ -2545,7 +2564,7 @@ class Daemon(AuthJSONRPCServer):
                 response = yield self._render_response(0.0)
                 log.warning(err)
                 defer.returnValue(response)
-            decoded = read_sd_blob(sd_blob)
+            decoded = yield read_sd_blob(sd_blob)
             blob_hashes = [blob.get("blob_hash") for blob in decoded['blobs']
                            if blob.get("blob_hash")]
         sample = random.sample(blob_hashes, min(len(blob_hashes), 5))
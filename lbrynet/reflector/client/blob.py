@@ -1,10 +1,10 @@
 import json
 import logging
 
-from twisted.protocols.basic import FileSender
 from twisted.internet.protocol import Protocol, ClientFactory
 from twisted.internet import defer, error
 
+from lbrynet.core.HashBlob import BlobMapSender
 from lbrynet.reflector.common import IncompleteResponse, REFLECTOR_V2
 
 
@@ -94,7 +94,8 @@ class BlobReflectorClient(Protocol):
 
     def set_not_uploading(self):
         if self.next_blob_to_send is not None:
-            self.next_blob_to_send.close_read_handle(self.read_handle)
+            if self.read_handle is not None:
+                self.read_handle.close()
             self.read_handle = None
             self.next_blob_to_send = None
         self.file_sender = None
@@ -121,7 +122,7 @@ class BlobReflectorClient(Protocol):
             if 'send_blob' not in response_dict:
                 raise ValueError("I don't know whether to send the blob or not!")
             if response_dict['send_blob'] is True:
-                self.file_sender = FileSender()
+                self.file_sender = BlobMapSender()
                 return defer.succeed(True)
             else:
                 return self.set_not_uploading()
@@ -133,7 +134,7 @@ class BlobReflectorClient(Protocol):
 
     def open_blob_for_reading(self, blob):
         if blob.is_validated():
-            read_handle = blob.open_for_reading()
+            read_handle = blob.open_for_mapped_reading()
             if read_handle is not None:
                 log.debug('Getting ready to send %s', blob.blob_hash)
                 self.next_blob_to_send = blob
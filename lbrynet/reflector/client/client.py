@@ -2,10 +2,10 @@ import json
 import logging
 
 from twisted.internet.error import ConnectionRefusedError
-from twisted.protocols.basic import FileSender
 from twisted.internet.protocol import Protocol, ClientFactory
 from twisted.internet import defer, error
 
+from lbrynet.core.HashBlob import BlobMapSender
 from lbrynet.reflector.common import IncompleteResponse, ReflectorRequestError
 from lbrynet.reflector.common import REFLECTOR_V1, REFLECTOR_V2
 
@@ -179,7 +179,8 @@ class EncryptedFileReflectorClient(Protocol):
     def set_not_uploading(self):
         if self.next_blob_to_send is not None:
             log.debug("Close %s", self.next_blob_to_send)
-            self.next_blob_to_send.close_read_handle(self.read_handle)
+            if self.read_handle is not None:
+                self.read_handle.close()
             self.read_handle = None
             self.next_blob_to_send = None
         if self.file_sender is not None:
@@ -207,7 +208,7 @@ class EncryptedFileReflectorClient(Protocol):
             if 'send_sd_blob' not in response_dict:
                 raise ReflectorRequestError("I don't know whether to send the sd blob or not!")
             if response_dict['send_sd_blob'] is True:
-                self.file_sender = FileSender()
+                self.file_sender = BlobMapSender()
             else:
                 self.received_descriptor_response = True
             self.descriptor_needed = response_dict['send_sd_blob']
@@ -232,7 +233,7 @@ class EncryptedFileReflectorClient(Protocol):
             if 'send_blob' not in response_dict:
                 raise ValueError("I don't know whether to send the blob or not!")
             if response_dict['send_blob'] is True:
-                self.file_sender = FileSender()
+                self.file_sender = BlobMapSender()
                 return defer.succeed(True)
             else:
                 log.warning("Reflector already has %s for %s", self.next_blob_to_send,
@@ -254,7 +255,7 @@ class EncryptedFileReflectorClient(Protocol):
 
     def open_blob_for_reading(self, blob):
         if blob.is_validated():
-            read_handle = blob.open_for_reading()
+            read_handle = blob.open_for_mapped_reading()
             if read_handle is not None:
                 log.debug('Getting ready to send %s', blob.blob_hash)
                 self.next_blob_to_send = blob
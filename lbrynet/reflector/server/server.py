@@ -39,6 +39,7 @@ class ReflectorServer(Protocol):
         self.blob_finished_d = None
         self.cancel_write = None
         self.request_buff = ""
+        self.blob_write_paused = False
 
     def connectionLost(self, reason=failure.Failure(error.ConnectionDone())):
         log.info("Reflector upload from %s finished" % self.peer.host)
@@ -99,7 +100,7 @@ class ReflectorServer(Protocol):
 
     def dataReceived(self, data):
         if self.receiving_blob:
-            self.blob_write(data)
+            self.write_blob_data(data)
         else:
             log.debug('Not yet recieving blob, data needs further processing')
             self.request_buff += data
@@ -110,7 +111,20 @@ class ReflectorServer(Protocol):
                 d.addErrback(self.handle_error)
                 if self.receiving_blob and extra_data:
                     log.debug('Writing extra data to blob')
-                    self.blob_write(extra_data)
+                    self.write_blob_data(extra_data)
+
+    def write_blob_data(self, data):
+        d = self.blob_write(data)
+        if isinstance(d, defer.Deferred) and not self.blob_write_paused:
+            # stop reading from the socket until the blob writer catches up
+            self.blob_write_paused = True
+            self.transport.pauseProducing()
+            d.addCallback(self._blob_writer_drained)
+
+    def _blob_writer_drained(self, result):
+        self.blob_write_paused = False
+        self.transport.resumeProducing()
+        return result
 
     def _get_valid_response(self, response_msg):
         extra_data = None
@@ -251,10 +265,14 @@ class ReflectorServer(Protocol):
         return d
 
     def determine_missing_blobs(self, sd_blob):
-        with sd_blob.open_for_reading() as sd_file:
-            sd_blob_data = sd_file.read()
-        decoded_sd_blob = json.loads(sd_blob_data)
-        return self.get_unvalidated_blobs_in_stream(decoded_sd_blob)
+        def read_sd_blob(sd_file):
+            with sd_file:
+                return json.loads(sd_file.read())
+
+        d = sd_blob.open_for_reading_async()
+        d.addCallback(read_sd_blob)
+        d.addCallback(self.get_unvalidated_blobs_in_stream)
+        return d
 
     def get_unvalidated_blobs_in_stream(self, sd_blob):
         dl = defer.DeferredList(list(self._iter_unvalidated_blobs_in_stream(sd_blob)),
@@ -0,0 +1,80 @@
+"""Benchmark bencoding and decoding the DHT messages a node handles most
+
+The messages are encoded with the message format used on the wire: findNode responses
+with k contact triples, findValue responses with --peers peers and a token, and store
+requests.
+"""
+import argparse
+import random
+import sys
+import time
+
+from lbrynet.dht import constants, msgformat, msgtypes
+from lbrynet.dht.encoding import Bencode
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=5000)
+    parser.add_argument('--peers', type=int, nargs='+', default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    messages = [
+        ('findNode response', find_node_response(rand)),
+        ('store request', store_request(rand)),
+    ]
+    for num_peers in args.peers:
+        messages.append(
+            ('findValue response, %i peers' % num_peers, find_value_response(rand, num_peers)))
+
+    encoder = Bencode()
+    translator = msgformat.DefaultFormat()
+    print "%-32s %8s %12s %12s" % ('message', 'bytes', 'encode us', 'decode us')
+    for name, message in messages:
+        primitive = translator.toPrimitive(message)
+        encoded = encoder.encode(primitive)
+        # tuples are decoded as lists, so compare the encodings
+        assert encoder.encode(encoder.decode(encoded)) == encoded
+        encode_time = time_calls(encoder.encode, primitive, args.iterations)
+        decode_time = time_calls(encoder.decode, encoded, args.iterations)
+        print "%-32s %8i %12.2f %12.2f" % (name, len(encoded), encode_time, decode_time)
+
+
+def random_id(rand):
+    return ''.join(chr(rand.randrange(256)) for _ in range(constants.key_bits / 8))
+
+
+def compact_address(rand):
+    # ip, port and lbryid, as stored by Node.store
+    return ''.join(chr(rand.randrange(256)) for _ in range(6)) + random_id(rand)
+
+
+def find_node_response(rand):
+    contacts = [(random_id(rand), '10.0.%i.%i' % (i, i), 4444) for i in range(constants.k)]
+    return msgtypes.ResponseMessage(random_id(rand), random_id(rand), contacts)
+
+
+def find_value_response(rand, num_peers):
+    key = random_id(rand)
+    response = {key: [compact_address(rand) for _ in range(num_peers)],
+                'token': random_id(rand)}
+    return msgtypes.ResponseMessage(random_id(rand), random_id(rand), response)
+
+
+def store_request(rand):
+    node_id = random_id(rand)
+    value = {'port': 3333, 'lbryid': random_id(rand), 'token': random_id(rand)}
+    return msgtypes.RequestMessage(node_id, 'store', [random_id(rand), value, node_id, 0])
+
+
+def time_calls(func, arg, iterations):
+    """Return the average time of a call in microseconds"""
+    start = time.time()
+    for _ in xrange(iterations):
+        func(arg)
+    return 1000000 * (time.time() - start) / iterations
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Benchmark how many completed blobs per second DiskBlobManager can record
+
+Runs once writing every completed blob in its own transaction (the behaviour before
+blobs.db writes were batched) and once with the write-behind queue.
+"""
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from twisted.internet import defer
+from twisted.internet import reactor
+
+from lbrynet import conf
+from lbrynet.core import log_support
+from lbrynet.core.BlobManager import DiskBlobManager
+from lbrynet.core.HashAnnouncer import DummyHashAnnouncer
+from lbrynet.core.HashBlob import HashBlob
+from lbrynet.core.utils import generate_id
+
+
+log = logging.getLogger('benchmark_blob_completion')
+
+
+def main():
+    conf.initialize_settings(load_conf_file=False)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blobs', type=int, default=5000)
+    args = parser.parse_args()
+    log_support.configure_console(level='INFO')
+
+    failed = []
+
+    def report_failure(err):
+        log.error('Benchmark failed: %s', err.getTraceback())
+        failed.append(err)
+
+    d = run(args)
+    d.addErrback(report_failure)
+    d.addBoth(lambda _: reactor.callLater(0, reactor.stop))
+    reactor.run()
+    return 1 if failed else 0
+
+
+@defer.inlineCallbacks
+def run(args):
+    blobs = [HashBlob(generate_id(i).encode('hex'), 2 * conf.MB) for i in range(args.blobs)]
+    unbatched = yield benchmark(blobs, batched=False)
+    batched = yield benchmark(blobs, batched=True)
+    print "per blob transactions: %.1f blobs/s" % unbatched
+    print "write-behind batches:  %.1f blobs/s" % batched
+
+
+def count_blobs(db_dir):
+    db = sqlite3.connect(os.path.join(db_dir, "blobs.db"))
+    try:
+        return db.execute("select count(*) from blobs").fetchone()[0]
+    finally:
+        db.close()
+
+
+@defer.inlineCallbacks
+def benchmark(blobs, batched):
+    db_dir = tempfile.mkdtemp()
+    blob_dir = tempfile.mkdtemp()
+    blob_manager = DiskBlobManager(DummyHashAnnouncer(), blob_dir, db_dir)
+    try:
+        yield blob_manager.setup()
+        start = time.time()
+        for blob in blobs:
+            if batched:
+                yield blob_manager.blob_completed(blob, next_announce_time=start)
+            else:
+                yield blob_manager._write_db_mutations(
+                    {blob.blob_hash: (blob.length, start)}, set(), {}, {})
+        # stopping flushes the pending writes and closes blobs.db
+        yield blob_manager.stop()
+        elapsed = time.time() - start
+        stored = count_blobs(db_dir)
+        if stored != len(blobs):
+            raise Exception("%i of %i blobs were written to blobs.db" % (stored, len(blobs)))
+    finally:
+        shutil.rmtree(db_dir)
+        shutil.rmtree(blob_dir)
+    defer.returnValue(len(blobs) / elapsed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""Compare announcing blobs to the DHT one at a time and in bulk
+
+A network of --nodes nodes is started on 127.0.0.1, then --blobs random blob hashes are
+announced by one node, first with announceHaveBlob (--concurrent at a time, like the hash
+announcer used to) and then with announceHaveBlobs. The time taken and the number of
+packets sent are reported, and a sample of the blobs is looked up from another node.
+"""
+import argparse
+import logging
+import sys
+import time
+
+from twisted.internet import defer, reactor
+
+from lbrynet.core import log_support
+from lbrynet.core.utils import generate_id
+from lbrynet.dht.node import Node
+
+
+log = logging.getLogger('benchmark_dht_announce')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=50)
+    parser.add_argument('--blobs', type=int, default=1000)
+    parser.add_argument('--concurrent', type=int, default=5)
+    parser.add_argument('--base-port', type=int, default=44200)
+    parser.add_argument('--sample', type=int, default=20)
+    args = parser.parse_args()
+    log_support.configure_console(level='WARNING')
+
+    d = run(args)
+    reactor.run()
+
+
+@defer.inlineCallbacks
+def run(args):
+    network = []
+    try:
+        for i in range(args.nodes):
+            network.append(Node(udpPort=args.base_port + i, lbryid=generate_id(),
+                                externalIP='127.0.0.1'))
+        yield network[0].joinNetwork(None)
+        for dht_node in network[1:]:
+            yield dht_node.joinNetwork([('127.0.0.1', args.base_port)])
+        announcer, searcher = network[-1], network[-2]
+        print "%-12s %10s %10s %14s" % ('method', 'seconds', 'packets', 'sample found')
+        for method in ('one at a time', 'bulk'):
+            blob_hashes = [generate_id() for _ in range(args.blobs)]
+            packets = announcer._protocol.getSendQueueStats()['packets_sent']
+            start = time.time()
+            if method == 'bulk':
+                yield announcer.announceHaveBlobs(blob_hashes, 3333)
+            else:
+                yield announce_one_at_a_time(announcer, blob_hashes, args.concurrent)
+            elapsed = time.time() - start
+            packets = announcer._protocol.getSendQueueStats()['packets_sent'] - packets
+            found = 0
+            for blob_hash in blob_hashes[:args.sample]:
+                peers = yield searcher.getPeersForBlob(blob_hash)
+                found += 1 if peers else 0
+            print "%-12s %10.2f %10i %11i/%i" % (method, elapsed, packets, found, args.sample)
+    except Exception:
+        log.exception('Benchmark failed')
+    finally:
+        for dht_node in network:
+            dht_node.stop()
+        reactor.callLater(0, reactor.stop)
+
+
+def announce_one_at_a_time(dht_node, blob_hashes, concurrent):
+    queue = list(blob_hashes)
+
+    @defer.inlineCallbacks
+    def announce():
+        while queue:
+            yield dht_node.announceHaveBlob(queue.pop(), 3333)
+
+    return defer.DeferredList([announce() for _ in range(concurrent)])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""Measure the latency of DHT node lookups on a local network with unresponsive nodes
+
+A network of --nodes nodes is started on 127.0.0.1, each handling packets after --latency
+seconds, and then --dead of them stop listening without the others knowing. A node then
+looks up --lookups random keys one after another, and the latency of each is reported.
+"""
+import argparse
+import logging
+import sys
+import time
+
+from twisted.internet import defer, reactor
+
+from lbrynet.core import log_support
+from lbrynet.core.utils import generate_id
+from lbrynet.dht.node import Node
+
+
+log = logging.getLogger('benchmark_dht_lookup')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=60)
+    parser.add_argument('--dead', type=int, default=10)
+    parser.add_argument('--base-port', type=int, default=44100)
+    parser.add_argument('--lookups', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args()
+    log_support.configure_console(level='WARNING')
+
+    d = run(args)
+    reactor.run()
+
+
+@defer.inlineCallbacks
+def run(args):
+    network = []
+    try:
+        for i in range(args.nodes):
+            network.append(Node(udpPort=args.base_port + i, lbryid=generate_id(),
+                                externalIP='127.0.0.1'))
+        yield network[0].joinNetwork(None)
+        for dht_node in network[1:]:
+            yield dht_node.joinNetwork([('127.0.0.1', args.base_port)])
+        for dht_node in network:
+            delay_packets(dht_node, args.latency)
+        for dht_node in network[1:args.dead + 1]:
+            yield dht_node._listeningPort.stopListening()
+        searcher = network[-1]
+        latencies = []
+        for _ in range(args.lookups):
+            start = time.time()
+            yield searcher.iterativeFindNode(generate_id())
+            latencies.append(time.time() - start)
+        latencies.sort()
+        print "lookups: %i, mean: %.3fs, median: %.3fs, max: %.3fs" % (
+            len(latencies), sum(latencies) / len(latencies), latencies[len(latencies) / 2],
+            latencies[-1])
+        if hasattr(searcher, 'getLookupStats'):
+            print "lookup stats: %s" % searcher.getLookupStats()
+    except Exception:
+        log.exception('Benchmark failed')
+    finally:
+        for dht_node in network:
+            dht_node.stop()
+        reactor.callLater(0, reactor.stop)
+
+
+def delay_packets(dht_node, delay):
+    protocol = dht_node._protocol
+    datagram_received = protocol.datagramReceived
+    protocol.datagramReceived = lambda datagram, address: reactor.callLater(
+        delay, datagram_received, datagram, address)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
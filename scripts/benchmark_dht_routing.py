@@ -0,0 +1,75 @@
+"""Benchmark the cost of handling inbound DHT packets with each routing table
+
+Every datagram a node receives adds (or refreshes) the sender in the routing table, and
+findNode requests also look up the k closest contacts. For each routing table class, a
+node is filled with --contacts contacts and then fed encoded ping and findNode requests
+from those contacts, without sending the responses.
+"""
+import argparse
+import random
+import sys
+import time
+
+from lbrynet.dht import constants, msgtypes, routingtable
+from lbrynet.dht.node import Node
+
+
+TABLES = ['TreeRoutingTable', 'OptimizedTreeRoutingTable', 'BisectRoutingTable']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--contacts', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--packets', type=int, default=20000)
+    args = parser.parse_args()
+
+    print "%8s  %-26s %12s %16s %8s" % (
+        'contacts', 'routing table', 'ping us/pkt', 'findNode us/pkt', 'buckets')
+    for num_contacts in args.contacts:
+        for table in TABLES:
+            ping, find_node, buckets = benchmark(
+                getattr(routingtable, table), num_contacts, args.packets)
+            print "%8i  %-26s %12.2f %16.2f %8i" % (
+                num_contacts, table, ping, find_node, buckets)
+
+
+def random_id(rand):
+    return ''.join(chr(rand.randrange(256)) for _ in range(constants.key_bits / 8))
+
+
+def encode_requests(node, rand, sender_ids, method, args):
+    protocol = node._protocol
+    datagrams = []
+    for sender_id in sender_ids:
+        msg = msgtypes.RequestMessage(sender_id, method, args(rand))
+        datagrams.append(protocol._encoder.encode(protocol._translator.toPrimitive(msg)))
+    return datagrams
+
+
+def time_datagrams(node, datagrams):
+    """Return the average time to handle a datagram in microseconds"""
+    protocol = node._protocol
+    start = time.time()
+    for datagram in datagrams:
+        protocol.datagramReceived(datagram, ('127.0.0.1', 4444))
+    return 1000000 * (time.time() - start) / len(datagrams)
+
+
+def benchmark(table_class, num_contacts, num_packets):
+    rand = random.Random(0)
+    node = Node(id=random_id(rand), udpPort=None, routingTableClass=table_class)
+    # responses are only recorded, not sent
+    node._protocol._send = lambda data, rpc_id, address, priority=None: None
+    sender_ids = [random_id(rand) for _ in range(num_contacts)]
+    senders = [rand.choice(sender_ids) for _ in range(num_packets)]
+    pings = encode_requests(node, rand, senders, 'ping', lambda r: [])
+    find_nodes = encode_requests(node, rand, senders, 'findNode', lambda r: [random_id(r)])
+    time_datagrams(node, encode_requests(node, rand, sender_ids, 'ping', lambda r: []))
+    ping = time_datagrams(node, pings)
+    find_node = time_datagrams(node, find_nodes)
+    node.stop()
+    return ping, find_node, len(node._routingTable._buckets)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Measure the time from starting a DHT node to its first successful peer lookup
+
+A local network of --nodes nodes is started on 127.0.0.1 and one of them announces a blob.
+A new node then joins through the first node of the network, and looks for peers for the
+blob every --poll-interval seconds until some are found. This is done once without a
+contacts snapshot (a cold start, bootstrapping from the known node) and --runs times with
+the snapshot saved by the previous run (a warm start).
+
+Nodes of the network handle packets after --latency seconds, and the known node after
+--seed-delay more seconds, like the few bootstrap nodes everyone joins through.
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from twisted.internet import defer, reactor, task
+
+from lbrynet.core import log_support
+from lbrynet.core.utils import generate_id
+from lbrynet.dht.node import Node
+
+
+log = logging.getLogger('benchmark_dht_warm_start')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=20)
+    parser.add_argument('--base-port', type=int, default=44000)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--poll-interval', type=float, default=0.05)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--seed-delay', type=float, default=1.0)
+    args = parser.parse_args()
+    log_support.configure_console(level='WARNING')
+
+    d = run(args)
+    reactor.run()
+
+
+@defer.inlineCallbacks
+def run(args):
+    snapshot_dir = tempfile.mkdtemp()
+    network = []
+    try:
+        blob_hash = yield start_network(network, args.nodes, args.base_port)
+        for i, dht_node in enumerate(network):
+            delay_packets(dht_node, args.latency + (args.seed_delay if i == 0 else 0))
+        snapshot_path = os.path.join(snapshot_dir, 'dht_contacts.json')
+        port = args.base_port + args.nodes
+        for run_num in range(args.runs + 1):
+            elapsed, lookups = yield time_first_lookup(
+                snapshot_path, port + run_num, args.base_port, blob_hash, args.poll_interval)
+            print "%s start: first peers found after %.3fs (%i lookups)" % (
+                'warm' if run_num else 'cold', elapsed, lookups)
+    except Exception:
+        log.exception('Benchmark failed')
+    finally:
+        for dht_node in network:
+            dht_node.stop()
+        shutil.rmtree(snapshot_dir)
+        reactor.callLater(0, reactor.stop)
+
+
+@defer.inlineCallbacks
+def start_network(network, num_nodes, base_port):
+    for i in range(num_nodes):
+        network.append(Node(udpPort=base_port + i, lbryid=generate_id(),
+                            externalIP='127.0.0.1'))
+    yield network[0].joinNetwork(None)
+    yield defer.DeferredList([
+        dht_node.joinNetwork([('127.0.0.1', base_port)]) for dht_node in network[1:]
+    ])
+    blob_hash = generate_id()
+    yield network[-1].announceHaveBlob(blob_hash, 3333)
+    defer.returnValue(blob_hash)
+
+
+def delay_packets(dht_node, delay):
+    protocol = dht_node._protocol
+    datagram_received = protocol.datagramReceived
+    protocol.datagramReceived = lambda datagram, address: reactor.callLater(
+        delay, datagram_received, datagram, address)
+
+
+@defer.inlineCallbacks
+def time_first_lookup(snapshot_path, port, seed_port, blob_hash, poll_interval):
+    dht_node = Node(udpPort=port, lbryid=generate_id(), externalIP='127.0.0.1',
+                    contactsSnapshotPath=snapshot_path)
+    start = time.time()
+    dht_node.joinNetwork([('127.0.0.1', seed_port)])
+    lookups = 1
+    peers = yield dht_node.getPeersForBlob(blob_hash)
+    while not peers:
+        yield task.deferLater(reactor, poll_interval, lambda: None)
+        lookups += 1
+        peers = yield dht_node.getPeersForBlob(blob_hash)
+    elapsed = time.time() - start
+    # saves the contacts snapshot for the next run
+    dht_node.stop()
+    defer.returnValue((elapsed, lookups))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Benchmark the lbry_file_blobs lookups done while downloading, with and without indexes
+
+For each number of streams a lbryfile_info.db is filled with --blobs-per-stream blobs per
+stream, then the queries of DBEncryptedFileMetadataManager are timed before and after the
+indexes of db migration 4 -> 5 are added.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from lbrynet.core.utils import generate_id
+from lbrynet.db_migrator.migrate4to5 import migrate_lbryfile_info_db
+
+
+QUERIES = {
+    'further_blob_infos':
+        "select * from ("
+        "  select blob_hash, position, iv, length from lbry_file_blobs "
+        "    where stream_hash = ? and position > ? order by position limit ?"
+        ") order by position",
+    'blob_num_by_hash':
+        "select position from lbry_file_blobs where stream_hash = ? and blob_hash = ?",
+    'stream_of_blobhash':
+        "select stream_hash from lbry_file_blobs where blob_hash = ?",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--streams', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--blobs-per-stream', type=int, default=10)
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    print "%8s  %-20s %12s %12s" % ('streams', 'query', 'no index ms', 'indexed ms')
+    for num_streams in args.streams:
+        db_dir = tempfile.mkdtemp()
+        try:
+            results = benchmark(db_dir, num_streams, args.blobs_per_stream, args.lookups)
+        finally:
+            shutil.rmtree(db_dir)
+        for name in sorted(QUERIES):
+            print "%8i  %-20s %12.3f %12.3f" % ((num_streams, name) + results[name])
+
+
+def get_hash(i):
+    return generate_id(i).encode('hex')
+
+
+def create_db(db_dir, num_streams, blobs_per_stream):
+    db = sqlite3.connect(os.path.join(db_dir, "lbryfile_info.db"))
+    # the schema before db revision 5
+    db.execute("create table lbry_file_blobs (blob_hash text, stream_hash text, "
+               "position integer, iv text, length integer)")
+    for stream_num in xrange(num_streams):
+        stream_hash = get_hash(stream_num)
+        db.executemany(
+            "insert into lbry_file_blobs values (?, ?, ?, ?, ?)",
+            [(get_hash(num_streams + stream_num * blobs_per_stream + position), stream_hash,
+              position, '00' * 16, 2 ** 21) for position in xrange(blobs_per_stream)])
+    db.commit()
+    db.close()
+
+
+def time_queries(db_dir, num_streams, blobs_per_stream, lookups):
+    """Return the average time of each query in ms"""
+    db = sqlite3.connect(os.path.join(db_dir, "lbryfile_info.db"))
+    rand = random.Random(0)
+    results = {}
+    for name, query in QUERIES.iteritems():
+        elapsed = 0.0
+        for _ in xrange(lookups):
+            stream_num = rand.randrange(num_streams)
+            position = rand.randrange(blobs_per_stream)
+            stream_hash = get_hash(stream_num)
+            blob_hash = get_hash(num_streams + stream_num * blobs_per_stream + position)
+            if name == 'further_blob_infos':
+                params = (stream_hash, position, 5)
+            elif name == 'blob_num_by_hash':
+                params = (stream_hash, blob_hash)
+            else:
+                params = (blob_hash,)
+            start = time.time()
+            rows = db.execute(query, params).fetchall()
+            elapsed += time.time() - start
+            assert rows or name == 'further_blob_infos'
+        results[name] = 1000 * elapsed / lookups
+    db.close()
+    return results
+
+
+def benchmark(db_dir, num_streams, blobs_per_stream, lookups):
+    create_db(db_dir, num_streams, blobs_per_stream)
+    before = time_queries(db_dir, num_streams, blobs_per_stream, lookups)
+    migrate_lbryfile_info_db(db_dir)
+    after = time_queries(db_dir, num_streams, blobs_per_stream, lookups)
+    return {name: (before[name], after[name]) for name in QUERIES}
+
+
+if __name__ == '__main__':
+    sys.exit(main())
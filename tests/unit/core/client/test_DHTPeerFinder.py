@@ -0,0 +1,95 @@
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from lbrynet.core.PeerManager import PeerManager
+from lbrynet.core.client.DHTPeerFinder import DHTPeerFinder
+
+
+BLOB_HASH = 'ab' * 48
+
+
+class FakeDHTNode(object):
+    def __init__(self):
+        self.lookups = []
+
+    def getPeersForBlob(self, blob_hash):
+        d = defer.Deferred()
+        self.lookups.append(d)
+        return d
+
+
+class DHTPeerFinderTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.dht_node = FakeDHTNode()
+        self.peer_manager = PeerManager()
+        self.peer_finder = DHTPeerFinder(self.dht_node, self.peer_manager, cache_ttl=30,
+                                         negative_cache_ttl=10, clock=self.clock)
+
+    def _find(self, **kwargs):
+        results = []
+        d = self.peer_finder.find_peers_for_blob(BLOB_HASH, **kwargs)
+        d.addBoth(results.append)
+        return results
+
+    def test_concurrent_searches_share_a_lookup(self):
+        first, second = self._find(), self._find()
+        self.assertEqual(1, len(self.dht_node.lookups))
+        self.dht_node.lookups[0].callback([('1.2.3.4', 3333), ('1.2.3.4', 3333)])
+        self.assertEqual([('1.2.3.4', 3333)], [(p.host, p.port) for p in first[0]])
+        self.assertEqual(first, second)
+        self.assertEqual(1, self.peer_finder.get_stats()['coalesced'])
+
+    def test_peers_are_cached(self):
+        self._find()
+        self.dht_node.lookups[0].callback([('1.2.3.4', 3333)])
+        self.clock.advance(29)
+        self.assertEqual(1, len(self._find()[0]))
+        self.assertEqual(1, len(self.dht_node.lookups))
+        self.clock.advance(1)
+        self._find()
+        self.assertEqual(2, len(self.dht_node.lookups))
+        self.assertEqual({'cached_blobs': 0, 'lookups_in_progress': 1, 'hits': 1,
+                          'negative_hits': 0, 'misses': 2, 'coalesced': 0, 'hit_rate': 1 / 3.0},
+                         self.peer_finder.get_stats())
+
+    def test_unavailable_peers_are_filtered_from_cached_results(self):
+        self._find()
+        self.dht_node.lookups[0].callback([('1.2.3.4', 3333)])
+        self.peer_manager.get_peer('1.2.3.4', 3333).report_down()
+        self.assertEqual([[]], self._find())
+
+    def test_no_peers_are_cached_for_less_time(self):
+        self._find()
+        self.dht_node.lookups[0].callback([])
+        self.clock.advance(9)
+        self.assertEqual([[]], self._find())
+        self.assertEqual(1, self.peer_finder.negative_hits)
+        self.clock.advance(1)
+        self._find()
+        self.assertEqual(2, len(self.dht_node.lookups))
+
+    def test_failed_lookups_are_not_cached(self):
+        first = self._find()
+        self.dht_node.lookups[0].errback(Exception('lookup failed'))
+        first[0].trap(Exception)
+        self._find()
+        self.assertEqual(2, len(self.dht_node.lookups))
+
+    def test_timeout_does_not_cancel_the_shared_lookup(self):
+        first = self._find(timeout=5)
+        second = self._find()
+        self.clock.advance(5)
+        first[0].trap(defer.CancelledError)
+        self.assertEqual([], second)
+        self.dht_node.lookups[0].callback([('1.2.3.4', 3333)])
+        self.assertEqual(1, len(second[0]))
+        self.assertEqual(1, len(self._find()[0]))
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_manage_removes_expired_entries(self):
+        self._find()
+        self.dht_node.lookups[0].callback([])
+        self.clock.advance(10)
+        self.peer_finder._manage_peers()
+        self.assertEqual(0, self.peer_finder.get_stats()['cached_blobs'])
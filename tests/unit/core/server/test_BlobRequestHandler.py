@@ -69,7 +69,7 @@ class TestBlobRequestHandlerQueries(unittest.TestCase):
     def test_blob_unavailable_when_blob_cannot_be_opened(self):
         blob = mock.Mock()
         blob.is_validated.return_value = True
-        blob.open_for_reading.return_value = None
+        blob.open_for_reading_async.return_value = defer.succeed(None)
         self.blob_manager.get_blob.return_value = defer.succeed(blob)
         query = {
             'blob_data_payment_rate': 0.0,
@@ -85,7 +85,7 @@ class TestBlobRequestHandlerQueries(unittest.TestCase):
     def test_blob_details_are_set_when_all_conditions_are_met(self):
         blob = mock.Mock()
         blob.is_validated.return_value = True
-        blob.open_for_reading.return_value = True
+        blob.open_for_reading_async.return_value = defer.succeed(True)
         blob.blob_hash = 'DEADBEEF'
         blob.length = 42
         peer = mock.Mock()
@@ -9,10 +9,12 @@ from tests.util import random_lbry_hash
 class MocDHTNode(object):
     def __init__(self):
         self.blobs_announced = 0
+        self.batches = []
 
-    def announceHaveBlob(self,blob,port):
-        self.blobs_announced += 1
-        return defer.succeed(True)
+    def announceHaveBlobs(self, blobs, port):
+        self.blobs_announced += len(blobs)
+        self.batches.append(blobs)
+        return defer.succeed(dict.fromkeys(blobs, 1))
 
 class MocSupplier(object):
     def __init__(self, blobs_to_announce):
@@ -41,14 +43,26 @@ class DHTHashAnnouncerTest(unittest.TestCase):
         self.announcer.add_supplier(self.supplier)
 
     def test_basic(self):
+        self.announcer.ANNOUNCE_BATCH_SIZE = 1
         self.announcer._announce_available_hashes()
         self.assertEqual(self.announcer.hash_queue_size(),self.announcer.CONCURRENT_ANNOUNCERS)
         self.clock.advance(1)
         self.assertEqual(self.dht_node.blobs_announced, self.num_blobs)
         self.assertEqual(self.announcer.hash_queue_size(), 0)
 
+    def test_hashes_are_announced_in_sorted_batches(self):
+        self.announcer.ANNOUNCE_BATCH_SIZE = 4
+        d = self.announcer._announce_hashes(self.blobs_to_announce)
+        self.clock.advance(1)
+        self.assertTrue(d.called)
+        self.assertEqual([4, 4, 2], [len(batch) for batch in self.dht_node.batches])
+        announced = [blob for batch in self.dht_node.batches for blob in batch]
+        self.assertEqual(sorted(announced), announced)
+        self.assertEqual(self.num_blobs, len(set(announced)))
+
     def test_immediate_announce(self):
         # Test that immediate announce puts a hash at the front of the queue
+        self.announcer.ANNOUNCE_BATCH_SIZE = 1
         self.announcer._announce_available_hashes()
         blob_hash = random_lbry_hash()
         self.announcer.immediate_announce([blob_hash])
@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+from twisted.internet import defer, protocol, reactor
+from twisted.test import proto_helpers
+from twisted.trial import unittest
+
+from lbrynet.core.server import SendfileSender
+
+
+class ReceiverProtocol(protocol.Protocol):
+    def __init__(self, expected_length):
+        self.expected_length = expected_length
+        self.received = []
+        self.finished = defer.Deferred()
+
+    def dataReceived(self, data):
+        self.received.append(data)
+        if sum(len(d) for d in self.received) >= self.expected_length:
+            self.finished.callback(''.join(self.received))
+
+
+class SenderProtocol(protocol.Protocol):
+    def __init__(self, factory):
+        self.factory = factory
+
+    def connectionMade(self):
+        self.factory.connected.callback(self)
+
+
+class SenderFactory(protocol.ServerFactory):
+    def __init__(self):
+        self.connected = defer.Deferred()
+
+    def buildProtocol(self, addr):
+        return SenderProtocol(self)
+
+
+class SendfileSenderTest(unittest.TestCase):
+    def setUp(self):
+        if SendfileSender.sendfile is None:
+            raise unittest.SkipTest("sendfile is not available")
+        fd, self.file_path = tempfile.mkstemp()
+        self.data = os.urandom(3 * SendfileSender.SendfileSender.CHUNK_SIZE + 123)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.data)
+        self.addCleanup(os.remove, self.file_path)
+
+    @defer.inlineCallbacks
+    def test_file_is_sent_after_buffered_data(self):
+        sender_factory = SenderFactory()
+        port = reactor.listenTCP(0, sender_factory, interface='127.0.0.1')
+        self.addCleanup(port.stopListening)
+        prefix = 'header'
+        receiver = ReceiverProtocol(len(prefix) + len(self.data) - 10)
+        client_factory = protocol.ClientFactory()
+        client_factory.protocol = lambda: receiver
+        reactor.connectTCP('127.0.0.1', port.getHost().port, client_factory)
+        sender_protocol = yield sender_factory.connected
+        self.addCleanup(sender_protocol.transport.loseConnection)
+
+        sent = []
+        with open(self.file_path, 'rb') as read_handle:
+            self.assertTrue(SendfileSender.SendfileSender.is_supported(
+                sender_protocol.transport, read_handle))
+            read_handle.seek(10)
+            sender_protocol.transport.write(prefix)
+            sender = SendfileSender.SendfileSender(
+                read_handle, sender_protocol.transport, sent.append)
+            yield sender.start()
+        received = yield receiver.finished
+        self.assertEqual(prefix + self.data[10:], received)
+        self.assertEqual(len(self.data) - 10, sum(sent))
+
+    def test_not_supported_on_fake_transport(self):
+        transport = proto_helpers.StringTransport()
+        with open(self.file_path, 'rb') as read_handle:
+            self.assertFalse(
+                SendfileSender.SendfileSender.is_supported(transport, read_handle))
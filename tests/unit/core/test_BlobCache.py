@@ -0,0 +1,61 @@
+from twisted.trial import unittest
+
+from lbrynet.core.BlobCache import BlobCache
+from lbrynet.core.HashBlob import TempBlob
+from tests.util import random_lbry_hash
+
+
+class BlobCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = BlobCache(3)
+
+    def _add_blobs(self, count):
+        blobs = [TempBlob(random_lbry_hash()) for _ in range(count)]
+        for blob in blobs:
+            self.cache.add(blob)
+        return blobs
+
+    def test_evicts_least_recently_used(self):
+        blobs = self._add_blobs(3)
+        self.cache.get(blobs[0].blob_hash)
+        self.cache.add(TempBlob(random_lbry_hash()))
+        self.assertEqual(3, len(self.cache))
+        self.assertIn(blobs[0].blob_hash, list(self.cache))
+        self.assertNotIn(blobs[1].blob_hash, list(self.cache))
+        self.assertEqual(1, self.cache.evictions)
+
+    def test_does_not_evict_blobs_in_use(self):
+        blobs = self._add_blobs(3)
+        blobs[0].readers = 1
+        blobs[1].writers = {'peer': None}
+        self._add_blobs(1)
+        self.assertIn(blobs[0].blob_hash, list(self.cache))
+        self.assertIn(blobs[1].blob_hash, list(self.cache))
+        self.assertNotIn(blobs[2].blob_hash, list(self.cache))
+
+    def test_over_size_when_everything_is_in_use(self):
+        blobs = self._add_blobs(3)
+        for blob in blobs:
+            blob.readers = 1
+        self._add_blobs(1)
+        self.assertEqual(3, len(self.cache))
+        self.assertEqual(1, self.cache.evictions)
+        blob = TempBlob(random_lbry_hash())
+        blob.readers = 1
+        self.cache.add(blob)
+        self.assertEqual(4, len(self.cache))
+
+    def test_evicted_blob_still_referenced_is_returned(self):
+        blobs = self._add_blobs(4)
+        self.assertNotIn(blobs[0].blob_hash, list(self.cache))
+        self.assertIs(blobs[0], self.cache.get(blobs[0].blob_hash))
+
+    def test_stats(self):
+        blobs = self._add_blobs(1)
+        self.cache.get(blobs[0].blob_hash)
+        self.cache.get(random_lbry_hash())
+        stats = self.cache.get_stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(0, stats['evictions'])
+        self.assertEqual(1, stats['size'])
@@ -0,0 +1,282 @@
+import os
+import shutil
+import tempfile
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from lbrynet import conf
+from lbrynet.core import Database
+from lbrynet.core.BlobManager import DiskBlobManager, TempBlobManager
+from lbrynet.core.HashAnnouncer import DummyHashAnnouncer
+from lbrynet.core.HashBlob import BlobFile
+from tests.util import random_lbry_hash
+
+
+class DiskBlobManagerTest(unittest.TestCase):
+    @defer.inlineCallbacks
+    def setUp(self):
+        conf.initialize_settings()
+        self.db_dir = tempfile.mkdtemp()
+        self.blob_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.db_dir)
+        self.addCleanup(shutil.rmtree, self.blob_dir)
+        self.bm = yield self._start_manager()
+
+    def tearDown(self):
+        conf.settings = None
+
+    @defer.inlineCallbacks
+    def _start_manager(self):
+        bm = DiskBlobManager(DummyHashAnnouncer(), self.blob_dir, self.db_dir)
+        yield bm.setup()
+        self.addCleanup(bm.stop)
+        defer.returnValue(bm)
+
+    @defer.inlineCallbacks
+    def _create_blob(self, data):
+        creator = self.bm.get_blob_creator()
+        creator.write(data)
+        blob_hash = yield creator.close()
+        defer.returnValue(blob_hash)
+
+    @defer.inlineCallbacks
+    def _download_blob(self, data):
+        blob_hash = random_lbry_hash()
+        with open(os.path.join(self.blob_dir, blob_hash), 'wb') as f:
+            f.write(data)
+        blob = BlobFile(self.blob_dir, blob_hash, len(data), verified=True)
+        yield self.bm.blob_completed(blob)
+        defer.returnValue(blob_hash)
+
+    @defer.inlineCallbacks
+    def test_completed_blobs_uses_index(self):
+        blob_hash = yield self._create_blob('a' * 100)
+        unknown_hash = random_lbry_hash()
+        completed = yield self.bm.completed_blobs([blob_hash, unknown_hash])
+        self.assertEqual([blob_hash], completed)
+        verified = yield self.bm.get_all_verified_blobs()
+        self.assertEqual([blob_hash], verified)
+
+    @defer.inlineCallbacks
+    def test_index_is_loaded_on_setup(self):
+        blob_hash = yield self._create_blob('b' * 100)
+        yield self.bm._flush_db()
+        bm = yield self._start_manager()
+        completed = yield bm.completed_blobs([blob_hash])
+        self.assertEqual([blob_hash], completed)
+        blob = yield bm.get_blob(blob_hash)
+        self.assertTrue(blob.verified)
+        self.assertEqual(100, blob.length)
+
+    @defer.inlineCallbacks
+    def test_stop_closes_the_database(self):
+        bm = yield self._start_manager()
+        db_path = os.path.abspath(bm.db_file)
+        yield self.bm.stop()
+        self.assertIn(db_path, Database._databases)
+        yield bm.stop()
+        self.assertNotIn(db_path, Database._databases)
+
+    @defer.inlineCallbacks
+    def test_delete_removes_from_index(self):
+        blob_hash = yield self._create_blob('c' * 100)
+        yield self.bm.delete_blobs([blob_hash])
+        completed = yield self.bm.completed_blobs([blob_hash])
+        self.assertEqual([], completed)
+        to_announce = yield self.bm.hashes_to_announce()
+        self.assertNotIn(blob_hash, to_announce)
+
+    @defer.inlineCallbacks
+    def test_db_writes_are_batched(self):
+        blob_hashes = []
+        for i in range(3):
+            blob_hash = yield self._create_blob(str(i) * 100)
+            blob_hashes.append(blob_hash)
+        self.bm.delete_blobs(blob_hashes[:1])
+        yield self.bm._delete_blobs_from_db(blob_hashes[:1])
+        rows = yield self.bm.db_conn.runQuery("select blob_hash from blobs")
+        self.assertEqual([], rows)
+        yield self.bm._flush_db()
+        rows = yield self.bm.db_conn.runQuery("select blob_hash from blobs")
+        self.assertEqual(set(blob_hashes[1:]), set(r[0] for r in rows))
+
+    @defer.inlineCallbacks
+    def test_transfer_history_rollups(self):
+        blob_1, blob_2 = random_lbry_hash(), random_lbry_hash()
+        self.bm.add_blob_to_upload_history(blob_1, '1.2.3.4', 0.1, 100)
+        self.bm.add_blob_to_upload_history(blob_1, '1.2.3.4', 0.1, 100)
+        self.bm.add_blob_to_upload_history(blob_1, '5.6.7.8', 0.1, 100)
+        self.bm.add_blob_to_upload_history(blob_2, '5.6.7.8', 0.1, 50)
+        self.bm.add_blob_to_download_history(blob_2, '5.6.7.8', 0.1, 1000)
+        self.assertEqual(4, len(self.bm.transfer_history))
+
+        top_blobs = yield self.bm.get_top_blobs(limit=1)
+        self.assertEqual([(blob_1, 3, 300)], top_blobs)
+        per_host = yield self.bm.get_bytes_per_host()
+        self.assertEqual([('1.2.3.4', 2, 200), ('5.6.7.8', 2, 150)], per_host)
+        per_host = yield self.bm.get_bytes_per_host(direction='download')
+        self.assertEqual([('5.6.7.8', 1, 1000)], per_host)
+
+        self.bm.add_blob_to_upload_history(blob_2, '5.6.7.8', 0.1, 50)
+        per_host = yield self.bm.get_bytes_per_host()
+        self.assertEqual([('1.2.3.4', 2, 200), ('5.6.7.8', 3, 200)], per_host)
+
+    @defer.inlineCallbacks
+    def test_created_blobs_are_pinned(self):
+        blob_hash = yield self._create_blob('d' * 100)
+        self.assertTrue(self.bm.is_pinned(blob_hash))
+        bm = yield self._start_manager()
+        self.assertTrue(bm.is_pinned(blob_hash))
+        self.bm.delete_blobs([blob_hash])
+        self.assertFalse(self.bm.is_pinned(blob_hash))
+
+    @defer.inlineCallbacks
+    def test_eviction_over_storage_limit(self):
+        self.bm.storage_limit = 350
+        published = yield self._create_blob('p' * 100)
+        popular = yield self._download_blob('a' * 100)
+        self.bm.add_blob_to_upload_history(popular, '1.2.3.4', 0.1, 100)
+        oldest = yield self._download_blob('b' * 100)
+        self.bm._blob_access_times[oldest] -= 60
+        self.assertIsNone(self.bm._eviction_deferred)
+
+        newest = yield self._download_blob('c' * 100)
+        evicted = yield self.bm._eviction_deferred
+        self.assertEqual([oldest], evicted)
+        self.assertEqual(300, self.bm.get_storage_stats()['bytes'])
+        completed = yield self.bm.completed_blobs([published, popular, oldest, newest])
+        self.assertEqual([published, popular, newest], completed)
+        rows = yield self.bm.db_conn.runQuery("select blob_hash from blobs where blob_hash = ?",
+                                              (oldest,))
+        self.assertEqual([], rows)
+        to_announce = yield self.bm.hashes_to_announce()
+        self.assertNotIn(oldest, to_announce)
+
+    @defer.inlineCallbacks
+    def test_delete_blob_files_in_batches(self):
+        self.bm.DELETE_BATCH_SIZE = 2
+        blob_hashes = []
+        for i in range(5):
+            blob_hash = yield self._download_blob(str(i) * 100)
+            blob_hashes.append(blob_hash)
+        yield self.bm.delete_blobs(blob_hashes)
+        for blob_hash in blob_hashes:
+            self.assertFalse(os.path.isfile(os.path.join(self.blob_dir, blob_hash)))
+        self.assertIsNone(self.bm._deletion_deferred)
+        self.assertIsNone(self.bm._next_deletion_retry)
+        yield self.bm._flush_db()
+        rows = yield self.bm.db_conn.runQuery("select blob_hash from blobs")
+        self.assertEqual([], rows)
+
+    @defer.inlineCallbacks
+    def test_delete_blob_in_use_is_retried(self):
+        blob_hash = yield self._download_blob('e' * 100)
+        blob = yield self.bm.get_blob(blob_hash)
+        read_handle = blob.open_for_reading()
+        yield self.bm.delete_blobs([blob_hash])
+        self.assertTrue(os.path.isfile(blob.file_path))
+        self.assertIsNotNone(self.bm._next_deletion_retry)
+        # the blob stays completed until its file is deleted
+        completed = yield self.bm.completed_blobs([blob_hash])
+        self.assertEqual([blob_hash], completed)
+
+        blob.close_read_handle(read_handle)
+        self.bm._next_deletion_retry.cancel()
+        self.bm._retry_deleting_blobs_in_use()
+        yield self.bm._deletion_deferred
+        self.assertFalse(os.path.isfile(blob.file_path))
+        self.assertFalse(blob.verified)
+        completed = yield self.bm.completed_blobs([blob_hash])
+        self.assertEqual([], completed)
+        self.assertIsNone(self.bm._next_deletion_retry)
+
+
+class TempBlobManagerTest(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings()
+        self.bm = TempBlobManager(DummyHashAnnouncer(), memory_limit=250)
+        self.bm.setup()
+        self.addCleanup(self.bm.stop)
+
+    def tearDown(self):
+        conf.settings = None
+
+    @defer.inlineCallbacks
+    def _create_blob(self, data):
+        creator = self.bm.get_blob_creator()
+        creator.write(data)
+        blob_hash = yield creator.close()
+        defer.returnValue(blob_hash)
+
+    def _read_blob(self, blob):
+        read_handle = blob.open_for_reading()
+        try:
+            return read_handle.read()
+        finally:
+            blob.close_read_handle(read_handle)
+
+    @defer.inlineCallbacks
+    def test_least_recently_used_blobs_are_spilled(self):
+        first = yield self._create_blob('a' * 100)
+        second = yield self._create_blob('b' * 100)
+        yield self.bm.get_blob(first)
+        third = yield self._create_blob('c' * 100)
+        yield self.bm._spill_deferred
+        self.assertEqual({
+            'blobs_in_memory': 2,
+            'bytes_in_memory': 200,
+            'blobs_spilled': 1,
+            'bytes_spilled': 100,
+            'memory_limit': 250,
+        }, self.bm.get_storage_stats())
+
+        spilled = yield self.bm.get_blob(second)
+        self.assertIsNone(spilled.data_buffer)
+        self.assertTrue(os.path.isfile(spilled.spill_path))
+        self.assertEqual('b' * 100, self._read_blob(spilled))
+        blob_map = spilled.open_for_mapped_reading()
+        self.assertEqual('b' * 100, str(blob_map.slice()))
+        blob_map.close()
+        for blob_hash in (first, third):
+            blob = yield self.bm.get_blob(blob_hash)
+            self.assertIsNone(blob.spill_path)
+
+    @defer.inlineCallbacks
+    def test_spilled_blob_is_deleted(self):
+        blob_hashes = []
+        for i in range(3):
+            blob_hash = yield self._create_blob(str(i) * 100)
+            blob_hashes.append(blob_hash)
+        yield self.bm._spill_deferred
+        blob = yield self.bm.get_blob(blob_hashes[0])
+        spill_path = blob.spill_path
+        self.bm.delete_blobs([blob_hashes[0]])
+        yield self.bm._delete_blobs_marked_for_deletion()
+        self.assertFalse(os.path.isfile(spill_path))
+        self.assertEqual(0, self.bm.bytes_spilled)
+        self.assertEqual(200, self.bm.bytes_in_memory)
+
+        spill_dir = self.bm.spill_dir
+        yield self.bm.stop()
+        self.assertFalse(os.path.isdir(spill_dir))
+
+    @defer.inlineCallbacks
+    def test_spilled_blobs_are_deleted_together(self):
+        blob_hashes = []
+        for i in range(4):
+            blob_hash = yield self._create_blob(str(i) * 100)
+            blob_hashes.append(blob_hash)
+            yield self.bm._spill_deferred
+        self.assertEqual(200, self.bm.bytes_spilled)
+        spill_paths = []
+        for blob_hash in blob_hashes[:2]:
+            blob = yield self.bm.get_blob(blob_hash)
+            spill_paths.append(blob.spill_path)
+        self.bm.delete_blobs(blob_hashes[:2])
+        yield self.bm._delete_blobs_marked_for_deletion()
+        for spill_path in spill_paths:
+            self.assertFalse(os.path.isfile(spill_path))
+        self.assertEqual({}, self.bm.blob_hashes_to_delete)
+        self.assertEqual(0, self.bm.bytes_spilled)
+        self.assertEqual(200, self.bm.bytes_in_memory)
@@ -0,0 +1,200 @@
+import os
+import shutil
+import tempfile
+
+from twisted.internet import defer, reactor, task, threads
+from twisted.trial import unittest
+
+from lbrynet import conf
+from lbrynet.core.BlobManager import DiskBlobManager
+from lbrynet.core.BlobPackStore import BlobPackStore, INDEX_FILE_EXTENSION
+from lbrynet.core.HashAnnouncer import DummyHashAnnouncer
+from lbrynet.core.cryptoutils import get_lbry_hash_obj
+from tests.util import random_lbry_hash
+
+
+def get_blob_hash(data):
+    hashsum = get_lbry_hash_obj()
+    hashsum.update(data)
+    return hashsum.hexdigest()
+
+
+class BlobPackStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.pack_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pack_dir)
+        self.store = self._load_store()
+
+    def _load_store(self):
+        store = BlobPackStore(self.pack_dir, 100)
+        store.MAX_PACK_SIZE = 350
+        store.load()
+        self.addCleanup(store.close)
+        return store
+
+    def _add_blobs(self, count):
+        blobs = {}
+        for i in range(count):
+            blob_hash = random_lbry_hash()
+            blobs[blob_hash] = str(i) * 100
+            self.store.add(blob_hash, blobs[blob_hash])
+        return blobs
+
+    def test_add_and_read(self):
+        blobs = self._add_blobs(4)
+        for blob_hash, data in blobs.iteritems():
+            self.assertIn(blob_hash, self.store)
+            self.assertEqual(data, self.store.read(blob_hash))
+            self.assertEqual(100, self.store.get_length(blob_hash))
+        self.assertIsNone(self.store.read(random_lbry_hash()))
+        # three blobs fit in a pack
+        self.assertEqual(2, self.store.get_stats()['packs'])
+
+    def test_index_is_loaded(self):
+        blobs = self._add_blobs(3)
+        removed = blobs.keys()[0]
+        self.store.remove([removed])
+        store = self._load_store()
+        self.assertEqual(2, len(store))
+        self.assertNotIn(removed, store)
+        for blob_hash, data in blobs.iteritems():
+            if blob_hash != removed:
+                self.assertEqual(data, store.read(blob_hash))
+
+    def test_truncated_index_line_is_ignored(self):
+        blob_hash = random_lbry_hash()
+        self.store.add(blob_hash, 'a' * 100)
+        self.store.close()
+        with open(self.store.get_path(0, INDEX_FILE_EXTENSION), 'ab') as index_file:
+            index_file.write(random_lbry_hash() + ' 100')
+        store = self._load_store()
+        self.assertEqual(1, len(store))
+        self.assertEqual('a' * 100, store.read(blob_hash))
+
+    def test_compaction(self):
+        blobs = self._add_blobs(5)
+        removed = [b for b in blobs if self.store._index[b][0] == 0][:2]
+        self.store.remove(removed)
+        self.assertEqual([0], self.store.get_packs_to_compact())
+        self.assertEqual(300, self.store.compact())
+        self.assertFalse(os.path.isfile(self.store.get_path(0)))
+        self.assertEqual([], self.store.get_packs_to_compact())
+        store = self._load_store()
+        self.assertEqual(3, len(store))
+        for blob_hash in blobs:
+            if blob_hash not in removed:
+                self.assertEqual(blobs[blob_hash], store.read(blob_hash))
+
+    def test_empty_pack_is_deleted(self):
+        blobs = self._add_blobs(4)
+        first_pack = [b for b in blobs if self.store._index[b][0] == 0]
+        self.store.remove(first_pack)
+        self.assertFalse(os.path.isfile(self.store.get_path(0)))
+        self.assertEqual(1, self.store.get_stats()['packs'])
+
+
+class PackedBlobTest(unittest.TestCase):
+    @defer.inlineCallbacks
+    def setUp(self):
+        conf.initialize_settings()
+        self.db_dir = tempfile.mkdtemp()
+        self.blob_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.db_dir)
+        self.addCleanup(shutil.rmtree, self.blob_dir)
+        self.bm = DiskBlobManager(DummyHashAnnouncer(), self.blob_dir, self.db_dir,
+                                  blob_pack_max_size=1000)
+        yield self.bm.setup()
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.bm.stop()
+        conf.settings = None
+
+    @defer.inlineCallbacks
+    def _receive_blob(self, data, length=None):
+        blob = yield self.bm.get_blob(get_blob_hash(data), length)
+        finished_d, write, _ = blob.open_for_writing('peer')
+        # the length of stream descriptors is only known once the peer sends it
+        blob.set_length(len(data))
+        write(data)
+        yield finished_d
+        yield self.bm.blob_completed(blob)
+        # the writer is removed from the blob after finished_d has fired
+        yield task.deferLater(reactor, 0, lambda: None)
+        defer.returnValue(blob)
+
+    def _read_blob(self, blob):
+        read_handle = blob.open_for_reading()
+        try:
+            return read_handle.read()
+        finally:
+            blob.close_read_handle(read_handle)
+
+    @defer.inlineCallbacks
+    def test_received_blobs(self):
+        small = yield self._receive_blob('a' * 1000)
+        big = yield self._receive_blob('b' * 1001)
+        big_with_length = yield self._receive_blob('c' * 1001, 1001)
+        self.assertTrue(self.bm.is_packed(small.blob_hash))
+        self.assertFalse(os.path.isfile(small.file_path))
+        self.assertEqual('a' * 1000, self._read_blob(small))
+        blob_map = small.open_for_mapped_reading()
+        self.assertEqual('a' * 1000, str(blob_map.slice()))
+        blob_map.close()
+        self.assertEqual(0, small.readers)
+        for blob in (big, big_with_length):
+            self.assertFalse(self.bm.is_packed(blob.blob_hash))
+            with open(blob.file_path, 'rb') as blob_file:
+                self.assertEqual(blob.length, len(blob_file.read()))
+
+    @defer.inlineCallbacks
+    def test_open_packed_blob_for_reading_async(self):
+        blob = yield self._receive_blob('h' * 100)
+        read_handle = yield blob.open_for_reading_async()
+        self.assertEqual(1, blob.readers)
+        self.assertEqual('h' * 100, read_handle.read())
+        blob.close_read_handle(read_handle)
+        self.assertEqual(0, blob.readers)
+
+    @defer.inlineCallbacks
+    def test_created_blob_is_packed_and_reloaded(self):
+        creator = self.bm.get_blob_creator()
+        creator.write('d' * 500)
+        blob_hash = yield creator.close()
+        self.assertTrue(self.bm.is_packed(blob_hash))
+        yield self.bm._flush_db()
+
+        self.bm.blobs.remove(blob_hash)
+        self.bm.pack_store.close()
+        yield threads.deferToThread(self.bm.pack_store.load)
+        blob = yield self.bm.get_blob(blob_hash)
+        self.assertTrue(blob.verified)
+        self.assertEqual('d' * 500, self._read_blob(blob))
+
+    @defer.inlineCallbacks
+    def test_delete_packed_blob(self):
+        blob = yield self._receive_blob('e' * 100)
+        yield self.bm.delete_blobs([blob.blob_hash])
+        self.assertFalse(self.bm.is_packed(blob.blob_hash))
+        self.assertFalse(blob.verified)
+        self.assertIsNone(blob.open_for_reading())
+
+    @defer.inlineCallbacks
+    def test_scrub_packed_blob(self):
+        blob = yield self._receive_blob('f' * 100)
+        corrupt = yield self._receive_blob('g' * 100)
+        pack_id, offset, _ = self.bm.pack_store._index[corrupt.blob_hash]
+        with open(self.bm.pack_store.get_path(pack_id), 'r+b') as pack_file:
+            pack_file.seek(offset)
+            pack_file.write('x')
+        yield self.bm._flush_db()
+        yield self.bm.db_conn.runQuery("update blobs set last_verified_time = 0")
+        yield self.bm.scrubber._scrub_next_blob()
+        yield self.bm.scrubber._scrub_next_blob()
+        self.assertEqual(1, self.bm.scrubber.blobs_verified)
+        self.assertEqual(1, self.bm.scrubber.blobs_quarantined)
+        self.assertTrue(self.bm.is_packed(blob.blob_hash))
+        self.assertFalse(self.bm.is_packed(corrupt.blob_hash))
+        self.assertFalse(corrupt.verified)
+        self.assertTrue(
+            os.path.isfile(os.path.join(self.bm.quarantine_dir, corrupt.blob_hash)))
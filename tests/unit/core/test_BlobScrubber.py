@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from lbrynet import conf
+from lbrynet.core.BlobManager import DiskBlobManager
+from lbrynet.core.HashAnnouncer import DummyHashAnnouncer
+
+
+class BlobScrubberTest(unittest.TestCase):
+    @defer.inlineCallbacks
+    def setUp(self):
+        conf.initialize_settings()
+        self.db_dir = tempfile.mkdtemp()
+        self.blob_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.db_dir)
+        self.addCleanup(shutil.rmtree, self.blob_dir)
+        # scrub blob files, scrubbing packed blobs is covered in test_BlobPackStore
+        self.bm = DiskBlobManager(DummyHashAnnouncer(), self.blob_dir, self.db_dir,
+                                  blob_pack_max_size=0)
+        yield self.bm.setup()
+        self.scrubber = self.bm.scrubber
+        self.blob_hashes = []
+        for i in range(3):
+            creator = self.bm.get_blob_creator()
+            creator.write(str(i) * 1000)
+            blob_hash = yield creator.close()
+            self.blob_hashes.append(blob_hash)
+        yield self.bm._flush_db()
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.bm.stop()
+        conf.settings = None
+
+    def _get_last_verified_times(self):
+        d = self.bm.db_conn.runQuery("select blob_hash, last_verified_time from blobs")
+        d.addCallback(dict)
+        return d
+
+    def test_delay_respects_budget(self):
+        self.scrubber.max_bytes_per_second = 2 ** 20
+        self.scrubber.max_iops = 10
+        # 32 reads of 64 KB
+        self.assertEqual(3.2, self.scrubber.get_delay(2 * 2 ** 20))
+        self.assertEqual(0.1, self.scrubber.get_delay(100))
+        self.scrubber.max_iops = 100
+        self.assertEqual(2.0, self.scrubber.get_delay(2 * 2 ** 20))
+
+    @defer.inlineCallbacks
+    def test_scrubs_least_recently_verified_first(self):
+        yield self.bm.db_conn.runQuery(
+            "update blobs set last_verified_time = ? where blob_hash = ?",
+            (1, self.blob_hashes[1]))
+        yield self.bm.db_conn.runQuery(
+            "update blobs set last_verified_time = null where blob_hash = ?",
+            (self.blob_hashes[2],))
+        to_scrub = yield self.bm.get_blobs_to_scrub(2, 10)
+        self.assertEqual([self.blob_hashes[2], self.blob_hashes[1]], [b for b, _ in to_scrub])
+
+        num_bytes = yield self.scrubber._scrub_next_blob()
+        self.assertEqual(1000, num_bytes)
+        yield self.scrubber._scrub_next_blob()
+        num_bytes = yield self.scrubber._scrub_next_blob()
+        self.assertIsNone(num_bytes)
+        self.assertEqual(2, self.scrubber.blobs_verified)
+        yield self.bm._flush_db()
+        last_verified = yield self._get_last_verified_times()
+        self.assertGreater(last_verified[self.blob_hashes[1]], 1)
+        self.assertIsNotNone(last_verified[self.blob_hashes[2]])
+
+    @defer.inlineCallbacks
+    def test_corrupt_blob_is_quarantined(self):
+        corrupt_hash = self.blob_hashes[0]
+        blob = yield self.bm.get_blob(corrupt_hash)
+        with open(blob.file_path, 'r+b') as f:
+            f.write('x')
+        yield self.bm.db_conn.runQuery(
+            "update blobs set last_verified_time = 0 where blob_hash = ?", (corrupt_hash,))
+
+        yield self.scrubber._scrub_next_blob()
+        self.assertEqual(1, self.scrubber.blobs_quarantined)
+        self.assertFalse(blob.verified)
+        self.assertTrue(os.path.isfile(os.path.join(self.bm.quarantine_dir, corrupt_hash)))
+        self.assertFalse(os.path.isfile(blob.file_path))
+        completed = yield self.bm.completed_blobs(self.blob_hashes)
+        self.assertNotIn(corrupt_hash, completed)
+        yield self.bm._flush_db()
+        last_verified = yield self._get_last_verified_times()
+        self.assertNotIn(corrupt_hash, last_verified)
@@ -0,0 +1,95 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from lbrynet.core import Database
+
+
+class DatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.db_dir)
+        self.db_path = os.path.join(self.db_dir, 'test.db')
+        self.db = Database.open_database(self.db_path)
+        self.addCleanup(self.db.close)
+        return self.db.runOperation("create table numbers (n integer primary key, name text)")
+
+    def test_wal_mode(self):
+        connection = sqlite3.connect(self.db_path)
+        mode, = connection.execute("pragma journal_mode").fetchone()
+        connection.close()
+        self.assertEqual('wal', mode)
+
+    def test_database_is_shared(self):
+        db = Database.open_database(self.db_path)
+        self.assertIs(self.db, db)
+        db.close()
+        self.assertIs(self.db, Database._databases[os.path.abspath(self.db_path)])
+        self.db.close()
+        self.assertNotIn(os.path.abspath(self.db_path), Database._databases)
+        # closing more often than opening is ignored
+        self.db.close()
+
+    @defer.inlineCallbacks
+    def test_use_after_close_fails(self):
+        self.db.close()
+        yield self.assertFailure(self.db.runQuery("select * from numbers"),
+                                 sqlite3.ProgrammingError)
+        yield self.assertFailure(self.db.runOperation("delete from numbers"),
+                                 sqlite3.ProgrammingError)
+        yield self.assertFailure(self.db.runInteraction(lambda transaction: None),
+                                 sqlite3.ProgrammingError)
+
+    @defer.inlineCallbacks
+    def test_concurrent_reads_and_writes(self):
+        def insert(transaction, i):
+            transaction.execute("insert into numbers values (?, ?)", (i, str(i)))
+            return transaction.lastrowid
+
+        ds = []
+        for i in range(200):
+            ds.append(self.db.runInteraction(insert, i))
+            ds.append(self.db.runQuery("select count(*) from numbers"))
+        results = yield defer.gatherResults(ds)
+        self.assertEqual(range(200), results[::2])
+        for rows in results[1::2]:
+            self.assertTrue(0 <= rows[0][0] <= 200)
+        rows = yield self.db.runQuery("select count(*) from numbers")
+        self.assertEqual([(200,)], rows)
+
+    @defer.inlineCallbacks
+    def test_failed_interaction_is_rolled_back(self):
+        def insert_twice(transaction):
+            transaction.execute("insert into numbers values (1, 'one')")
+            transaction.execute("insert into numbers values (1, 'one')")
+
+        yield self.assertFailure(self.db.runInteraction(insert_twice), sqlite3.IntegrityError)
+        rows = yield self.db.runQuery("select * from numbers")
+        self.assertEqual([], rows)
+        yield self.db.runQuery("insert into numbers values (2, 'two')")
+        rows = yield self.db.runQuery("select * from numbers")
+        self.assertEqual([(2, u'two')], rows)
+
+    @defer.inlineCallbacks
+    def test_query_metrics(self):
+        def insert_many(transaction, names):
+            transaction.execute("delete from numbers where name in (?, ?)", ('a', 'b'))
+            transaction.executemany("insert into numbers (name) values (?)",
+                                    [(name,) for name in names])
+
+        yield self.db.runInteraction(insert_many, ['a', 'b', 'c'])
+        yield self.db.runQuery("select name from numbers where n = ?", (1,))
+        yield self.db.runQuery("select name from numbers where n = ?", (2,))
+        stats = self.db.get_stats()
+        self.assertEqual(0, stats['pending_writes'])
+        queries = stats['queries']
+        self.assertEqual(2, queries["select name from numbers where n = ?"]['count'])
+        self.assertEqual(1, queries["insert into numbers (name) values (?)"]['count'])
+        self.assertEqual(1, queries["delete from numbers where name in (?, ...)"]['count'])
+        # creating the table and the interaction
+        self.assertEqual(2, queries[Database.Database.WRITE_QUEUE]['count'])
+        self.assertIn('test.db', Database.get_database_stats())
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+
+from twisted.internet import defer
+from twisted.test import proto_helpers
+from twisted.trial import unittest
+
+from lbrynet import conf
+from lbrynet.core.cryptoutils import get_lbry_hash_obj
+from lbrynet.core.Error import DownloadCanceledError, InvalidDataError
+from lbrynet.core.HashBlob import BlobFile, BlobMapSender, HashBlobWriter, TempBlob
+from tests.util import random_lbry_hash
+
+
+class BlobReadMapTest(unittest.TestCase):
+    def setUp(self):
+        self.blob_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.blob_dir)
+        self.data = os.urandom(3 * BlobMapSender.CHUNK_SIZE + 7)
+        self.blob_hash = random_lbry_hash()
+        with open(os.path.join(self.blob_dir, self.blob_hash), 'wb') as f:
+            f.write(self.data)
+        self.blob = BlobFile(self.blob_dir, self.blob_hash, len(self.data), verified=True)
+
+    def test_mapped_reading(self):
+        blob_map = self.blob.open_for_mapped_reading()
+        self.assertEqual(1, self.blob.readers)
+        self.assertEqual(len(self.data), len(blob_map))
+        self.assertEqual(self.data[10:20], blob_map.slice(10, 20)[:])
+        self.assertEqual(self.data, ''.join(c[:] for c in blob_map.iter_slices(2 ** 16)))
+        blob_map.close()
+        self.assertEqual(0, self.blob.readers)
+
+    def test_read_passes_the_whole_blob(self):
+        received = []
+        d = self.blob.read(lambda data: received.append(data[:]))
+        self.assertEqual(len(self.data), self.successResultOf(d))
+        self.assertEqual([self.data], received)
+        self.assertEqual(0, self.blob.readers)
+
+    def test_empty_blob(self):
+        blob_hash = random_lbry_hash()
+        open(os.path.join(self.blob_dir, blob_hash), 'wb').close()
+        blob = BlobFile(self.blob_dir, blob_hash, 0, verified=True)
+        blob_map = blob.open_for_mapped_reading()
+        self.assertEqual('', blob_map.slice()[:])
+        blob_map.close()
+
+    def test_unverified_blob_is_not_mapped(self):
+        blob = TempBlob(random_lbry_hash())
+        self.assertIsNone(blob.open_for_mapped_reading())
+        self.failureResultOf(blob.read(lambda data: None), ValueError)
+
+    def test_blob_map_sender(self):
+        consumer = proto_helpers.StringTransport()
+        blob_map = self.blob.open_for_mapped_reading()
+        d = BlobMapSender().beginFileTransfer(blob_map, consumer)
+        self.assertEqual(len(self.data), self.successResultOf(d))
+        self.assertEqual(self.data, consumer.value())
+        blob_map.close()
+
+
+class HashBlobWriterTest(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings()
+        self.blob_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.blob_dir)
+        self.data = os.urandom(3 * HashBlobWriter.MAX_BUFFER_SIZE)
+        hashsum = get_lbry_hash_obj()
+        hashsum.update(self.data)
+        self.blob = BlobFile(self.blob_dir, hashsum.hexdigest(), len(self.data), verified=False)
+
+    def tearDown(self):
+        conf.settings = None
+
+    @defer.inlineCallbacks
+    def test_write_blob(self):
+        finished_d, write, _ = self.blob.open_for_writing('peer')
+        drained = []
+        for i in range(0, len(self.data), 2 ** 16):
+            d = write(self.data[i:i + 2 ** 16])
+            if d is not None:
+                drained.append(d)
+        self.assertTrue(drained, "the writer never asked to slow down")
+        blob = yield finished_d
+        self.assertIs(self.blob, blob)
+        self.assertTrue(blob.verified)
+        for d in drained:
+            self.assertTrue(d.called)
+        with open(blob.file_path, 'rb') as f:
+            self.assertEqual(self.data, f.read())
+
+    @defer.inlineCallbacks
+    def test_write_too_much(self):
+        finished_d, write, _ = self.blob.open_for_writing('peer')
+        write(self.data[:10])
+        write(self.data + 'x')
+        yield self.assertFailure(finished_d, InvalidDataError)
+        self.assertFalse(self.blob.verified)
+
+    @defer.inlineCallbacks
+    def test_cancel(self):
+        finished_d, write, cancel = self.blob.open_for_writing('peer')
+        write(self.data[:10])
+        cancel()
+        yield self.assertFailure(finished_d, DownloadCanceledError)
+        self.assertFalse(self.blob.verified)
+        self.assertFalse(os.path.isfile(self.blob.file_path))
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from lbrynet.core import blob_layout
+from tests.util import random_lbry_hash
+
+
+class BlobLayoutTest(unittest.TestCase):
+    def test_get_blob_path(self):
+        blob_hash = random_lbry_hash()
+        self.assertEqual(os.path.join('blobs', blob_hash),
+                         blob_layout.get_blob_path('blobs', blob_hash, 0))
+        self.assertEqual(os.path.join('blobs', blob_hash[:2], blob_hash[2:4], blob_hash),
+                         blob_layout.get_blob_path('blobs', blob_hash, 2))
+
+
+class BlobLayoutMigratorTest(unittest.TestCase):
+    def setUp(self):
+        self.blob_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.blob_dir)
+        self.blob_hashes = [random_lbry_hash() for _ in range(10)]
+        for blob_hash in self.blob_hashes:
+            with open(os.path.join(self.blob_dir, blob_hash), 'w') as f:
+                f.write(blob_hash)
+        with open(os.path.join(self.blob_dir, 'tmpfile'), 'w') as f:
+            f.write('not a blob')
+
+    def _assert_blobs_in_layout(self, dir_levels):
+        for blob_hash in self.blob_hashes:
+            path = blob_layout.get_blob_path(self.blob_dir, blob_hash, dir_levels)
+            self.assertTrue(os.path.isfile(path))
+
+    @defer.inlineCallbacks
+    def test_migrate(self):
+        migrator = blob_layout.BlobLayoutMigrator(self.blob_dir, 2)
+        yield migrator.start()
+        yield migrator._migrate_deferred
+        self._assert_blobs_in_layout(2)
+        self.assertTrue(os.path.isfile(os.path.join(self.blob_dir, 'tmpfile')))
+        self.assertEqual(2, blob_layout.read_dir_levels(self.blob_dir))
+
+        migrator = blob_layout.BlobLayoutMigrator(self.blob_dir, 1)
+        yield migrator.start()
+        yield migrator._migrate_deferred
+        self._assert_blobs_in_layout(1)
+        self.assertEqual(1, blob_layout.read_dir_levels(self.blob_dir))
+
+    @defer.inlineCallbacks
+    def test_no_migration_when_layout_matches(self):
+        migrator = blob_layout.BlobLayoutMigrator(self.blob_dir, 0)
+        yield migrator.start()
+        self.assertEqual(0, migrator.pending)
+        self._assert_blobs_in_layout(0)
+
+    def test_migrate_blob_on_demand(self):
+        migrator = blob_layout.BlobLayoutMigrator(self.blob_dir, 2)
+        migrator._pending = blob_layout.find_misplaced_blobs(self.blob_dir, 2)
+        migrator.migrate_blob(self.blob_hashes[0])
+        self.assertTrue(os.path.isfile(
+            blob_layout.get_blob_path(self.blob_dir, self.blob_hashes[0], 2)))
+        self.assertEqual(len(self.blob_hashes) - 1, migrator.pending)
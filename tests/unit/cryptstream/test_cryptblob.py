@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from lbrynet import conf
+from lbrynet.core.HashBlob import BlobFile
+from lbrynet.cryptstream.CryptBlob import CryptStreamBlobMaker, StreamBlobDecryptor
+from tests.util import random_lbry_hash
+
+
+class EncryptedBlobWriter(object):
+    def __init__(self):
+        self.data = []
+
+    def write(self, data):
+        self.data.append(data)
+
+    def close(self):
+        return defer.succeed(random_lbry_hash())
+
+
+class StreamBlobDecryptorTest(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings()
+        self.blob_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.blob_dir)
+        self.key = os.urandom(16)
+        self.iv = os.urandom(16)
+
+    def tearDown(self):
+        conf.settings = None
+
+    @defer.inlineCallbacks
+    def _encrypt_to_blob(self, plaintext):
+        writer = EncryptedBlobWriter()
+        maker = CryptStreamBlobMaker(self.key, self.iv, 0, writer)
+        maker.write(plaintext)
+        blob_info = yield maker.close()
+        encrypted = ''.join(writer.data)
+        blob_hash = random_lbry_hash()
+        with open(os.path.join(self.blob_dir, blob_hash), 'wb') as f:
+            f.write(encrypted)
+        blob = BlobFile(self.blob_dir, blob_hash, len(encrypted), verified=True)
+        defer.returnValue((blob, blob_info))
+
+    @defer.inlineCallbacks
+    def _test_round_trip(self, plaintext):
+        blob, blob_info = yield self._encrypt_to_blob(plaintext)
+        decrypted = []
+        decryptor = StreamBlobDecryptor(blob, self.key, self.iv, blob_info.length)
+        yield decryptor.decrypt(decrypted.append)
+        self.assertEqual(plaintext, ''.join(decrypted))
+        self.assertEqual(0, blob.readers)
+
+    def test_decrypt(self):
+        return self._test_round_trip(os.urandom(2 ** 20 + 5))
+
+    def test_decrypt_block_multiple(self):
+        return self._test_round_trip(os.urandom(2 ** 16))
+
+    def test_decrypt_short(self):
+        return self._test_round_trip('hello')
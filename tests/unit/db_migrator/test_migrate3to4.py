@@ -0,0 +1,58 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from twisted.trial import unittest
+
+from lbrynet.db_migrator import migrate3to4
+from tests.util import random_lbry_hash
+
+
+class MigrateBlobsDbTest(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.db_dir)
+        self.db_path = os.path.join(self.db_dir, "blobs.db")
+        db = sqlite3.connect(self.db_path)
+        for direction in ('download', 'upload'):
+            db.execute("create table {} (id integer primary key autoincrement, blob text, "
+                       "host text, rate float, ts integer)".format(direction))
+        db.commit()
+        db.close()
+
+    def _insert(self, direction, rows):
+        db = sqlite3.connect(self.db_path)
+        db.executemany("insert into {} values (null, ?, ?, ?, ?)".format(direction), rows)
+        db.commit()
+        db.close()
+
+    def _get_history(self):
+        db = sqlite3.connect(self.db_path)
+        rows = db.execute("select direction, blob_hash, host, hour, transfers, rate_sum "
+                          "from transfer_history order by direction").fetchall()
+        tables = [t for t, in db.execute("select tbl_name from sqlite_master "
+                                         "where type='table'").fetchall()]
+        db.close()
+        return rows, tables
+
+    def test_transfers_are_rolled_up(self):
+        blob_hash = random_lbry_hash()
+        self._insert('download', [(blob_hash, '1.2.3.4', 1.0, 7200),
+                                  (blob_hash, '1.2.3.4', 2.0, 7300)])
+        self._insert('upload', [(blob_hash, '1.2.3.4', 0.5, 3600)])
+        migrate3to4.do_migration(self.db_dir)
+        rows, tables = self._get_history()
+        self.assertEqual([('download', blob_hash, '1.2.3.4', 2, 2, 3.0),
+                          ('upload', blob_hash, '1.2.3.4', 1, 1, 0.5)], rows)
+        self.assertNotIn('download', tables)
+        self.assertNotIn('upload', tables)
+
+    def test_legacy_rows_are_dropped(self):
+        blob_hash = random_lbry_hash()
+        # older versions stored str(blob), the first 16 characters of the hash
+        self._insert('download', [(blob_hash[:16], '1.2.3.4', 1.0, 7200),
+                                  (blob_hash, '1.2.3.4', 1.0, 7200)])
+        migrate3to4.do_migration(self.db_dir)
+        rows, _ = self._get_history()
+        self.assertEqual([('download', blob_hash, '1.2.3.4', 2, 1, 1.0)], rows)
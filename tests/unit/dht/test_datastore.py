@@ -4,6 +4,9 @@
 # the GNU Lesser General Public License Version 3, or any later version.
 # See the COPYING file included in this archive
 
+import os
+import shutil
+import tempfile
 import unittest
 import time
 import datetime
@@ -82,6 +85,48 @@ class DictDataStoreTest(unittest.TestCase):
         self.failIf('val2' in self.ds.getPeersForBlob(h1),  'DataStore failed to delete an expired value! Value %s, publish time %s, current time %s'  % ('val2', str(now - td2), str(now)))
         self.failIf('val3' in self.ds.getPeersForBlob(h2), 'DataStore failed to delete an expired value! Value %s, publish time %s, current time %s'  % ('val3', str(now - td2), str(now)))
         self.failUnless('val4' in self.ds.getPeersForBlob(h2), 'DataStore deleted an unexpired value! Value %s, publish time %s, current time %s'  % ('val4', str(now), str(now)))
+
+    def testReannounceReplacesPeer(self):
+        now = int(time.time())
+        self.ds.addPeerToBlob('key', 'peer1', now - 100, now - 100, 'node1')
+        self.ds.addPeerToBlob('key', 'peer2', now - 50, now - 50, 'node2')
+        self.ds.addPeerToBlob('key', 'peer1', now, now, 'node1')
+        self.assertEqual(['peer2', 'peer1'], self.ds.getPeersForBlob('key'))
+        self.assertEqual(2, self.ds._peerCount)
+        # the entry of the first announcement is outdated and must not expire the peer
+        td = lbrynet.dht.constants.dataExpireTimeout
+        self.assertEqual(1, self.ds.removeExpiredPeers(now - 50 + td + 1))
+        self.assertEqual(['peer1'], self.ds.getPeersForBlob('key'))
+
+    def testExpiredPeersAreNotReturned(self):
+        now = int(time.time())
+        td = lbrynet.dht.constants.dataExpireTimeout
+        self.ds.addPeerToBlob('key', 'peer1', now - td - 1, now - td - 1, 'node1')
+        self.assertFalse(self.ds.hasPeersForBlob('key'))
+        self.assertEqual(1, self.ds.removeExpiredPeers())
+        self.assertEqual([], self.ds.keys())
+
+    def testPeersPerKeyLimit(self):
+        ds = lbrynet.dht.datastore.DictDataStore(maxPeersPerKey=3)
+        now = int(time.time())
+        for i in range(5):
+            ds.addPeerToBlob('key', 'peer%i' % i, now, now, 'node')
+        self.assertEqual(['peer2', 'peer3', 'peer4'], ds.getPeersForBlob('key'))
+
+    def testPeerLimit(self):
+        ds = lbrynet.dht.datastore.DictDataStore(maxPeers=3)
+        now = int(time.time())
+        for i in range(5):
+            ds.addPeerToBlob('key%i' % i, 'peer', now - 10 + i, now - 10 + i, 'node')
+        self.assertEqual(['key2', 'key3', 'key4'], sorted(ds.keys()))
+        self.assertEqual(3, ds._peerCount)
+
+    def testExpiryHeapIsRebuilt(self):
+        now = int(time.time())
+        for i in range(100):
+            self.ds.addPeerToBlob('key', 'peer', now + i, now + i, 'node')
+        self.assertEqual(1, self.ds._peerCount)
+        self.assertLessEqual(len(self.ds._expiryHeap), 2 + lbrynet.dht.constants.k)
             
 #        # First write with fake values
 #        for key, value in self.cases:
@@ -109,11 +154,99 @@ class DictDataStoreTest(unittest.TestCase):
 #        for key, value in self.cases:
 
 
+class SqliteDataStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.db_dir, 'dht_data.db')
+        self.ds = lbrynet.dht.datastore.SqliteDataStore(self.path)
+
+    def tearDown(self):
+        self.ds.close()
+        shutil.rmtree(self.db_dir)
+
+    def _reopen(self, **kwargs):
+        self.ds.close()
+        self.ds = lbrynet.dht.datastore.SqliteDataStore(self.path, **kwargs)
+
+    def testPeersAreReloaded(self):
+        now = int(time.time())
+        td = lbrynet.dht.constants.dataExpireTimeout
+        self.ds.addPeerToBlob('\x00key1', '\x00peer1', now, now, '\x00node1')
+        self.ds.addPeerToBlob('\x00key1', '\x00peer2', now, now, '\x00node2')
+        self.ds.addPeerToBlob('\x00key1', '\x00peer1', now, now, '\x00node1')
+        self.ds.addPeerToBlob('\x00key2', '\x00peer3', now - td - 1, now - td - 1, 'node3')
+        self._reopen()
+        self.assertEqual(['\x00key1'], list(self.ds.keys()))
+        self.assertEqual(1, len(self.ds))
+        self.assertEqual(['\x00peer1', '\x00peer2'],
+                         sorted(self.ds.getPeersForBlob('\x00key1')))
+        self.assertFalse(self.ds.hasPeersForBlob('\x00key2'))
+        self.assertFalse('nodeState' in self.ds)
+
+    def testCacheIsBounded(self):
+        self._reopen(cacheSize=5)
+        now = int(time.time())
+        for i in range(20):
+            self.ds.addPeerToBlob('key%i' % i, 'peer%i' % i, now, now, 'node')
+        self.assertEqual(5, len(self.ds._cache))
+        for i in range(20):
+            self.assertEqual(['peer%i' % i], self.ds.getPeersForBlob('key%i' % i))
+        self.assertEqual(5, len(self.ds._cache))
+
+    def testUnknownKeysAreNotCached(self):
+        self._reopen(cacheSize=5)
+        now = int(time.time())
+        self.ds.addPeerToBlob('key', 'peer', now, now, 'node')
+        for i in range(10):
+            self.assertIsNone(self.ds.getPeersForBlob('unknown%i' % i))
+        self.assertEqual(['key'], self.ds._cache.keys())
+
+    def testKeysAreCounted(self):
+        self._reopen(maxPeers=4, maxPeersPerKey=2, cacheSize=2)
+        now = int(time.time())
+        for i in range(3):
+            self.ds.addPeerToBlob('key%i' % i, 'peer1', now + i, now + i, 'node')
+            self.ds.addPeerToBlob('key%i' % i, 'peer2', now + i, now + i, 'node')
+            self.ds.addPeerToBlob('key%i' % i, 'peer3', now + i, now + i, 'node')
+        # the peer limit removed the peers of key0 after it was pushed out of the cache
+        self.assertEqual(['key1', 'key2'], sorted(self.ds.keys()))
+        self.assertEqual(2, len(self.ds))
+        td = lbrynet.dht.constants.dataExpireTimeout
+        self.assertEqual(2, self.ds.removeExpiredPeers(now + 1 + td + 1))
+        self.assertEqual(['key2'], list(self.ds.keys()))
+        self.assertEqual(1, len(self.ds))
+        self._reopen()
+        self.assertEqual(1, len(self.ds))
+
+    def testPeersPerKeyLimit(self):
+        self._reopen(maxPeersPerKey=3, cacheSize=1)
+        now = int(time.time())
+        for i in range(5):
+            self.ds.addPeerToBlob('key', 'peer%i' % i, now + i, now + i, 'node')
+        self.ds.addPeerToBlob('other key', 'peer', now, now, 'node')
+        self.assertEqual(['peer2', 'peer3', 'peer4'], self.ds.getPeersForBlob('key'))
+
+    def testPeerLimit(self):
+        self._reopen(maxPeers=3)
+        now = int(time.time())
+        for i in range(5):
+            self.ds.addPeerToBlob('key%i' % i, 'peer', now - 10 + i, now - 10 + i, 'node')
+        self.assertEqual(['key2', 'key3', 'key4'], sorted(self.ds.keys()))
+        self.assertIsNone(self.ds.getPeersForBlob('key0'))
+
+    def testRemoveExpiredPeers(self):
+        now = int(time.time())
+        td = lbrynet.dht.constants.dataExpireTimeout
+        self.ds.addPeerToBlob('key', 'peer1', now - 100, now - 100, 'node')
+        self.ds.addPeerToBlob('key', 'peer2', now, now, 'node')
+        self.assertEqual(1, self.ds.removeExpiredPeers(now - 50 + td))
+        self.assertEqual(['peer2'], self.ds.getPeersForBlob('key'))
 
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(DictDataStoreTest))
+    suite.addTest(unittest.makeSuite(SqliteDataStoreTest))
     return suite
 
 
@@ -37,6 +37,20 @@ class BencodeTest(unittest.TestCase):
         for encodedValue in self.badDecoderCases:
             self.failUnlessRaises(lbrynet.dht.encoding.DecodeError, self.encoding.decode, encodedValue)
 
+    def testNestedDict(self):
+        value = {'args': ['key', {'port': 3333, 'token': 'abc'}, 'node', 0], 'n': None}
+        encoded = self.encoding.encode(value)
+        self.assertEqual('d4:argsl3:keyd4:porti3333e5:token3:abce4:nodei0ee1:nne', encoded)
+        self.assertEqual(value, self.encoding.decode(encoded))
+
+    def testFloat(self):
+        self.assertEqual('f1.500000e', self.encoding.encode(1.5))
+        self.assertEqual([1.5, 2], self.encoding.decode('lf1.500000ei2ee'))
+
+    def testTruncatedData(self):
+        for encodedValue in ('10:abc', 'i42', 'l3:abcf1.5'):
+            self.assertRaises(lbrynet.dht.encoding.DecodeError, self.encoding.decode, encodedValue)
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(BencodeTest))
@@ -0,0 +1,342 @@
+import os
+import random
+import shutil
+import tempfile
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from lbrynet.dht import constants, msgtypes
+from lbrynet.dht.contact import Contact
+from lbrynet.dht.node import Distance, Node, _IterativeFindHelper
+from lbrynet.dht.protocol import TimeoutError
+
+
+class FakeProtocol(object):
+    """ Answers pings from the contacts on the live ports """
+
+    def __init__(self, live_ports):
+        self.live_ports = live_ports
+        self.pinged = []
+
+    def sendRPC(self, contact, method, args, rawResponse=False):
+        self.pinged.append(contact.port)
+        if contact.port in self.live_ports:
+            return defer.succeed('pong')
+        return defer.fail(TimeoutError(contact.id))
+
+
+class ContactsSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, 'dht_contacts.json')
+        self.nodes = []
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.stop()
+
+    def _make_node(self, protocol=None):
+        node = Node(udpPort=None, networkProtocol=protocol, contactsSnapshotPath=self.path)
+        self.nodes.append(node)
+        return node
+
+    def _save_contacts(self, ports):
+        node = self._make_node()
+        for port in ports:
+            node.addContact(Contact(node._generateID(), '127.0.0.1', port, None, port))
+        node._saveContactsSnapshot()
+        return node
+
+    def test_save_and_load(self):
+        saved = self._save_contacts([4001, 4002, 4003])
+        node = self._make_node()
+        loaded = node._loadContactsSnapshot()
+        self.assertEqual([4003, 4002, 4001], [c.port for c in loaded])
+        for contact in loaded:
+            self.assertEqual(contact, saved._routingTable.getContact(contact.id))
+            self.assertEqual('127.0.0.1', contact.address)
+
+    def test_unreadable_snapshot(self):
+        with open(self.path, 'w') as snapshot_file:
+            snapshot_file.write('[{"id": ')
+        self.assertEqual([], self._make_node()._loadContactsSnapshot())
+
+    @defer.inlineCallbacks
+    def test_ping_contacts(self):
+        self._save_contacts(range(4001, 4011))
+        node = self._make_node(FakeProtocol([4002, 4005]))
+        live = yield node._pingContacts(node._loadContactsSnapshot())
+        self.assertEqual([4005, 4002], [c.port for c in live])
+
+    @defer.inlineCallbacks
+    def test_ping_stops_waiting_after_k_responses(self):
+        ports = range(4001, 4001 + 2 * constants.k)
+        self._save_contacts(ports)
+        node = self._make_node(FakeProtocol(ports))
+        live = yield node._pingContacts(node._loadContactsSnapshot())
+        self.assertEqual(constants.k, len(live))
+
+    def test_join_falls_back_to_known_nodes(self):
+        self._save_contacts([4001, 4002])
+        node = self._make_node(FakeProtocol([]))
+        shortlists = []
+        node._iterativeFind = lambda key, shortlist=None: shortlists.append(shortlist)
+        node.joinNetwork([('127.0.0.1', 5000)])
+        self.assertEqual(1, len(shortlists))
+        self.assertEqual([5000], [c.port for c in shortlists[0]])
+        self.assertEqual([4002, 4001], node._protocol.pinged)
+
+    def test_join_uses_live_contacts(self):
+        self._save_contacts([4001, 4002])
+        node = self._make_node(FakeProtocol([4001]))
+        shortlists = []
+        node._iterativeFind = lambda key, shortlist=None: shortlists.append(shortlist)
+        node.joinNetwork([('127.0.0.1', 5000)])
+        # the routing table is searched, responding contacts are added to it
+        self.assertEqual([None], shortlists)
+
+
+class StoreTest(unittest.TestCase):
+    def setUp(self):
+        self.node = Node(udpPort=None)
+        self.sender = Contact(self.node._generateID(), '10.0.0.1', 4444, None)
+        self.value = {'port': 3333, 'lbryid': self.node._generateID()}
+
+    def tearDown(self):
+        self.node.stop()
+
+    def _store(self, token, *args):
+        value = dict(self.value, token=token)
+        return self.node.store('key', value, self.sender.id, *args,
+                               _rpcNodeID=self.sender.id, _rpcNodeContact=self.sender)
+
+    def test_store_with_token(self):
+        token = self.node.make_token(self.sender.compact_ip())
+        self.assertEqual('OK', self._store(token, 0))
+        self.assertTrue(self.node._dataStore.hasPeersForBlob('key'))
+
+    def test_remote_self_store_needs_token(self):
+        self.assertRaises(ValueError, self._store, 'bad token', 0)
+        self.assertRaises(ValueError, self._store, 'bad token', 1)
+
+
+class FakeNetwork(object):
+    """ Answers lookup RPCs for a network of nodes that all know each other """
+
+    def __init__(self, clock, num_nodes, latency=0.01):
+        self.clock = clock
+        self.latency = latency
+        rand = random.Random(0)
+        self.ids = [''.join(chr(rand.randrange(256)) for _ in range(constants.key_bits / 8))
+                    for _ in range(num_nodes)]
+        self.dead = set()
+        self.slow = {}
+        self.values = {}
+        self.probed = []
+
+    def contact(self, node_id):
+        return Contact(node_id, '10.0.0.%i' % self.ids.index(node_id), 4444, self)
+
+    def closest(self, key, count=constants.k):
+        return sorted(self.ids, key=Distance(key))[:count]
+
+    def sendRPC(self, contact, method, args, rawResponse=False):
+        self.probed.append(contact.id)
+        d = defer.Deferred()
+        if contact.id in self.dead:
+            self.clock.callLater(constants.rpcTimeout, d.errback, TimeoutError(contact.id))
+            return d
+        key = args[0]
+        contacts = [(node_id, '10.0.0.%i' % self.ids.index(node_id), 4444)
+                    for node_id in self.closest(key)]
+        if method == 'findValue':
+            if contact.id in self.values.get(key, []):
+                response = {key: ['peer']}
+            else:
+                response = {'contacts': contacts}
+        else:
+            response = contacts
+        msg = msgtypes.ResponseMessage('rpc id', contact.id, response)
+        self.clock.callLater(self.slow.get(contact.id, self.latency), d.callback,
+                             (msg, (contact.address, contact.port)))
+        return d
+
+
+class IterativeFindTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.network = FakeNetwork(self.clock, 50)
+        self.node = Node(udpPort=None, networkProtocol=self.network)
+        self.key = self.network.ids[0][::-1]
+
+    def tearDown(self):
+        self.node.stop()
+
+    def _find(self, shortlist, find_value=False):
+        results = []
+        d = defer.Deferred()
+        d.addCallback(results.append)
+        helper = _IterativeFindHelper(self.node, d, shortlist, self.key, find_value,
+                                      'findValue' if find_value else 'findNode',
+                                      clock=self.clock)
+        helper.start()
+        return results, helper
+
+    def _furthest_contacts(self, count=constants.alpha):
+        return [self.network.contact(node_id)
+                for node_id in self.network.closest(self.key, 50)[-count:]]
+
+    def test_find_node(self):
+        results, helper = self._find(self._furthest_contacts())
+        self.clock.pump([0.01] * 100)
+        self.assertEqual(self.network.closest(self.key), [c.id for c in results[0]])
+        # the lookup stops once the k closest nodes responded, without asking every node
+        self.assertLess(len(self.network.probed), 50)
+        self.assertEqual(len(set(self.network.probed)), len(self.network.probed))
+        stats = self.node.getLookupStats()
+        self.assertEqual(1, stats['lookups'])
+        self.assertEqual({2: 1}, stats['hops'])
+        self.assertAlmostEqual(10, stats['rtt_ms'])
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_find_value(self):
+        self.network.values[self.key] = self.network.closest(self.key)[3:4]
+        results, helper = self._find(self._furthest_contacts(), find_value=True)
+        self.clock.pump([0.01] * 100)
+        self.assertEqual(['peer'], results[0][self.key])
+        self.assertEqual('10.0.0.%i' % self.network.ids.index(self.network.values[self.key][0]),
+                         results[0]['from_peer'])
+
+    def test_timeouts(self):
+        closest = self.network.closest(self.key)
+        self.network.dead.update(closest[:2])
+        results, helper = self._find(self._furthest_contacts())
+        self.clock.pump([0.01] * 100)
+        # the lookup doesn't wait for the dead nodes to time out
+        found = [c.id for c in results[0]]
+        self.assertEqual(constants.k, len(found))
+        self.assertEqual(closest[2:], found[:constants.k - 2])
+        self.assertEqual(0, self.node.getLookupStats()['timeouts'])
+        concurrency = helper.concurrency
+        self.clock.advance(constants.rpcTimeout)
+        self.assertEqual(2, self.node.getLookupStats()['timeouts'])
+        self.assertEqual(max(1.0, concurrency / 4), helper.concurrency)
+
+    def test_slow_probes_do_not_block_the_lookup(self):
+        contacts = self._furthest_contacts(constants.alpha + 1)
+        for contact in contacts[:constants.alpha]:
+            self.network.slow[contact.id] = constants.rpcTimeout - 1
+        results, helper = self._find(contacts)
+        self.assertEqual([c.id for c in contacts[:constants.alpha]], self.network.probed)
+        # before a round trip time was measured, probes count as in flight for a while
+        self.clock.advance(constants.iterativeLookupDelay - 0.01)
+        self.assertEqual(constants.alpha, len(self.network.probed))
+        self.clock.advance(0.01)
+        self.assertEqual(contacts[constants.alpha].id, self.network.probed[-1])
+        self.clock.pump([0.01] * 100)
+        self.assertEqual(self.network.closest(self.key), [c.id for c in results[0]])
+
+
+class StoreManyTest(unittest.TestCase):
+    def setUp(self):
+        self.node = Node(udpPort=None)
+        self.sender = Contact(self.node._generateID(), '10.0.0.1', 4444, None)
+        self.value = {'port': 3333, 'lbryid': self.node._generateID(),
+                      'token': self.node.make_token(self.sender.compact_ip())}
+
+    def tearDown(self):
+        self.node.stop()
+
+    def _store_many(self, keys, value):
+        return self.node.storeMany(keys, value, self.sender.id, 0,
+                                   _rpcNodeID=self.sender.id, _rpcNodeContact=self.sender)
+
+    def test_store_many(self):
+        self.assertEqual('OK', self._store_many(['key1', 'key2'], self.value))
+        self.assertTrue(self.node._dataStore.hasPeersForBlob('key1'))
+        self.assertTrue(self.node._dataStore.hasPeersForBlob('key2'))
+
+    def test_invalid_store_many(self):
+        self.assertRaises(ValueError, self._store_many, ['key1'], dict(self.value, token='bad'))
+        self.assertRaises(ValueError, self._store_many,
+                          ['key'] * (constants.maxKeysPerStore + 1), self.value)
+        self.assertRaises(ValueError, self._store_many, 'key1', self.value)
+        self.assertFalse(self.node._dataStore.hasPeersForBlob('key1'))
+
+
+class FakeStoreProtocol(object):
+    """ Answers findValue and stores, old nodes don't know about storeMany """
+
+    def __init__(self, old_ports):
+        self.old_ports = old_ports
+        self.calls = []
+
+    def sendRPC(self, contact, method, args, rawResponse=False):
+        self.calls.append((contact.port, method, args))
+        if method == 'findValue':
+            return defer.succeed({'contacts': [], 'token': 'token'})
+        if method == 'storeMany' and contact.port in self.old_ports:
+            return defer.fail(Exception('Invalid method: storeMany'))
+        return defer.succeed('OK')
+
+
+class AnnounceHaveBlobsTest(unittest.TestCase):
+    def setUp(self):
+        self.protocol = FakeStoreProtocol(old_ports=[4000])
+        self.node = Node(udpPort=None, networkProtocol=self.protocol, lbryid='lbryid')
+        self.contacts = [Contact(self.node._generateID(), '10.0.0.1', 4000 + i, self.protocol)
+                         for i in range(constants.k)]
+        self.lookups = []
+        self.node.iterativeFindNode = self._find_node
+
+    def tearDown(self):
+        self.node.stop()
+
+    def _find_node(self, key):
+        self.lookups.append(key)
+        return defer.succeed(sorted(self.contacts, key=Distance(key).to_contact)[:constants.k])
+
+    @defer.inlineCallbacks
+    def test_neighboring_keys_share_a_lookup(self):
+        prefix = self.node._generateID()[:-2]
+        keys = [prefix + chr(i) + chr(j) for i in range(2) for j in range(100)]
+        stored = yield self.node.announceHaveBlobs(keys, 3333)
+        self.assertEqual(1, len(self.lookups))
+        self.assertEqual(dict.fromkeys(keys, constants.k), stored)
+        store_many = [args for port, method, args in self.protocol.calls
+                      if method == 'storeMany' and port == 4001]
+        self.assertEqual([constants.maxKeysPerStore, 200 - constants.maxKeysPerStore],
+                         [len(args[0]) for args in store_many])
+        self.assertEqual('token', store_many[0][1]['token'])
+        # the node without storeMany gets a store for each key
+        old_node_calls = [method for port, method, args in self.protocol.calls
+                          if port == 4000]
+        self.assertEqual(['findValue', 'storeMany'] + ['store'] * 200, old_node_calls)
+
+    @defer.inlineCallbacks
+    def test_failed_lookup_is_not_reused(self):
+        prefix = self.node._generateID()[:-1]
+        keys = [prefix + chr(i) for i in range(3)]
+        contacts, self.contacts = self.contacts, []
+
+        def find_node(key):
+            # the first lookup finds no contacts, the following ones do
+            d = self._find_node(key)
+            self.contacts = contacts
+            return d
+
+        self.node.iterativeFindNode = find_node
+        stored = yield self.node.announceHaveBlobs(keys, 3333)
+        self.assertEqual(keys[:2], self.lookups)
+        self.assertEqual({keys[0]: 0, keys[1]: constants.k, keys[2]: constants.k}, stored)
+
+    @defer.inlineCallbacks
+    def test_distant_keys_are_looked_up(self):
+        # the k closest contacts to each key are much closer to it than to the other keys
+        self.contacts = [Contact(chr(4 * i) + self.node._generateID()[1:], '10.0.0.1', 5000 + i,
+                                 self.protocol) for i in range(64)]
+        keys = [chr(50 * i) + self.node._generateID()[1:] for i in range(5)]
+        yield self.node.announceHaveBlobs(keys, 3333)
+        self.assertEqual(sorted(keys), self.lookups)
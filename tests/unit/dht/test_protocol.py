@@ -0,0 +1,141 @@
+import time
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from lbrynet.dht import msgtypes
+from lbrynet.dht.node import Node
+from lbrynet.dht.protocol import PartialMessages, SendQueue
+
+
+class PartialMessagesTest(unittest.TestCase):
+    def setUp(self):
+        self.messages = PartialMessages(ttl=10, maxBytes=100, maxPerSource=2)
+
+    def test_reassembly(self):
+        address = ('10.0.0.1', 4444)
+        self.assertIsNone(self.messages.add('msg', address, 3, 2, 'ghi'))
+        self.assertIsNone(self.messages.add('msg', address, 3, 0, 'abc'))
+        # repeated fragments are ignored
+        self.assertIsNone(self.messages.add('msg', address, 3, 0, 'abc'))
+        self.assertEqual(6, self.messages.bytes)
+        self.assertEqual('abcdefghi', self.messages.add('msg', address, 3, 1, 'def'))
+        self.assertEqual(0, len(self.messages))
+        self.assertEqual(0, self.messages.bytes)
+        self.assertEqual(1, self.messages.stats['completed'])
+
+    def test_fragments_from_another_address_are_ignored(self):
+        self.messages.add('msg', ('10.0.0.1', 4444), 2, 0, 'abc')
+        self.assertIsNone(self.messages.add('msg', ('10.0.0.2', 4444), 2, 1, 'def'))
+        self.assertIsNone(self.messages.add('msg', ('10.0.0.1', 4444), 2, 2, 'def'))
+        self.assertEqual(2, self.messages.stats['invalid_fragments'])
+        self.assertEqual(1, self.messages.fragmentCount('msg'))
+
+    def test_expire(self):
+        self.messages.add('msg1', ('10.0.0.1', 4444), 2, 0, 'abc')
+        self.messages.expire(time.time() + 5)
+        self.assertIn('msg1', self.messages)
+        self.messages.expire(time.time() + 11)
+        self.assertNotIn('msg1', self.messages)
+        self.assertEqual(0, self.messages.bytes)
+        self.assertEqual(1, self.messages.stats['expired'])
+
+    def test_per_source_limit(self):
+        for i in range(3):
+            self.messages.add('msg%i' % i, ('10.0.0.1', 4000 + i), 2, 0, 'abc')
+        self.messages.add('msg3', ('10.0.0.2', 4444), 2, 0, 'abc')
+        self.assertEqual(['msg0', 'msg1', 'msg3'], sorted(self.messages._messages))
+        self.assertEqual(1, self.messages.stats['dropped'])
+
+    def test_byte_limit(self):
+        self.messages.add('msg1', ('10.0.0.1', 4444), 2, 0, 'a' * 60)
+        self.messages.add('msg2', ('10.0.0.2', 4444), 2, 0, 'b' * 30)
+        self.messages.add('msg2', ('10.0.0.2', 4444), 3, 1, 'b' * 30)
+        self.messages.add('msg3', ('10.0.0.3', 4444), 2, 0, 'c' * 30)
+        # the oldest message is dropped
+        self.assertEqual(['msg2', 'msg3'], sorted(self.messages._messages))
+        self.assertEqual(60, self.messages.bytes)
+        self.assertEqual({'completed': 0, 'expired': 0, 'dropped': 1, 'invalid_fragments': 1,
+                          'in_progress': 2, 'bytes': 60}, self.messages.getStats())
+
+
+class SendQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.sent = []
+        self.queue = SendQueue(lambda data, address: self.sent.append(data),
+                               packetsPerSecond=100, bytesPerSecond=10000, clock=self.clock)
+
+    def test_sends_on_next_tick(self):
+        self.queue.put('ping', ('10.0.0.1', 4444), SendQueue.PRIORITY_REQUEST)
+        self.queue.put('pong', ('10.0.0.1', 4444), SendQueue.PRIORITY_REQUEST)
+        self.assertEqual([], self.sent)
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.clock.advance(0)
+        self.assertEqual(['ping', 'pong'], self.sent)
+        self.assertEqual(0, len(self.queue))
+
+    def test_responses_are_sent_first(self):
+        self.queue.put('request', ('10.0.0.1', 4444), SendQueue.PRIORITY_REQUEST)
+        self.queue.put('response', ('10.0.0.1', 4444), SendQueue.PRIORITY_RESPONSE)
+        self.clock.advance(0)
+        self.assertEqual(['response', 'request'], self.sent)
+
+    def test_packet_rate_limit(self):
+        # the bucket holds 10 packets, then 1 packet is sent every 10ms
+        for i in range(15):
+            self.queue.put(str(i), ('10.0.0.1', 4444), SendQueue.PRIORITY_REQUEST)
+        self.clock.advance(0)
+        self.assertEqual(10, len(self.sent))
+        self.assertEqual({'queued_responses': 0, 'queued_requests': 5, 'packets_sent': 10,
+                          'bytes_sent': 10, 'packets_dropped': 0, 'avg_latency_ms': 0.0,
+                          'max_latency_ms': 0.0}, self.queue.getStats())
+        self.clock.advance(0.01)
+        self.assertEqual(11, len(self.sent))
+        self.clock.advance(0.04)
+        self.assertEqual(15, len(self.sent))
+        self.assertAlmostEqual(50, self.queue.getStats()['max_latency_ms'])
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_byte_rate_limit(self):
+        # the bucket holds a full size datagram, refilling at 10 bytes per ms
+        for _ in range(3):
+            self.queue.put('x' * 4000, ('10.0.0.1', 4444), SendQueue.PRIORITY_REQUEST)
+        self.clock.advance(0)
+        self.assertEqual(2, len(self.sent))
+        self.clock.advance(0.38)
+        self.assertEqual(2, len(self.sent))
+        self.clock.advance(0.001)
+        self.assertEqual(3, len(self.sent))
+
+    def test_stop(self):
+        self.queue.put('ping', ('10.0.0.1', 4444), SendQueue.PRIORITY_REQUEST)
+        self.queue.stop()
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.assertEqual(1, self.queue.getStats()['packets_dropped'])
+
+
+class MultiPacketMessageTest(unittest.TestCase):
+    def setUp(self):
+        self.sender = Node(udpPort=None)
+        self.receiver = Node(udpPort=None)
+        self.packets = []
+        self.sender._protocol._sendQueue.put = \
+            lambda data, address, priority: self.packets.append(data)
+        self.receiver._protocol._send = lambda data, rpcID, address, priority=None: None
+
+    def tearDown(self):
+        self.sender.stop()
+        self.receiver.stop()
+
+    def test_multi_packet_request(self):
+        protocol = self.sender._protocol
+        msg = msgtypes.RequestMessage(self.sender.id, 'findNode', ['k' * 20000])
+        encoded = protocol._encoder.encode(protocol._translator.toPrimitive(msg))
+        protocol._send(encoded, msg.id, ('127.0.0.1', 4444))
+        self.assertEqual(3, len(self.packets))
+        for packet in reversed(self.packets):
+            self.receiver._protocol.datagramReceived(packet, ('10.0.0.1', 4444))
+        self.assertEqual(self.sender.id,
+                         self.receiver._routingTable.getContact(self.sender.id).id)
+        self.assertEqual(1, self.receiver._protocol.getPartialMessageStats()['completed'])
@@ -1,3 +1,4 @@
+import random
 import unittest
 
 from lbrynet.dht import contact, routingtable, constants
@@ -57,3 +58,52 @@ class KeyErrorFixedTest(unittest.TestCase):
         #     print "Replacement Cache for Bucket " + str(key)
         #     for c in bucket:
         #         print "  contact " + str(c.id)
+
+
+class BisectRoutingTableTest(unittest.TestCase):
+    def setUp(self):
+        self.rand = random.Random(0)
+        self.own_id = self._random_id()
+        self.table = routingtable.BisectRoutingTable(self.own_id)
+        self.contacts = []
+        for _ in range(500):
+            c = contact.Contact(self._random_id(), '127.0.0.1', 9999, None)
+            self.table.addContact(c)
+            self.contacts.append(c)
+
+    def _random_id(self):
+        return ''.join(chr(self.rand.randrange(256)) for _ in range(constants.key_bits / 8))
+
+    def _distance(self, key, contact_id):
+        return long(key.encode('hex'), 16) ^ long(contact_id.encode('hex'), 16)
+
+    def test_bucket_index(self):
+        self.assertGreater(len(self.table._buckets), 1)
+        for c in self.contacts:
+            index = self.table._kbucketIndex(c.id)
+            self.assertTrue(self.table._buckets[index].keyInRange(c.id))
+        self.assertEqual(0, self.table._kbucketIndex(0))
+        self.assertEqual(len(self.table._buckets) - 1,
+                         self.table._kbucketIndex(2 ** constants.key_bits - 1))
+
+    def test_get_contact(self):
+        known = [c for bucket in self.table._buckets for c in bucket._contacts]
+        self.assertTrue(known)
+        for c in known:
+            self.assertIs(c, self.table.getContact(c.id))
+
+    def test_find_close_nodes(self):
+        in_table = [c for bucket in self.table._buckets for c in bucket._contacts]
+        for _ in range(50):
+            key = self._random_id()
+            distance = lambda c: self._distance(key, c.id)
+            expected = sorted(in_table, key=distance)[:constants.k]
+            found = self.table.findCloseNodes(key, constants.k)
+            self.assertEqual(expected, sorted(found, key=distance))
+
+    def test_find_close_nodes_excludes_sender(self):
+        in_table = [c for bucket in self.table._buckets for c in bucket._contacts]
+        sender = in_table[0]
+        found = self.table.findCloseNodes(sender.id, constants.k, sender.id)
+        self.assertNotIn(sender, found)
+        self.assertEqual(constants.k, len(found))
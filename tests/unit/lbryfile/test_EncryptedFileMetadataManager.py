@@ -27,7 +27,7 @@ class DBEncryptedFileMetadataManagerTest(unittest.TestCase):
         key = 'key'
         suggested_file_name = 'sug_file_name'
         blob1 = CryptBlobInfo(random_lbry_hash(),0,10,1)
-        blob2 = CryptBlobInfo(random_lbry_hash(),0,10,1)
+        blob2 = CryptBlobInfo(random_lbry_hash(),1,10,1)
         blobs=[blob1,blob2]
 
         # save stream
@@ -48,12 +48,19 @@ class DBEncryptedFileMetadataManagerTest(unittest.TestCase):
         self.assertEqual(1, len(out))
 
         # add a blob to stream
-        blob3 = CryptBlobInfo(random_lbry_hash(),0,10,1)
+        blob3 = CryptBlobInfo(random_lbry_hash(),2,10,1)
         blobs = [blob3]
         out = yield self.manager.add_blobs_to_stream(stream_hash,blobs)
         out = yield self.manager.get_blobs_for_stream(stream_hash)
         self.assertEqual(3, len(out))
 
+        # adding blobs again doesn't duplicate them
+        yield self.manager.add_blobs_to_stream(stream_hash, [blob2, blob3])
+        out = yield self.manager.get_blobs_for_stream(stream_hash)
+        self.assertEqual(3, len(out))
+        out = yield self.manager.get_blobs_for_stream(stream_hash, start_blob=blob2.blob_hash)
+        self.assertEqual([blob3.blob_hash], [blob_info[0] for blob_info in out])
+
         out = yield self.manager.get_stream_of_blob(blob3.blob_hash)
         self.assertEqual(stream_hash, out)
 